@@ -0,0 +1,4 @@
+# Приложение Celery загружается вместе с Django, чтобы задачи @shared_task использовали его
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
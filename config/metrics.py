@@ -0,0 +1,177 @@
+import ipaddress
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.db import connections
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client import multiprocess
+
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Метрики запросов по имени URL (namespace:name) и HTTP-методу.
+# Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR, prometheus_client пишет значения
+# в общие файлы этого каталога, и /metrics собирает их со всех воркеров gunicorn
+REQUEST_LATENCY = Histogram(
+    'diary_http_request_duration_seconds',
+    'Время обработки запроса',
+    ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_COUNT = Counter(
+    'diary_http_requests',
+    'Количество запросов',
+    ['view', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'diary_http_db_queries',
+    'Количество SQL-запросов на один запрос',
+    ['view', 'method'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_LATENCY = Histogram(
+    'diary_http_db_duration_seconds',
+    'Суммарное время SQL-запросов на один запрос',
+    ['view', 'method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+TEMPLATE_LATENCY = Histogram(
+    'diary_http_template_duration_seconds',
+    'Время рендеринга шаблона ответа',
+    ['view', 'method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+# Пул соединений с базой (DB_POOL): состояние - сумма по живым воркерам,
+# счетчики - приращения статистики psycopg_pool с прошлой публикации. Каждый воркер публикует
+# статистику своего пула не чаще DB_POOL_METRICS_INTERVAL секунд (см. observe_db_pools_periodically)
+DB_POOL_GAUGES = {
+    'pool_max': Gauge('diary_db_pool_max_size', 'Максимальный размер пула', ['database'],
+                      multiprocess_mode='livesum'),
+    'pool_size': Gauge('diary_db_pool_size', 'Открытые соединения пула', ['database'],
+                       multiprocess_mode='livesum'),
+    'pool_available': Gauge('diary_db_pool_available', 'Свободные соединения пула', ['database'],
+                            multiprocess_mode='livesum'),
+    'requests_waiting': Gauge('diary_db_pool_requests_waiting', 'Запросы, ожидающие соединения', ['database'],
+                              multiprocess_mode='livesum'),
+}
+DB_POOL_COUNTERS = {
+    'requests_num': Counter('diary_db_pool_requests', 'Выдачи соединений из пула', ['database']),
+    'requests_queued': Counter('diary_db_pool_requests_queued', 'Выдачи с ожиданием свободного соединения',
+                               ['database']),
+    'requests_errors': Counter('diary_db_pool_requests_errors', 'Выдачи с ошибкой (истек DB_POOL_TIMEOUT)',
+                               ['database']),
+    'connections_num': Counter('diary_db_pool_connections', 'Открытые пулом соединения с PostgreSQL',
+                               ['database']),
+    'connections_errors': Counter('diary_db_pool_connections_errors', 'Ошибки открытия соединений',
+                                  ['database']),
+    'connections_lost': Counter('diary_db_pool_connections_lost', 'Соединения, не прошедшие проверку',
+                                ['database']),
+}
+DB_POOL_TIMERS = {
+    'requests_wait_ms': Counter('diary_db_pool_requests_wait_seconds', 'Суммарное ожидание соединения',
+                                ['database']),
+    'connections_ms': Counter('diary_db_pool_connections_seconds', 'Суммарное время открытия соединений',
+                              ['database']),
+}
+
+# Кеш фрагментов записей (diary.fragments): попадания и промахи по имени фрагмента
+FRAGMENT_CACHE_REQUESTS = Counter(
+    'diary_fragment_cache_requests',
+    'Обращения к кешу фрагментов записей',
+    ['fragment', 'result'],
+)
+
+
+def observe_request(view, method, status, total, queries, db_time, template_time=None):
+    """ Записывает измерения одного запроса в метрики (время - в секундах) """
+    REQUEST_LATENCY.labels(view, method).observe(total)
+    REQUEST_COUNT.labels(view, method, str(status)).inc()
+    DB_QUERIES.labels(view, method).observe(queries)
+    DB_LATENCY.labels(view, method).observe(db_time)
+    if template_time is not None:
+        TEMPLATE_LATENCY.labels(view, method).observe(template_time)
+
+
+def observe_db_pools():
+    """ Записывает статистику пулов соединений процесса в метрики. pop_stats() обнуляет
+    счетчики пула, поэтому вызывается не на каждый запрос (см. observe_db_pools_periodically) """
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        if pool is None or pool.closed:
+            continue
+        stats = pool.pop_stats()
+        for key, gauge in DB_POOL_GAUGES.items():
+            gauge.labels(alias).set(stats.get(key, 0))
+        for key, counter in DB_POOL_COUNTERS.items():
+            if stats.get(key):
+                counter.labels(alias).inc(stats[key])
+        for key, counter in DB_POOL_TIMERS.items():
+            if stats.get(key):
+                counter.labels(alias).inc(stats[key] / 1000)
+
+
+_pools_observed_at = 0.0
+_pools_lock = threading.Lock()
+
+
+def observe_db_pools_periodically():
+    """ Публикует статистику пулов процесса, если с прошлой публикации прошло DB_POOL_METRICS_INTERVAL
+    секунд. Вызывается после каждого запроса, поэтому состояние пула обновляется в каждом работающем
+    воркере, а не только в том, который ответил на сбор метрик """
+    global _pools_observed_at
+    now = time.monotonic()
+    with _pools_lock:
+        if now - _pools_observed_at < getattr(settings, 'DB_POOL_METRICS_INTERVAL', 15):
+            return
+        _pools_observed_at = now
+    observe_db_pools()
+
+
+def observe_fragment_cache(fragment, hits, misses):
+    """ Учитывает попадания и промахи кеша фрагментов """
+    if hits:
+        FRAGMENT_CACHE_REQUESTS.labels(fragment, 'hit').inc(hits)
+    if misses:
+        FRAGMENT_CACHE_REQUESTS.labels(fragment, 'miss').inc(misses)
+
+
+def get_registry():
+    """ Реестр для выдачи метрик: в многопроцессном режиме собирается из файлов всех воркеров """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def is_internal_request(request):
+    """ Запрос пришел напрямую (не через nginx, который добавляет X-Forwarded-For)
+    с адреса из METRICS_ALLOWED_NETWORKS """
+    if 'X-Forwarded-For' in request.headers:
+        return False
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    networks = getattr(settings, 'METRICS_ALLOWED_NETWORKS', ['127.0.0.0/8', '::1/128'])
+    return any(address in ipaddress.ip_network(network.strip(), strict=False) for network in networks if network)
+
+
+def metrics_view(request):
+    """ Метрики в текстовом формате Prometheus. Если задан METRICS_AUTH_TOKEN,
+    требуется заголовок Authorization: Bearer <токен>, иначе метрики доступны
+    только внутренним запросам (is_internal_request), остальным отвечаем 404 """
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not is_internal_request(request):
+        raise Http404
+    observe_db_pools()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,158 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.middleware.gzip import GZipMiddleware
+
+from .metrics import observe_db_pools_periodically, observe_request
+
+# Статистика SQL текущего запроса. Контекстная переменная копируется в потоки sync_to_async,
+# поэтому учитываются и запросы асинхронного ORM, и параллельные запросы из пула потоков
+_query_stats = ContextVar('request_query_stats', default=None)
+
+
+class QueryStats:
+    """ Количество SQL-запросов и их суммарное время в рамках одного HTTP-запроса """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, duration):
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+
+
+def record_query(execute, sql, params, many, context):
+    """ Обертка выполнения SQL (execute_wrapper): учитывает запрос в статистике текущего HTTP-запроса """
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(time.perf_counter() - started)
+
+
+def install_query_recorder(sender=None, connection=None, **kwargs):
+    """ Подключает record_query к соединению с базой (при каждом его открытии) """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+for _connection in connections.all(initialized_only=True):
+    install_query_recorder(connection=_connection)
+
+
+class RequestTimingMiddleware:
+    """ Замер запроса: количество и время SQL-запросов, время рендеринга шаблона и общее время.
+    Измерения попадают в метрики Prometheus (/metrics) по имени URL, а в заголовке Server-Timing
+    отдаются персоналу или всем (настройка SERVER_TIMING).
+    Должен стоять первым в MIDDLEWARE, чтобы учитывать работу остальных middleware.
+    Работает и в синхронном (WSGI), и в асинхронном (ASGI) режиме """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        total = time.perf_counter() - started
+
+        self.observe(request, response, total, stats)
+        if self.show_server_timing(request):
+            response['Server-Timing'] = self.server_timing(request, total, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = QueryStats()
+        token = _query_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+        total = time.perf_counter() - started
+
+        self.observe(request, response, total, stats)
+        if self.show_server_timing(request):
+            response['Server-Timing'] = self.server_timing(request, total, stats)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponse рендерится обработчиком сразу после этого метода
+        render_started = time.perf_counter()
+
+        def rendered(response):
+            request._template_render_time = time.perf_counter() - render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def observe(request, response, total, stats):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        template_time = getattr(request, '_template_render_time', None)
+        observe_request(view, request.method, response.status_code, total, stats.count, stats.duration, template_time)
+        observe_db_pools_periodically()
+
+    @staticmethod
+    def show_server_timing(request):
+        """ Нужен ли заголовок Server-Timing. Для режима 'staff' пользователь берется, только если
+        его уже загрузил контроллер: ради заголовка сессия и пользователь не загружаются """
+        mode = getattr(settings, 'SERVER_TIMING', 'staff')
+        if mode == 'all':
+            return True
+        if mode != 'staff':
+            return False
+        user = request.__dict__.get('_cached_user') or request.__dict__.get('_acached_user')
+        return user is not None and user.is_staff
+
+    @staticmethod
+    def server_timing(request, total, stats):
+        """ Значение заголовка Server-Timing (длительности в миллисекундах) """
+        metrics = [f'db;desc="SQL queries: {stats.count}";dur={stats.duration * 1000:.1f}']
+        template_time = getattr(request, '_template_render_time', None)
+        if template_time is not None:
+            metrics.append(f'tpl;desc="Template render";dur={template_time * 1000:.1f}')
+        metrics.append(f'total;desc="Total";dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """ Сжатие gzip текстовых ответов Django (HTML, JSON, CSV, NDJSON), если браузер его поддерживает.
+    Уже сжатые данные (выгрузка .gz, изображения) не сжимаются повторно, а статику
+    nginx отдает из заранее сжатых файлов. Встроенная в Django защита от BREACH
+    (случайная добавка к сжатому ответу) сохраняется """
+    compressible_types = (
+        'text/',
+        'application/json',
+        'application/x-ndjson',
+        'application/javascript',
+        'application/xml',
+    )
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith(self.compressible_types):
+            return response
+        return super().process_response(request, response)
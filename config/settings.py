@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_filters',
     'taggit',
 
@@ -35,6 +36,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.middleware.RequestTimingMiddleware',  # замеры запросов: Server-Timing и метрики /metrics
+    'config.middleware.CompressionMiddleware',  # сжатие gzip HTML и других текстовых ответов
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,6 +59,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'users.context_processors.roles',
             ],
         },
     },
@@ -65,15 +69,39 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv('DB_NAME'),
         'USER': os.getenv('DB_USER'),
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT', default='5432'),
+        # Проверять соединение перед использованием (с пулом - при каждой выдаче из пула)
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Время ожидания установки соединения с PostgreSQL (в секундах)
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
+# Пул соединений psycopg 3: соединения не открываются заново на каждый запрос, а берутся из пула
+# процесса и возвращаются в него. Размер пула - на один процесс (воркер gunicorn или Celery)
+DB_POOL = os.getenv('DB_POOL', 'True') == 'True'
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),  # Соединений, открытых всегда
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),  # Максимум соединений процесса
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),  # Ожидание свободного соединения (в секундах)
+        'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', 300)),  # Закрывать соединения сверх min_size после простоя
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', 1800)),  # Пересоздавать соединения после
+        'reconnect_timeout': float(os.getenv('DB_POOL_RECONNECT_TIMEOUT', 60)),  # Попытки переподключения
+    }
+else:
+    # Без пула: постоянные соединения на CONN_MAX_AGE секунд (0 - новое соединение на каждый запрос)
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 0))
+# Как часто каждый воркер публикует статистику своего пула в метрики /metrics (в секундах)
+DB_POOL_METRICS_INTERVAL = 15
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -108,6 +136,26 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+# Каталог для collectstatic: его раздает nginx (см. nginx/nginx.conf)
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # Загруженные для импорта файлы дневников: каталог вне MEDIA_ROOT, nginx его не раздает
+    'imports': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': os.getenv('DIARY_IMPORTS_ROOT', os.path.join(BASE_DIR, 'imports')),
+            'base_url': None,
+        },
+    },
+    # Имена статики с хешем содержимого и заранее сжатые варианты .gz/.br (config/storage.py)
+    'staticfiles': {
+        'BACKEND': 'config.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -117,6 +165,8 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')  # для EMAIL_BACKEND=...filebased.EmailBackend
 EMAIL_HOST = os.getenv('EMAIL_HOST')
 EMAIL_PORT = os.getenv('EMAIL_PORT')
 EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False') == 'True'  # Отключить TLS (по умолчанию True)
@@ -128,11 +178,147 @@ SERVER_EMAIL = EMAIL_HOST_USER
 
 AUTH_USER_MODEL = 'users.User'
 
+# Пользователь сессии загружается из кеша (users.backends.CachedModelBackend). ModelBackend остается
+# в списке для сессий, созданных до его появления: в них записан путь ModelBackend, и без него в списке
+# все пользователи разлогинились бы после обновления
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Время хранения групп и прав пользователя в кеше (в секундах); 0 - только в пределах запроса.
+# Столько же хранится id группы менеджеров (при 0 он ищется в базе каждый раз).
+# Без Redis сброс кеша не дошел бы до других воркеров, поэтому тогда роли между запросами не кешируются
+USER_ROLES_CACHE_TIMEOUT = 60 * 60 if os.getenv('REDIS_URL') else 0
+# Время хранения строки пользователя в кеше (в секундах); 0 - загружать из базы при каждом запросе.
+# Без Redis кеш у каждого процесса свой и сброс после смены пароля или блокировки не дошел бы
+# до других воркеров, поэтому тогда по умолчанию пользователь не кешируется
+USER_CACHE_TIMEOUT = int(os.getenv('USER_CACHE_TIMEOUT', 5 * 60 if os.getenv('REDIS_URL') else 0))
+
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
 REDIS_URL = os.getenv('REDIS_URL')
 
+# Кеш: Redis, если задан REDIS_URL, иначе локальная память процесса
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Хранилище сессий: 'cached_db' (кеш Redis с записью в базу), 'cache' (только Redis),
+# 'signed_cookies' (данные в подписанной cookie) или 'db'. Без Redis кеш у каждого процесса свой,
+# поэтому по умолчанию сессии тогда хранятся только в базе
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cached_db' if REDIS_URL else 'db')
+SESSION_ENGINE = f'django.contrib.sessions.backends.{SESSION_BACKEND}'
+
 LOCATION = os.getenv('LOCATION')
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND')
+CELERY_BEAT_SCHEDULE = {
+    # Периодическая отправка писем, которые не удалось отправить сразу
+    'send-email-outbox': {
+        'task': 'users.tasks.send_email_outbox',
+        'schedule': 60.0,
+    },
+    # Перенос автосохраненных черновиков записей из кеша в базу
+    'flush-entry-drafts': {
+        'task': 'diary.tasks.flush_entry_drafts',
+        'schedule': 30.0,
+    },
+}
+
+# Очередь исходящих писем: размер пачки, число попыток и базовая задержка повтора (в секундах)
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_DELAY = 60
+# Время (в секундах), на которое воркер забирает пачку писем; после него письма упавшего воркера отправляются снова
+EMAIL_OUTBOX_CLAIM_TIMEOUT = 5 * 60
+
+# Миниатюры аватаров: размеры сторон (px), каталог в MEDIA_ROOT и качество сжатия
+AVATAR_SIZES = (48, 128, 256)
+AVATAR_VARIANTS_DIR = 'avatars/variants'
+AVATAR_QUALITY = 85
+
+# Конфигурации полнотекстового поиска по записям дневника
+DIARY_SEARCH_CONFIGS = ('russian', 'english')
+
+# Пагинация списка записей: 'cursor' (по ключу created_at, id) или 'page' (по номеру страницы)
+DIARY_LIST_PAGINATION = 'cursor'
+# Показывать общее количество записей под списком (требует дополнительного COUNT(*))
+DIARY_LIST_SHOW_TOTAL = False
+
+# Количество строк, на которые разбит общий счетчик записей: создание и удаление записей
+# разных пользователей изменяют разные строки и не ждут блокировку одной строки
+DIARY_ENTRY_COUNTER_SHARDS = 16
+
+# Время хранения настроек дневника в кеше (в секундах); 0 - загружать из базы в каждом запросе.
+# Без Redis сброс кеша после сохранения настроек не дошел бы до других воркеров
+DIARY_SETTINGS_CACHE_TIMEOUT = 60 * 60 if REDIS_URL else 0
+
+# Хранение пользовательских полей записей: 'json' (JSONB-колонка записи)
+# или 'rows' (JSONB-колонка и дополнительно таблица CustomField). В режиме 'json' строки таблицы
+# не обновляются: перед переключением на 'rows' их нужно пересобрать командой sync_custom_fields
+DIARY_CUSTOM_FIELDS_STORAGE = 'json'
+
+# Кеш HTML-фрагментов записей (карточки списка и тела страницы записи). Ключ включает время
+# изменения записи (обновляется и при изменении ее тегов), флаги настроек и версию тегов пользователя
+# (сбрасывается при переименовании и удалении тегов), поэтому фрагменты не удаляются. DIARY_FRAGMENT_CACHE_VERSION
+# увеличивается при изменении шаблонов фрагментов, DIARY_FRAGMENT_CACHE_ALIAS - кеш из CACHES
+DIARY_FRAGMENT_CACHE = True
+DIARY_FRAGMENT_CACHE_ALIAS = 'default'
+DIARY_FRAGMENT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+DIARY_FRAGMENT_CACHE_VERSION = 1
+
+# Версия страниц для ETag списка и просмотра записей: увеличивается при изменении шаблонов,
+# чтобы браузеры не получали 304 со страницей старой версии
+DIARY_ETAG_VERSION = 1
+
+# Цели: период (в днях) для колонки "за последние дни" в списке целей
+# и количество месяцев в прогрессе по цели
+GOAL_RECENT_DAYS = 30
+GOAL_PROGRESS_MONTHS = 12
+
+# Черновики формы записи: задержка автосохранения после ввода (в миллисекундах), максимальная длина
+# текста, время хранения в кеше (в секундах) и количество черновиков, переносимых в базу одной пачкой
+DIARY_DRAFT_AUTOSAVE_DELAY = 2000
+DIARY_DRAFT_MAX_LENGTH = 100_000
+DIARY_DRAFT_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+DIARY_DRAFT_FLUSH_BATCH_SIZE = 500
+# Очередь черновиков в кеше переносит в базу задача Celery из другого процесса, поэтому она работает
+# только с общим кешем (Redis). Без Redis кеш у каждого процесса свой, и черновики пишутся сразу в базу
+DIARY_DRAFT_QUEUE = bool(REDIS_URL)
+
+# Выгрузка дневника: количество записей, читаемых из базы за один раз
+DIARY_EXPORT_CHUNK_SIZE = 2000
+
+# Импорт записей: количество записей файла, сохраняемых одной пачкой (в одной транзакции)
+DIARY_IMPORT_BATCH_SIZE = 1000
+
+# Токен для доступа к /metrics (заголовок Authorization: Bearer <токен>). Если не задан, /metrics
+# отвечает только на прямые запросы (не через nginx) с адресов из METRICS_ALLOWED_NETWORKS, остальным - 404.
+# Для сбора метрик со всех воркеров gunicorn задайте PROMETHEUS_MULTIPROC_DIR (см. gunicorn.conf.py)
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
+METRICS_ALLOWED_NETWORKS = os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',')
+
+# Заголовок Server-Timing с замерами запроса: 'staff' - только персоналу, 'all' - всем (для отладки),
+# 'off' - никому
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'staff')
+
+# Режим сервера: 'wsgi' (gunicorn, синхронные воркеры) или 'asgi' (gunicorn с воркерами uvicorn),
+# см. gunicorn.conf.py. В режиме ASGI главная страница, список и просмотр записей асинхронные
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+DIARY_ASYNC_VIEWS = os.getenv('DIARY_ASYNC_VIEWS', str(SERVER_MODE == 'asgi')) == 'True'
+# Асинхронные контроллеры выполняют независимые запросы параллельно в пуле потоков
+# (у каждого потока свое соединение с базой)
+DIARY_ASYNC_PARALLEL_QUERIES = True
+DIARY_ASYNC_QUERY_THREADS = 4
@@ -0,0 +1,64 @@
+import gzip
+
+import brotli
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ Хранилище статики для collectstatic: имена файлов с хешем содержимого (staticfiles.json)
+    и рядом с каждым текстовым файлом заранее сжатые варианты .gz и .br,
+    которые nginx отдает без сжатия на лету (gzip_static / brotli_static).
+    Пока collectstatic не выполнялся (разработка, тесты), ссылки ведут на исходные файлы """
+    # Ссылки на source map (sourceMappingURL) не переписываются: .map файлы Bootstrap
+    # в проект не входят, а отсутствующий файл прервал бы collectstatic
+    patterns = tuple(
+        (extension, tuple(
+            pattern for pattern in extension_patterns
+            if 'sourceMappingURL' not in (pattern[0] if isinstance(pattern, tuple) else pattern)
+        ))
+        for extension, extension_patterns in ManifestStaticFilesStorage.patterns
+    )
+    compress_extensions = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico')
+    # Файлы меньше этого размера не сжимаются: выигрыш меньше заголовков ответа
+    compress_min_size = 256
+
+    def stored_name(self, name):
+        if not self.hashed_files and not self.manifest_hash:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        # Сжимаются и файлы с хешем, и исходные имена (на них ссылаются сторонние CSS и source map)
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            for compressed_name in self.compress(name):
+                yield name, compressed_name, True
+
+    def compress(self, name):
+        """ Записывает name.gz и name.br, если файл текстовый и сжатие уменьшает размер.
+        Возвращает имена записанных файлов """
+        if not name.endswith(self.compress_extensions) or not self.exists(name):
+            return []
+        with self.open(name) as file:
+            content = file.read()
+        if len(content) < self.compress_min_size:
+            return []
+
+        variants = {
+            # mtime=0: одинаковое содержимое дает одинаковый архив при каждой сборке
+            f'{name}.gz': gzip.compress(content, compresslevel=9, mtime=0),
+            f'{name}.br': brotli.compress(content, quality=11),
+        }
+        written = []
+        for compressed_name, compressed in variants.items():
+            if len(compressed) >= len(content):
+                continue
+            if self.exists(compressed_name):
+                self.delete(compressed_name)
+            self._save(compressed_name, ContentFile(compressed))
+            written.append(compressed_name)
+        return written
@@ -19,10 +19,13 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('diary.urls', namespace='diary')),
     path('users/', include('users.urls', namespace='users')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
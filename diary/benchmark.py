@@ -0,0 +1,396 @@
+import copy
+import http.client
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import django
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection, connections, transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User
+from .models import DiaryEntry, UserTagCount
+from .synthetic import synthetic_users
+
+# Допустимый рост p95 относительно базовой линии (0.25 - на 25%)
+DEFAULT_TOLERANCE = 0.25
+
+
+class Scenario:
+    """ Сценарий замера: запрос к представлению. Запросы с изменением данных
+    выполняются в транзакции с откатом, чтобы повторы не меняли базу """
+
+    def __init__(self, name, path, method='get', data=None, rollback=False):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data or {}
+        self.rollback = rollback
+
+    def request(self, client):
+        if not self.rollback:
+            return getattr(client, self.method)(self.path, self.data)
+        with transaction.atomic():
+            response = getattr(client, self.method)(self.path, self.data)
+            transaction.set_rollback(True)
+        return response
+
+
+def find_benchmark_user(value=None):
+    """ Пользователь для замеров: по id или email, по умолчанию - сгенерированный
+    пользователь с наибольшим числом записей """
+    if value:
+        lookup = {'pk': value} if str(value).isdigit() else {'email': value}
+        user = User.objects.filter(**lookup).first()
+    else:
+        user = synthetic_users().annotate(entries=Count('diary_entries')).order_by('-entries').first()
+    if user is None:
+        raise ValueError('Пользователь не найден. Сгенерируйте данные командой generate_diary_data')
+    return user
+
+
+def build_scenarios(user):
+    """ Сценарии для горячих путей дневника на данных пользователя """
+    entry = DiaryEntry.objects.filter(user=user).order_by('-created_at', '-id').first()
+    if entry is None:
+        raise ValueError(f'У пользователя {user.email} нет записей для замеров')
+    popular_tag = UserTagCount.objects.filter(user=user).order_by('-entry_count').values_list('tag__name', flat=True)
+    word = entry.text.split()[0].strip('.').lower()
+    entry_data = {'text': 'Замер производительности', 'targets': 'Цель', 'tags': 'замер'}
+
+    scenarios = [
+        Scenario('home', reverse('diary:home')),
+        Scenario('list', reverse('diary:entry_list')),
+        Scenario('list_search', reverse('diary:entry_list') + f'?q={word}'),
+        Scenario('detail', reverse('diary:entry_detail', kwargs={'pk': entry.pk})),
+        Scenario('create_form', reverse('diary:entry_create')),
+        Scenario('create', reverse('diary:entry_create'), method='post', data=entry_data, rollback=True),
+        Scenario('update_form', reverse('diary:entry_update', kwargs={'pk': entry.pk})),
+        Scenario('update', reverse('diary:entry_update', kwargs={'pk': entry.pk}), method='post',
+                 data=entry_data, rollback=True),
+    ]
+    if popular_tag:
+        scenarios.insert(3, Scenario('list_tag', reverse('diary:entry_list') + f'?tag={popular_tag[0]}'))
+    return scenarios
+
+
+def percentile(values, percent):
+    """ Перцентиль методом ближайшего ранга """
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def measure(client, scenario, iterations, warmup=2):
+    """ Замер сценария: задержки (мс) и количество SQL-запросов последнего повтора """
+    for _ in range(warmup):
+        scenario.request(client)
+
+    timings = []
+    queries = 0
+    status = None
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = scenario.request(client)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(context.captured_queries)
+        status = response.status_code
+    return {
+        'status': status,
+        'queries': queries,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'mean_ms': round(sum(timings) / len(timings), 2),
+    }
+
+
+def run_benchmark(user, iterations=50, warmup=2, only=None):
+    """ Выполняет все сценарии от имени пользователя. Возвращает результаты в формате базовой линии """
+    client = Client()
+    client.force_login(user)
+    results = {}
+    for scenario in build_scenarios(user):
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = measure(client, scenario, iterations, warmup)
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'user': user.email,
+            'entries': DiaryEntry.objects.filter(user=user).count(),
+            'iterations': iterations,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+        },
+        'scenarios': results,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Сравнивает результаты с базовой линией. Регрессия - больше SQL-запросов
+    или p95 выше базового более чем на tolerance. Возвращает список описаний регрессий """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: SQL-запросов {current["queries"]} (было {previous["queries"]})')
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {current["p95_ms"]} мс (было {previous["p95_ms"]} мс)')
+    return regressions
+
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_baseline(results, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+
+
+def session_cookie(user):
+    """ Cookie сессии пользователя для запросов к запущенному серверу """
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def start_server(mode, port, workers=2):
+    """ Запускает gunicorn с gunicorn.conf.py в режиме wsgi или asgi и ждет, пока он начнет отвечать """
+    env = dict(os.environ, SERVER_MODE=mode, GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS=str(workers))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Сервер {mode} завершился с кодом {process.returncode}')
+        try:
+            client = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            client.request('GET', '/metrics')
+            client.getresponse().read()
+            client.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'Сервер {mode} не запустился за 30 секунд')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def load_test(base_url, paths, cookie=None, concurrency=16, requests=500):
+    """ Нагрузочный замер: concurrency потоков отправляют всего requests GET-запросов
+    по кругу по paths. Возвращает пропускную способность (запросов в секунду),
+    задержки p50/p95 (мс) и количество ошибок (нет ответа или статус не 200) """
+    url = urlsplit(base_url)
+    headers = {'Cookie': cookie} if cookie else {}
+    timings = []
+    errors = []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        client = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        while True:
+            with lock:
+                number = next(counter, None)
+            if number is None:
+                break
+            started = time.perf_counter()
+            try:
+                client.request('GET', paths[number % len(paths)], headers=headers)
+                response = client.getresponse()
+                response.read()
+                ok = response.status == 200
+                if response.will_close:
+                    client.close()
+            except (OSError, http.client.HTTPException):
+                ok = False
+                client.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                (timings if ok else errors).append(elapsed)
+        client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'errors': len(errors),
+        'rps': round(len(timings) / duration, 1),
+        'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+        'p95_ms': round(percentile(timings, 95), 2) if timings else None,
+    }
+
+
+def server_paths(user):
+    """ Страницы, которые сравниваются в режимах WSGI и ASGI (асинхронные контроллеры) """
+    entry = DiaryEntry.objects.filter(user=user).order_by('-created_at', '-id').first()
+    if entry is None:
+        raise ValueError(f'У пользователя {user.email} нет записей для замеров')
+    return {
+        'home': reverse('diary:home'),
+        'list': reverse('diary:entry_list'),
+        'detail': reverse('diary:entry_detail', kwargs={'pk': entry.pk}),
+    }
+
+
+# Режимы замера соединений: direct - новое соединение на каждый запрос (без пула, CONN_MAX_AGE = 0),
+# pool - соединение из пула psycopg 3, persistent - одно открытое соединение (нижняя граница)
+CONNECTION_MODES = ('direct', 'pool', 'persistent')
+
+
+def _connection_settings(mode, threads):
+    settings_dict = copy.deepcopy(connections.settings[connection.alias])
+    settings_dict['CONN_MAX_AGE'] = 0
+    pool = settings_dict['OPTIONS'].pop('pool', None)
+    if mode == 'pool':
+        pool = dict(pool) if isinstance(pool, dict) else {}
+        pool.update(min_size=threads, max_size=max(threads, pool.get('max_size', 0)))
+        settings_dict['OPTIONS']['pool'] = pool
+    return settings_dict
+
+
+def measure_connections(mode, iterations=200, threads=1):
+    """ Замер накладных расходов на соединение: каждый из threads потоков iterations раз берет
+    соединение, выполняет SELECT 1 и освобождает соединение. Возвращает задержки (мс)
+    и количество соединений, открытых с PostgreSQL. На время замера настройки базы
+    регистрируются под отдельным псевдонимом benchmark_<режим> """
+    alias = f'benchmark_{mode}'
+    connections.settings[alias] = _connection_settings(mode, threads)
+    timings = []
+    opened = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            run(connections[alias])
+        except Exception as e:
+            errors.append(e)
+
+    def run(wrapper):
+        local_timings = []
+        connects = 0
+        for _ in range(iterations):
+            started = time.perf_counter()
+            if wrapper.connection is None:
+                connects += 1
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            if mode != 'persistent':
+                wrapper.close()
+            local_timings.append((time.perf_counter() - started) * 1000)
+        wrapper.close()
+        with lock:
+            timings.extend(local_timings)
+            opened.append(connects)
+
+    try:
+        threads_list = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in threads_list:
+            thread.start()
+        for thread in threads_list:
+            thread.join()
+        duration = time.perf_counter() - started
+        if errors:
+            raise errors[0]
+
+        connections_opened = sum(opened)
+        if mode == 'pool':
+            connections_opened = connections[alias].pool.get_stats().get('connections_num', 0)
+    finally:
+        if mode == 'pool':
+            connections[alias].close_pool()
+        del connections.settings[alias]
+    return {
+        'iterations': len(timings),
+        'connections': connections_opened,
+        'per_second': round(len(timings) / duration, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+    }
+
+
+# Режимы загрузки сессии и пользователя: хранилище сессий и кеш строки пользователя.
+# db - как без кеширования (по запросу к django_session и к users_user на каждую страницу)
+SESSION_MODES = {
+    'db': ('db', False),
+    'db_user_cache': ('db', True),
+    'cached_db': ('cached_db', True),
+    'signed_cookies': ('signed_cookies', True),
+}
+
+
+def measure_sessions(user, mode, iterations=200):
+    """ Замер работы SessionMiddleware и AuthenticationMiddleware для вошедшего пользователя:
+    задержки (мс) и количество SQL-запросов на один HTTP-запрос. Кеш - из настроек проекта
+    (без REDIS_URL - память процесса, без сетевой задержки Redis) """
+    backend, user_cache = SESSION_MODES[mode]
+    overrides = {'SESSION_ENGINE': f'django.contrib.sessions.backends.{backend}'}
+    if not user_cache:
+        overrides['USER_CACHE_TIMEOUT'] = 0
+    with override_settings(**overrides):
+        client = Client()
+        client.force_login(user)
+        cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+        session_middleware = SessionMiddleware(lambda request: None)
+        auth_middleware = AuthenticationMiddleware(lambda request: None)
+        factory = RequestFactory()
+
+        def load_user():
+            request = factory.get('/')
+            request.COOKIES[settings.SESSION_COOKIE_NAME] = cookie
+            session_middleware.process_request(request)
+            auth_middleware.process_request(request)
+            return request.user.pk
+
+        load_user()  # прогрев: сессия и пользователь попадают в кеш
+        timings = []
+        with CaptureQueriesContext(connection) as context:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                if load_user() != user.pk:
+                    raise RuntimeError(f'Пользователь не загружен из сессии в режиме {mode}')
+                timings.append((time.perf_counter() - started) * 1000)
+        client.logout()
+    return {
+        'queries': round(len(context.captured_queries) / iterations, 2),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+    }
@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+_executor = None
+
+
+def _get_executor():
+    """ Пул потоков для параллельных запросов. У каждого потока свое соединение с базой,
+    поэтому размер пула ограничивает число дополнительных соединений процесса """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'DIARY_ASYNC_QUERY_THREADS', 4),
+            thread_name_prefix='diary-db',
+        )
+    return _executor
+
+
+def _call_in_thread(func):
+    try:
+        return func()
+    finally:
+        # Как и в конце HTTP-запроса: соединение потока закрывается после ошибки
+        # или по истечении CONN_MAX_AGE, иначе переиспользуется следующей задачей
+        for connection in connections.all(initialized_only=True):
+            connection.close_if_unusable_or_obsolete()
+
+
+async def run_parallel(*funcs):
+    """ Выполняет независимые синхронные функции с запросами к базе одновременно
+    и возвращает их результаты в том же порядке.
+
+    Асинхронный ORM Django выполняет запросы в одном потоке (thread_sensitive), поэтому
+    запросы, запущенные через asyncio.gather, все равно идут по очереди. Здесь каждая функция
+    выполняется в отдельном потоке пула со своим соединением. При DIARY_ASYNC_PARALLEL_QUERIES = False
+    (например, в тестах, где данные видны только в транзакции основного соединения)
+    функции выполняются последовательно в потоке запроса """
+    if not getattr(settings, 'DIARY_ASYNC_PARALLEL_QUERIES', True):
+        return [await sync_to_async(func)() for func in funcs]
+    executor = _get_executor()
+    return await asyncio.gather(*(
+        sync_to_async(_call_in_thread, thread_sensitive=False, executor=executor)(func) for func in funcs
+    ))
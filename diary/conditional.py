@@ -0,0 +1,74 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from users.services import get_user_roles
+
+
+def page_etag(request, *parts):
+    """ Слабый ETag страницы пользователя: версия шаблонов, данные пользователя
+    из меню (имя, аватар, роли) и переданные данные страницы """
+    user = request.user
+    payload = [
+        getattr(settings, 'DIARY_ETAG_VERSION', 1),
+        user.pk,
+        user.display_name,
+        user.is_superuser,
+        (user.avatar_variants or {}).get('hash'),
+        sorted(get_user_roles(user).groups),
+        *parts,
+    ]
+    digest = hashlib.sha1(json.dumps(payload, default=str).encode()).hexdigest()[:32]
+    return f'W/"{digest}"'
+
+
+class ConditionalGetMixin:
+    """ Условные GET-запросы (If-None-Match / If-Modified-Since). Если у браузера актуальная
+    версия страницы, возвращается 304 Not Modified без загрузки записей и рендеринга шаблона.
+    Валидаторы (ETag, Last-Modified) вычисляет get_validators() одним дешевым запросом """
+
+    def get_validators(self):
+        """ (etag, last_modified) страницы или None, если страницу проверить нельзя """
+        raise NotImplementedError
+
+    def get_response_validators(self):
+        """ Валидаторы для полного ответа (можно вычислить по уже загруженным данным) """
+        return self.get_validators()
+
+    def get_not_modified(self):
+        """ Ответ 304 Not Modified, если страница не изменилась, иначе None """
+        headers = self.request.headers
+        if 'If-None-Match' not in headers and 'If-Modified-Since' not in headers:
+            return None
+        validators = self.get_validators()
+        if validators is None:
+            return None
+        etag, last_modified = validators
+        response = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if response is None:
+            return None
+        return self.add_validators(response, validators)
+
+    def add_validators(self, response, validators):
+        """ Заголовки ETag и Last-Modified; no-cache заставляет браузер проверять страницу при каждом открытии """
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(last_modified.timestamp()))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get(self, request, *args, **kwargs):
+        response = self.get_not_modified()
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            response = self.add_validators(response, self.get_response_validators())
+        return response
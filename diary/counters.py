@@ -0,0 +1,120 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+from .models import DiaryEntry, EntryCounter
+
+
+def get_counter_shard(user_id):
+    """ Строка общего счетчика, которую изменяют записи пользователя """
+    return user_id % max(getattr(settings, 'DIARY_ENTRY_COUNTER_SHARDS', 16), 1)
+
+
+def change_entry_count(user_id, delta):
+    """ Изменяет счетчик пользователя и его часть общего счетчика одним запросом.
+    Часть общего счетчика изменяется через INSERT ... ON CONFLICT DO UPDATE, параллельные транзакции
+    разных пользователей блокируют разные ее строки. Строка пользователя при добавлении записи
+    создается тем же запросом (без гонки между чтением и вставкой), а при удалении только уменьшается:
+    при удалении самого пользователя его строка уже удалена каскадом и не должна появиться снова """
+    table = EntryCounter._meta.db_table
+    upsert = f'ON CONFLICT (user_id, shard) DO UPDATE SET entry_count = {table}.entry_count + EXCLUDED.entry_count'
+    with connection.cursor() as cursor:
+        if delta > 0:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, shard, entry_count) VALUES (%s, 0, %s), (NULL, %s, %s) {upsert}',
+                [user_id, delta, get_counter_shard(user_id), delta],
+            )
+        else:
+            cursor.execute(
+                f'WITH user_counter AS (UPDATE {table} SET entry_count = entry_count + %s '
+                f'WHERE user_id = %s AND shard = 0) '
+                f'INSERT INTO {table} (user_id, shard, entry_count) VALUES (NULL, %s, %s) {upsert}',
+                [delta, user_id, get_counter_shard(user_id), delta],
+            )
+
+
+def estimate_total_entries():
+    """ Оценка количества записей по статистике PostgreSQL (pg_class.reltuples), без чтения таблицы """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [DiaryEntry._meta.db_table])
+        row = cursor.fetchone()
+    return max(row[0], 0) if row else 0
+
+
+def _counters_lookup(user):
+    lookup = Q(user__isnull=True)
+    if user is not None and user.is_authenticated:
+        lookup |= Q(user=user)
+    return lookup
+
+
+def _counters(user):
+    """ Счетчики пользователя и сайта: {user_id или None: сумма строк} """
+    return EntryCounter.objects.filter(_counters_lookup(user)).values('user_id').annotate(
+        total=Sum('entry_count')
+    ).order_by().values_list('user_id', 'total')
+
+
+def get_entry_counts(user=None):
+    """ Возвращает (количество записей пользователя, количество записей на сайте) одним запросом.
+    Счетчик пользователя при отсутствии создается по точному COUNT по его записям,
+    общий счетчик при отсутствии заменяется оценкой reltuples """
+    authenticated = user is not None and user.is_authenticated
+    counts = dict(_counters(user))
+
+    user_count = None
+    if authenticated:
+        user_count = counts.get(user.pk)
+        if user_count is None:
+            user_count = DiaryEntry.objects.filter(user=user).count()
+            EntryCounter.objects.bulk_create([EntryCounter(user=user, entry_count=user_count)], ignore_conflicts=True)
+
+    total_count = counts.get(None)
+    if total_count is None:
+        total_count = estimate_total_entries()
+    return user_count, total_count
+
+
+async def aget_entry_counts(user=None):
+    """ Асинхронная версия get_entry_counts на асинхронном ORM """
+    authenticated = user is not None and user.is_authenticated
+    counts = {
+        user_id: entry_count
+        async for user_id, entry_count in _counters(user)
+    }
+
+    user_count = None
+    if authenticated:
+        user_count = counts.get(user.pk)
+        if user_count is None:
+            user_count = await DiaryEntry.objects.filter(user=user).acount()
+            await EntryCounter.objects.abulk_create(
+                [EntryCounter(user=user, entry_count=user_count)], ignore_conflicts=True
+            )
+
+    total_count = counts.get(None)
+    if total_count is None:
+        total_count = await sync_to_async(estimate_total_entries)()
+    return user_count, total_count
+
+
+def rebuild_entry_counters(user_ids=None):
+    """ Пересчитывает счетчики записей с нуля (все или только указанных пользователей
+    вместе с общим счетчиком, который собирается в одну строку). Возвращает общее количество записей """
+    entries = DiaryEntry.objects.all()
+    counters = EntryCounter.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        counters = counters.filter(Q(user_id__in=user_ids) | Q(user__isnull=True))
+
+    rows = entries.values('user_id').annotate(entry_count=Count('id')).order_by()
+    new_counters = [EntryCounter(user_id=row['user_id'], entry_count=row['entry_count']) for row in rows]
+    if user_ids is None:
+        total = sum(counter.entry_count for counter in new_counters)
+    else:
+        total = DiaryEntry.objects.count()
+    with transaction.atomic():
+        counters.delete()
+        EntryCounter.objects.bulk_create(new_counters + [EntryCounter(user=None, entry_count=total)], batch_size=1000)
+    return total
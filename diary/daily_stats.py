@@ -0,0 +1,177 @@
+import calendar
+import math
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import connection, transaction
+from django.db.models import Count, F, Func, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce, Length, TruncDate
+from django.utils import timezone
+
+from .models import DailyStat, DiaryEntry
+
+# Уровни заполненности клеток календаря (0 - записей нет)
+HEATMAP_LEVELS = 4
+MONTH_NAMES = ('Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь', 'Июль', 'Август', 'Сентябрь', 'Октябрь',
+               'Ноябрь', 'Декабрь')
+
+
+def word_count(field='text'):
+    """ Количество слов в тексте (последовательностей непробельных символов), считается в PostgreSQL """
+    return Func(F(field), Value(r'\S+'), function='regexp_count', output_field=IntegerField())
+
+
+def entry_date(entry):
+    """ День записи в часовом поясе сайта (ключ дневной сводки) """
+    return timezone.localdate(entry.created_at)
+
+
+def day_bounds(day):
+    """ Начало дня и начало следующего дня в часовом поясе сайта """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _lock_day(user_id, day):
+    """ Блокирует пересчет сводки пользователя за день до конца транзакции (advisory lock PostgreSQL).
+    Без блокировки два параллельных пересчета одного дня видят каждый только свои незафиксированные
+    изменения записей, и последний затирает результат первого """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(hashtextextended(%s, 0))', [f'diary.dailystat:{user_id}:{day}'],
+        )
+
+
+def refresh_daily_stat(user_id, day):
+    """ Пересчитывает сводку пользователя за один день по его записям этого дня
+    (диапазон индекса diary_entry_user_created_idx). День без записей удаляется.
+    Пересчеты одного дня выполняются по очереди: следующий ждет фиксации предыдущего
+    и видит его изменения """
+    start, end = day_bounds(day)
+    entries = DiaryEntry.objects.filter(user_id=user_id, created_at__gte=start, created_at__lt=end)
+    with transaction.atomic(savepoint=False):
+        _lock_day(user_id, day)
+        totals = entries.aggregate(
+            entry_count=Count('id'),
+            word_count=Coalesce(Sum(word_count()), 0),
+            char_count=Coalesce(Sum(Length('text')), 0),
+        )
+        if not totals['entry_count']:
+            DailyStat.objects.filter(user_id=user_id, date=day).delete()
+            return
+
+        tag_ids = sorted(set(entries.filter(tags__isnull=False).values_list('tags', flat=True)))
+        DailyStat.objects.bulk_create(
+            [DailyStat(user_id=user_id, date=day, tag_ids=tag_ids, tag_count=len(tag_ids), **totals)],
+            update_conflicts=True,
+            unique_fields=['user', 'date'],
+            update_fields=['entry_count', 'word_count', 'char_count', 'tag_ids', 'tag_count'],
+        )
+
+
+def refresh_entry_stats(entries):
+    """ Пересчитывает сводки дней, к которым относятся записи (пары user_id, created_at) """
+    for user_id, day in {(user_id, timezone.localdate(created_at)) for user_id, created_at in entries}:
+        refresh_daily_stat(user_id, day)
+
+
+def rebuild_daily_stats(user_ids=None):
+    """ Пересобирает дневные сводки с нуля по текущим записям. Возвращает количество строк """
+    stats = DailyStat.objects.all()
+    entries = DiaryEntry.objects.annotate(day=TruncDate('created_at'))
+    if user_ids is not None:
+        stats = stats.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+
+    tags = {
+        (row['user_id'], row['day']): sorted(row['tag_ids'])
+        for row in entries.filter(tags__isnull=False).values('user_id', 'day')
+        .annotate(tag_ids=ArrayAgg('tags', distinct=True)).order_by().iterator()
+    }
+    rows = entries.values('user_id', 'day').annotate(
+        entry_count=Count('id'),
+        word_count=Sum(word_count()),
+        char_count=Sum(Length('text')),
+    ).order_by()
+
+    new_stats = []
+    for row in rows.iterator():
+        tag_ids = tags.get((row['user_id'], row['day']), [])
+        new_stats.append(DailyStat(
+            user_id=row['user_id'],
+            date=row['day'],
+            entry_count=row['entry_count'],
+            word_count=row['word_count'],
+            char_count=row['char_count'],
+            tag_ids=tag_ids,
+            tag_count=len(tag_ids),
+        ))
+    with transaction.atomic():
+        stats.delete()
+        created = DailyStat.objects.bulk_create(new_stats, batch_size=1000)
+    return len(created)
+
+
+def get_year_stats(user, year):
+    """ Сводки пользователя за год одним запросом: {дата: DailyStat} """
+    stats = DailyStat.objects.filter(user=user, date__gte=date(year, 1, 1), date__lte=date(year, 12, 31))
+    return {stat.date: stat for stat in stats.only('date', 'entry_count', 'word_count', 'char_count', 'tag_ids')}
+
+
+def build_heatmap(stats, year):
+    """ Календарь года по неделям (столбцы с понедельника по воскресенье) с уровнем заполненности дней """
+    max_count = max((stat.entry_count for stat in stats.values()), default=0)
+    first = date(year, 1, 1)
+    day = first - timedelta(days=first.weekday())
+    last = date(year, 12, 31)
+    weeks = []
+    while day <= last:
+        week = []
+        for _ in range(7):
+            stat = stats.get(day)
+            count = stat.entry_count if stat else 0
+            week.append({
+                'date': day,
+                'in_year': day.year == year,
+                'entry_count': count,
+                'word_count': stat.word_count if stat else 0,
+                'level': math.ceil(count * HEATMAP_LEVELS / max_count) if count else 0,
+            })
+            day += timedelta(days=1)
+        weeks.append(week)
+    return weeks
+
+
+def build_monthly_stats(stats, year):
+    """ Статистика года по месяцам: дни с записями, записи, слова, символы и разные теги """
+    months = [
+        {'month': date(year, month, 1), 'name': MONTH_NAMES[month - 1], 'days': 0,
+         'entry_count': 0, 'word_count': 0, 'char_count': 0, 'tag_ids': set()}
+        for month in range(1, 13)
+    ]
+    for stat in stats.values():
+        month = months[stat.date.month - 1]
+        month['days'] += 1
+        month['entry_count'] += stat.entry_count
+        month['word_count'] += stat.word_count
+        month['char_count'] += stat.char_count
+        month['tag_ids'].update(stat.tag_ids)
+    for month in months:
+        month['days_in_month'] = calendar.monthrange(year, month['month'].month)[1]
+        month['tag_count'] = len(month.pop('tag_ids'))
+    return months
+
+
+def get_streaks(user, today=None):
+    """ Текущая серия дней подряд с записями (заканчивается сегодня или вчера) и самая длинная серия.
+    Читаются только даты сводок пользователя (индекс diary_dailystat_user_date_uniq) """
+    today = today or timezone.localdate()
+    dates = DailyStat.objects.filter(user=user, date__lte=today).order_by('date').values_list('date', flat=True)
+    longest = length = 0
+    previous = None
+    for day in dates.iterator():
+        length = length + 1 if previous is not None and day - previous == timedelta(days=1) else 1
+        longest = max(longest, length)
+        previous = day
+    current = length if previous is not None and today - previous <= timedelta(days=1) else 0
+    return current, longest
@@ -0,0 +1,205 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from users.models import User
+from .models import DiaryEntry, EntryDraft
+from .services import custom_values_from_post
+
+logger = logging.getLogger(__name__)
+
+# Поля формы записи, которые сохраняются в черновике (кроме пользовательских полей)
+DRAFT_FIELDS = ('text', 'targets', 'tags')
+DRAFT_FIELD_MAX_LENGTH = 255
+# Очередь черновиков, ожидающих переноса в базу: номер последнего элемента и последнего перенесенного
+QUEUE_SEQUENCE_KEY = 'diary:drafts:sequence'
+QUEUE_FLUSHED_KEY = 'diary:drafts:flushed'
+FLUSH_LOCK_KEY = 'diary:drafts:flush-lock'
+FLUSH_LOCK_TIMEOUT = 5 * 60
+# Черновик стоит в очереди один раз до ближайшего переноса. Если элемент очереди потерян,
+# флаг истекает и следующее автосохранение снова ставит черновик в очередь
+QUEUED_TIMEOUT = 5 * 60
+# Номер очереди выдается до записи элемента. Перенос останавливается на первом отсутствующем
+# элементе и ждет его до QUEUE_ITEM_WAIT секунд, после чего считает элемент потерянным
+QUEUE_ITEM_WAIT = 60
+
+
+def draft_cache_key(user_id, entry_id=None):
+    """ Ключ кеша черновика пользователя: редактируемой записи или новой (entry_id не задан) """
+    return f'diary:draft:{user_id}:{entry_id or "new"}'
+
+
+def _queued_key(user_id, entry_id):
+    return f'{draft_cache_key(user_id, entry_id)}:queued'
+
+
+def _queue_item_key(number):
+    return f'diary:drafts:queue:{number}'
+
+
+def _missing_item_key(number):
+    return f'diary:drafts:missing:{number}'
+
+
+def get_draft_timeout():
+    return getattr(settings, 'DIARY_DRAFT_CACHE_TIMEOUT', 7 * 24 * 60 * 60)
+
+
+def uses_queue():
+    """ Черновики копятся в кеше и переносятся в базу задачей flush_entry_drafts. Задача работает
+    в другом процессе (Celery), поэтому очередь нужна общая (Redis); с кешем в памяти процесса
+    (DIARY_DRAFT_QUEUE = False) черновики пишутся и читаются сразу из базы """
+    return getattr(settings, 'DIARY_DRAFT_QUEUE', True)
+
+
+def draft_from_post(post, custom_field_names):
+    """ Черновик из данных формы записи """
+    draft = {field: post.get(field, '') for field in DRAFT_FIELDS}
+    draft['custom_values'] = custom_values_from_post(post, custom_field_names)
+    return draft
+
+
+def save_draft(user_id, entry_id, draft):
+    """ Сохраняет черновик в кеш без обращения к базе и ставит его в очередь переноса в базу
+    (без очереди - сразу в базу). Возвращает черновик с временем сохранения """
+    draft = {**draft, 'saved_at': timezone.now()}
+    if not uses_queue():
+        _save_drafts({(user_id, entry_id): draft})
+        return draft
+    cache.set(draft_cache_key(user_id, entry_id), draft, get_draft_timeout())
+    if cache.add(_queued_key(user_id, entry_id), True, QUEUED_TIMEOUT):
+        cache.add(QUEUE_SEQUENCE_KEY, 0, None)
+        number = cache.incr(QUEUE_SEQUENCE_KEY)
+        cache.set(_queue_item_key(number), (user_id, entry_id), get_draft_timeout())
+    return draft
+
+
+def _load_draft(user_id, entry_id):
+    return (
+        EntryDraft.objects.filter(user_id=user_id, entry_id=entry_id)
+        .values(*DRAFT_FIELDS, 'custom_values', 'saved_at')
+        .first()
+    )
+
+
+def get_draft(user_id, entry_id=None):
+    """ Черновик формы: сначала из кеша, при промахе - из таблицы черновиков (результат,
+    в том числе отсутствие черновика, кешируется). Возвращает словарь или None """
+    if not uses_queue():
+        return _load_draft(user_id, entry_id)
+    key = draft_cache_key(user_id, entry_id)
+    draft = cache.get(key)
+    if draft is None:
+        draft = _load_draft(user_id, entry_id) or False
+        cache.set(key, draft, get_draft_timeout())
+    return draft or None
+
+
+def clear_draft(user_id, entry_id=None):
+    """ Удаляет черновик после сохранения записи. Строка в базе удаляется, только если
+    черновик мог туда попасть: в кеше есть черновик или о нем ничего не известно """
+    if not uses_queue():
+        EntryDraft.objects.filter(user_id=user_id, entry_id=entry_id).delete()
+        return
+    key = draft_cache_key(user_id, entry_id)
+    cached = cache.get(key)
+    cache.set(key, False, get_draft_timeout())
+    cache.delete(_queued_key(user_id, entry_id))
+    if cached is not False:
+        EntryDraft.objects.filter(user_id=user_id, entry_id=entry_id).delete()
+
+
+def flush_drafts(batch_size=None):
+    """ Переносит черновики из очереди в кеше в таблицу EntryDraft пачками (одна вставка на пачку).
+    Одновременно работает только один перенос. Возвращает количество сохраненных черновиков """
+    if not uses_queue():
+        return 0
+    batch_size = batch_size or getattr(settings, 'DIARY_DRAFT_FLUSH_BATCH_SIZE', 500)
+    # Блокировка снимается, только если она все еще наша: после истечения FLUSH_LOCK_TIMEOUT
+    # ее мог взять другой перенос
+    token = uuid.uuid4().hex
+    if not cache.add(FLUSH_LOCK_KEY, token, FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        last = cache.get(QUEUE_SEQUENCE_KEY, 0)
+        flushed = cache.get(QUEUE_FLUSHED_KEY, 0)
+        if flushed > last:
+            # Счетчик очереди вытеснен из кеша и начат заново
+            flushed = 0
+        saved = 0
+        while flushed < last:
+            numbers = range(flushed + 1, min(flushed + batch_size, last) + 1)
+            items = cache.get_many([_queue_item_key(number) for number in numbers])
+            ready = []
+            for number in numbers:
+                if _queue_item_key(number) not in items and not _item_lost(number):
+                    break
+                ready.append(number)
+            if ready:
+                saved += _flush_batch([_queue_item_key(number) for number in ready], items)
+                flushed = ready[-1]
+                cache.set(QUEUE_FLUSHED_KEY, flushed, None)
+            if len(ready) < len(numbers):
+                # Автосохранение получило номер, но еще не записало элемент: ждем следующего переноса
+                break
+        return saved
+    finally:
+        if cache.get(FLUSH_LOCK_KEY) == token:
+            cache.delete(FLUSH_LOCK_KEY)
+
+
+def _item_lost(number):
+    """ Элемент очереди не появился за QUEUE_ITEM_WAIT секунд с первой попытки его перенести
+    (автосохранение прервалось между выдачей номера и записью элемента) """
+    now = time.time()
+    key = _missing_item_key(number)
+    cache.add(key, now, QUEUED_TIMEOUT)
+    if now - cache.get(key, now) < QUEUE_ITEM_WAIT:
+        return False
+    logger.warning('Элемент очереди черновиков %s потерян, пропускаем', number)
+    cache.delete(key)
+    return True
+
+
+def _flush_batch(item_keys, items):
+    """ Сохраняет в базу черновики одной пачки элементов очереди """
+    items = {items[key] for key in item_keys if key in items}
+    # Флаг очереди снимается до чтения черновика: автосохранение после чтения снова поставит его в очередь
+    cache.delete_many([_queued_key(*item) for item in items])
+    cached = cache.get_many([draft_cache_key(*item) for item in items])
+    drafts = {item: cached.get(draft_cache_key(*item)) for item in items}
+    saved = _save_drafts({item: draft for item, draft in drafts.items() if draft})
+    cache.delete_many(item_keys)
+    return saved
+
+
+def _save_drafts(drafts):
+    """ Сохраняет черновики {(user_id, entry_id): черновик} одной вставкой. Черновики удаленных
+    пользователей, а также удаленных и чужих записей не сохраняются. Возвращает их количество """
+    user_ids = set(User.objects.filter(pk__in={user_id for user_id, _ in drafts}).values_list('pk', flat=True))
+    entry_ids = {entry_id for _, entry_id in drafts if entry_id}
+    owners = dict(DiaryEntry.objects.filter(pk__in=entry_ids).values_list('pk', 'user_id')) if entry_ids else {}
+    rows = [
+        EntryDraft(
+            user_id=user_id,
+            entry_id=entry_id,
+            text=draft['text'],
+            targets=draft['targets'][:DRAFT_FIELD_MAX_LENGTH],
+            tags=draft['tags'][:DRAFT_FIELD_MAX_LENGTH],
+            custom_values=draft['custom_values'],
+            saved_at=draft['saved_at'],
+        )
+        for (user_id, entry_id), draft in drafts.items()
+        if user_id in user_ids and (entry_id is None or owners.get(entry_id) == user_id)
+    ]
+    EntryDraft.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['user', 'entry'],
+        update_fields=['text', 'targets', 'tags', 'custom_values', 'saved_at'],
+    )
+    return len(rows)
@@ -0,0 +1,158 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import DiaryEntry
+
+# Форматы выгрузки: тип содержимого и расширение файла
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv', 'csv'),
+}
+
+CSV_COLUMNS = ('id', 'created_at', 'updated_at', 'text', 'targets', 'tags', 'custom_fields')
+
+# Размер блока, которым выгрузка отдается клиенту (байт)
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def get_export_chunk_size():
+    """ Количество записей, загружаемых из базы за один раз (вместе с тегами) """
+    return getattr(settings, 'DIARY_EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_queryset(user):
+    """ Записи пользователя для выгрузки в порядке создания """
+    return (
+        DiaryEntry.objects.filter(user=user)
+        .only('id', 'created_at', 'updated_at', 'text', 'targets', 'custom_values')
+        .prefetch_related('tags')
+        .order_by('created_at', 'id')
+    )
+
+
+def entry_to_dict(entry):
+    """ Запись дневника в виде словаря для выгрузки """
+    return {
+        'id': entry.pk,
+        'created_at': entry.created_at.isoformat(),
+        'updated_at': entry.updated_at.isoformat(),
+        'text': entry.text,
+        'targets': entry.targets,
+        'tags': sorted(tag.name for tag in entry.tags.all()),
+        'custom_fields': entry.custom_values,
+    }
+
+
+def iter_entries(user, chunk_size=None):
+    """ Записи пользователя словарями. iterator() читает записи серверным курсором
+    пачками по chunk_size и подгружает теги отдельным запросом для каждой пачки,
+    поэтому расход памяти не зависит от размера дневника """
+    queryset = export_queryset(user)
+    for entry in queryset.iterator(chunk_size=chunk_size or get_export_chunk_size()):
+        yield entry_to_dict(entry)
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _ndjson(entries):
+    for entry in entries:
+        yield _dumps(entry) + '\n'
+
+
+def _json(entries):
+    yield '['
+    separator = '\n'
+    for entry in entries:
+        yield separator + _dumps(entry)
+        separator = ',\n'
+    yield '\n]\n'
+
+
+class _Echo:
+    """ Псевдофайл для csv.writer: возвращает записанную строку вместо записи """
+
+    def write(self, value):
+        return value
+
+
+def _csv(entries):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for entry in entries:
+        yield writer.writerow([
+            entry['id'],
+            entry['created_at'],
+            entry['updated_at'],
+            entry['text'],
+            entry['targets'],
+            ', '.join(entry['tags']),
+            _dumps(entry['custom_fields']) if entry['custom_fields'] else '',
+        ])
+
+
+SERIALIZERS = {
+    'ndjson': _ndjson,
+    'json': _json,
+    'csv': _csv,
+}
+
+
+def _blocks(chunks, block_size=STREAM_BLOCK_SIZE):
+    """ Склеивает мелкие куски в блоки байтов примерно по block_size """
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        buffer.append(data)
+        size += len(data)
+        if size >= block_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzip(blocks):
+    """ Сжимает поток блоков в формат gzip на лету """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(user, export_format='ndjson', compress=False, chunk_size=None):
+    """ Выгрузка дневника пользователя потоком блоков байтов """
+    if export_format not in SERIALIZERS:
+        raise ValueError(f'Неизвестный формат выгрузки: {export_format}')
+    blocks = _blocks(SERIALIZERS[export_format](iter_entries(user, chunk_size)))
+    return _gzip(blocks) if compress else blocks
+
+
+async def astream_export(user, export_format='ndjson', compress=False, chunk_size=None):
+    """ Выгрузка потоком для ASGI. Обычный генератор сервер ASGI прочитал бы целиком до отправки
+    ответа, поэтому блоки берутся из stream_export по одному в потоке sync_to_async
+    (всегда в одном и том же: серверный курсор привязан к соединению потока) """
+    blocks = stream_export(user, export_format, compress, chunk_size)
+    next_block = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (block := await next_block(blocks, None)) is not None:
+            yield block
+    finally:
+        await sync_to_async(blocks.close, thread_sensitive=True)()
+
+
+def export_filename(export_format, compress=False, date=None):
+    """ Имя файла выгрузки, например diary-2025-06-30.ndjson.gz """
+    name = f'diary-{date:%Y-%m-%d}' if date else 'diary'
+    name += '.' + EXPORT_FORMATS[export_format][1]
+    return name + '.gz' if compress else name
@@ -49,3 +49,11 @@ class DiarySettingsForm(forms.ModelForm):
             'show_tags': '',
             'default_targets': ''
         }
+
+
+class DiaryImportForm(StyleFormMixin, forms.Form):
+    """ Форма загрузки файла для импорта записей """
+    file = forms.FileField(
+        label='Файл',
+        help_text='Выгрузка дневника в формате NDJSON или фикстура JSON (можно сжатые gzip)',
+    )
@@ -0,0 +1,98 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from config.metrics import observe_fragment_cache
+
+# Кешируемые фрагменты записи: карточка в списке и тело страницы записи
+FRAGMENT_TEMPLATES = {
+    'card': 'diary/includes/entry_card.html',
+    'body': 'diary/includes/entry_body.html',
+}
+
+
+def get_fragment_cache():
+    """ Кеш фрагментов (по умолчанию - общий кеш проекта: Redis или память процесса) """
+    return caches[getattr(settings, 'DIARY_FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def _tags_version_key(user_id):
+    return f'diary:fragment:tags:{user_id}'
+
+
+def get_tags_version(user_id):
+    """ Версия названий тегов пользователя для ключей фрагментов. Переименование или удаление тега
+    не меняет время изменения записей, поэтому сбрасывается версия (invalidate_tags_versions).
+    Новая версия - текущее время, так что после сброса или вытеснения ключи не повторяются """
+    cache = get_fragment_cache()
+    key = _tags_version_key(user_id)
+    version = time.time_ns() // 1000
+    if cache.add(key, version, None):
+        return version
+    return cache.get(key, version)
+
+
+def invalidate_tags_versions(user_ids):
+    """ Сбрасывает версии тегов пользователей. Ключи удаляются сразу и еще раз после фиксации
+    транзакции: запрос, прочитавший старые названия до фиксации, мог сохранить фрагменты """
+    keys = [_tags_version_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache = get_fragment_cache()
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def fragment_cache_key(fragment, entry, diary_settings, tags_version=0):
+    """ Ключ фрагмента: id и время изменения записи (меняется и при изменении тегов записи),
+    флаги отображения из настроек дневника, версия тегов пользователя (get_tags_version,
+    если теги показываются) и версия шаблонов. Изменение записи, ее тегов или настроек дает
+    новый ключ, поэтому фрагменты не нужно удалять из кеша: устаревшие истекают по
+    DIARY_FRAGMENT_CACHE_TIMEOUT """
+    version = getattr(settings, 'DIARY_FRAGMENT_CACHE_VERSION', 1)
+    updated = int(entry.updated_at.timestamp() * 1_000_000)
+    flags = f'{int(diary_settings.show_targets)}{int(diary_settings.show_tags)}'
+    return f'diary:fragment:{version}:{fragment}:{entry.pk}:{updated}:{flags}:{tags_version}'
+
+
+def render_entry_fragments(entries, fragment, diary_settings):
+    """ Подставляет записям готовый HTML фрагмента (entry.fragment_html).
+    Фрагменты всей страницы читаются из кеша одним get_many; теги загружаются
+    и фрагменты рендерятся только для промахов, после чего сохраняются одним set_many.
+    Результаты поиска (со сниппетом headline) зависят от запроса и не кешируются """
+    entries = list(entries)
+    context = {'show_targets': diary_settings.show_targets, 'show_tags': diary_settings.show_tags}
+    keys = {}
+    if getattr(settings, 'DIARY_FRAGMENT_CACHE', True):
+        cacheable = [entry for entry in entries if not getattr(entry, 'headline', None)]
+        tags_version = get_tags_version(diary_settings.user_id) if cacheable and context['show_tags'] else 0
+        keys = {
+            entry.pk: fragment_cache_key(fragment, entry, diary_settings, tags_version)
+            for entry in cacheable
+        }
+    cache = get_fragment_cache()
+    cached = cache.get_many(list(keys.values())) if keys else {}
+    observe_fragment_cache(fragment, hits=len(cached), misses=len(keys) - len(cached))
+
+    missed = [entry for entry in entries if keys.get(entry.pk) not in cached]
+    if context['show_tags']:
+        prefetch_related_objects(missed, 'tags')
+
+    rendered = {}
+    for entry in entries:
+        key = keys.get(entry.pk)
+        if key in cached:
+            html = cached[key]
+        else:
+            html = render_to_string(FRAGMENT_TEMPLATES[fragment], {'entry': entry, **context})
+            if key is not None:
+                rendered[key] = str(html)
+        entry.fragment_html = mark_safe(html)
+    if rendered:
+        cache.set_many(rendered, getattr(settings, 'DIARY_FRAGMENT_CACHE_TIMEOUT', 7 * 24 * 60 * 60))
+    return entries
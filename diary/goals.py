@@ -0,0 +1,139 @@
+import re
+from datetime import date, datetime, time
+
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import DiaryEntry, EntryGoal, Goal
+
+# Разделители целей в поле "Цели" записи: запятая, точка с запятой, перевод строки
+GOAL_SEPARATORS = re.compile(r'[,;\n]+')
+GOAL_NAME_MAX_LENGTH = 100
+
+
+def goal_key(name):
+    """ Нормализованное название цели: лишние пробелы убраны, регистр не учитывается """
+    return ' '.join(name.split()).casefold()[:GOAL_NAME_MAX_LENGTH]
+
+
+def parse_goals(targets):
+    """ Цели из текста поля "Цели": {ключ: название} в порядке первого упоминания """
+    goals = {}
+    for part in GOAL_SEPARATORS.split(targets or ''):
+        name = ' '.join(part.split())[:GOAL_NAME_MAX_LENGTH]
+        if name:
+            goals.setdefault(goal_key(name), name)
+    return goals
+
+
+def get_goal_ids(user_id, goals):
+    """ Id целей пользователя по ключам; недостающие цели создаются (goals - {ключ: название}) """
+    if not goals:
+        return {}
+    Goal.objects.bulk_create(
+        [Goal(user_id=user_id, key=key, name=name) for key, name in goals.items()],
+        ignore_conflicts=True,
+    )
+    return dict(Goal.objects.filter(user_id=user_id, key__in=goals).values_list('key', 'id'))
+
+
+def sync_entry_goals(entry, created=False):
+    """ Приводит связи записи с целями в соответствие с полем "Цели". У существующей записи
+    связи читаются одним запросом, и если цели не изменились, больше запросов нет """
+    goals = parse_goals(entry.targets)
+    existing = {} if created else dict(
+        EntryGoal.objects.filter(entry=entry).values_list('goal__key', 'id')
+    )
+    removed = [link_id for key, link_id in existing.items() if key not in goals]
+    added = {key: name for key, name in goals.items() if key not in existing}
+    if removed:
+        EntryGoal.objects.filter(pk__in=removed).delete()
+    if added:
+        EntryGoal.objects.bulk_create(
+            [EntryGoal(entry_id=entry.pk, goal_id=goal_id, created_at=entry.created_at)
+             for goal_id in get_goal_ids(entry.user_id, added).values()],
+            ignore_conflicts=True,
+        )
+
+
+def rebuild_entry_goals(user_ids=None, chunk_size=2000):
+    """ Пересобирает связи записей с целями по полю "Цели" (все или только указанных пользователей).
+    Цели, которые больше не упоминаются, сохраняются с нулем записей. Возвращает количество связей """
+    entries = DiaryEntry.objects.exclude(targets='').only('id', 'user_id', 'created_at', 'targets').order_by('pk')
+    links = EntryGoal.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        links = links.filter(goal__user_id__in=user_ids)
+
+    created = 0
+    with transaction.atomic():
+        links.delete()
+        batch = []
+        for entry in entries.iterator(chunk_size=chunk_size):
+            batch.append(entry)
+            if len(batch) >= chunk_size:
+                created += _create_links(batch)
+                batch = []
+        created += _create_links(batch)
+    return created
+
+
+def _create_links(entries):
+    """ Связи пачки записей с целями: цели создаются одним запросом на пользователя """
+    parsed = {entry.pk: parse_goals(entry.targets) for entry in entries}
+    goals_by_user = {}
+    for entry in entries:
+        goals_by_user.setdefault(entry.user_id, {}).update(parsed[entry.pk])
+    goal_ids = {user_id: get_goal_ids(user_id, goals) for user_id, goals in goals_by_user.items()}
+    links = [
+        EntryGoal(entry_id=entry.pk, goal_id=goal_ids[entry.user_id][key], created_at=entry.created_at)
+        for entry in entries
+        for key in parsed[entry.pk]
+    ]
+    return len(EntryGoal.objects.bulk_create(links, batch_size=1000))
+
+
+def get_goal_progress(user, since):
+    """ Цели пользователя с количеством записей (всего и начиная с since) и датой последней записи.
+    Считается одним запросом по индексу связей (goal, created_at) """
+    return (
+        Goal.objects.filter(user=user)
+        .annotate(
+            entry_count=Count('entry_links'),
+            recent_count=Count('entry_links', filter=Q(entry_links__created_at__gte=since)),
+            last_entry_at=Max('entry_links__created_at'),
+        )
+        .order_by('-recent_count', '-entry_count', 'name')
+    )
+
+
+def month_starts(months, today=None):
+    """ Первые дни последних months месяцев, включая текущий, по возрастанию """
+    today = today or timezone.localdate()
+    starts = []
+    year, month = today.year, today.month
+    for _ in range(months):
+        starts.append(date(year, month, 1))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return starts[::-1]
+
+
+def get_monthly_progress(goal, months=12):
+    """ Количество записей с целью по месяцам за последние months месяцев (с нулями),
+    диапазон индекса (goal, created_at): [{'month': дата, 'entry_count': количество}] """
+    starts = month_starts(months)
+    if not starts:
+        return []
+    since = timezone.make_aware(datetime.combine(starts[0], time.min))
+    counts = {
+        timezone.localdate(month): entry_count
+        for month, entry_count in EntryGoal.objects.filter(goal=goal, created_at__gte=since)
+        .annotate(month=TruncMonth('created_at'))
+        .values('month')
+        .annotate(entry_count=Count('id'))
+        .order_by()
+        .values_list('month', 'entry_count')
+    }
+    return [{'month': start, 'entry_count': counts.get(start, 0)} for start in starts]
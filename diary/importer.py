@@ -0,0 +1,416 @@
+import gzip
+import io
+import json
+import logging
+import time
+from collections import defaultdict
+from itertools import chain, islice
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+
+from users.models import User
+from .counters import rebuild_entry_counters
+from .daily_stats import rebuild_daily_stats
+from .goals import rebuild_entry_goals
+from .models import DiaryEntry, DiarySettings, ImportedEntry, ImportJob
+from .search import update_search_vector
+from .services import get_custom_fields_storage, invalidate_diary_settings, sync_custom_field_rows
+from .tag_counts import rebuild_tag_counts
+
+logger = logging.getLogger(__name__)
+
+READ_BLOCK_SIZE = 64 * 1024
+
+SETTINGS_FIELDS = ('show_targets', 'show_tags', 'theme', 'default_targets', 'custom_fields_names')
+
+
+def get_import_batch_size():
+    """ Количество записей файла, сохраняемых одной пачкой (в одной транзакции) """
+    return getattr(settings, 'DIARY_IMPORT_BATCH_SIZE', 1000)
+
+
+def open_source(file):
+    """ Текстовый поток из бинарного файла; сжатые gzip файлы распаковываются на лету """
+    file = getattr(file, 'file', file)  # файл хранилища Django: работаем с исходным объектом
+    magic = file.read(2)
+    file.seek(0)
+    if magic == b'\x1f\x8b':
+        file = gzip.GzipFile(fileobj=file)
+    return io.TextIOWrapper(file, encoding='utf-8-sig')
+
+
+def _iter_json_array(stream, buffer=''):
+    """ Объекты JSON-массива (формат фикстур dumpdata) по одному, без чтения файла целиком """
+    decoder = json.JSONDecoder()
+    position = buffer.index('[') + 1
+    eof = False
+    while True:
+        # Пропускаем пробелы и разделители между объектами
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = stream.read(READ_BLOCK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield obj
+        buffer = buffer[end:]
+        position = 0
+
+
+def iter_records(stream):
+    """ Записи файла импорта: JSON-массив фикстуры или NDJSON (по объекту в строке) """
+    head = ''
+    while not head.strip():
+        chunk = stream.read(1024)
+        if not chunk:
+            return
+        head += chunk
+    if head.lstrip().startswith('['):
+        yield from _iter_json_array(stream, head)
+        return
+
+    # Первая прочитанная порция дополняется до конца строки, дальше файл читается построчно
+    for chunk in chain([head + stream.readline()], stream):
+        for line in chunk.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def normalize_record(record):
+    """ Приводит запись файла к виду (тип, данные). Поддерживаются строки выгрузки дневника
+    (см. diary.export) и объекты фикстур diary.diaryentry, diary.customfield, diary.diarysettings """
+    model = record.get('model')
+    if model is None:
+        return 'entry', {
+            'pk': None,
+            'user': None,
+            'created_at': record.get('created_at'),
+            'updated_at': record.get('updated_at'),
+            'text': record.get('text'),
+            'targets': record.get('targets'),
+            'tags': record.get('tags') or [],
+            'custom_fields': record.get('custom_fields') or {},
+        }
+
+    fields = record.get('fields', {})
+    if model == 'diary.diaryentry':
+        return 'entry', {
+            'pk': record.get('pk'),
+            'user': fields.get('user'),
+            'created_at': fields.get('created_at'),
+            'updated_at': fields.get('updated_at'),
+            'text': fields.get('text'),
+            'targets': fields.get('targets'),
+            'tags': fields.get('tags') or [],
+            'custom_fields': fields.get('custom_values') or {},
+        }
+    if model == 'diary.customfield':
+        return 'custom_field', {'entry': fields.get('entry'), 'name': fields.get('name'), 'value': fields.get('value')}
+    if model == 'diary.diarysettings':
+        values = {name: fields[name] for name in SETTINGS_FIELDS if name in fields}
+        return 'settings', {'user': fields.get('user'), **values}
+    return None, None
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class DiaryImporter:
+    """ Импорт записей дневника пачками через bulk_create.
+
+    Каждая пачка сохраняется в отдельной транзакции вместе с контрольной точкой задания
+    (ImportJob.processed), поэтому прерванный импорт продолжается с первой несохраненной пачки.
+    bulk_create не вызывает сигналы, поэтому поисковый вектор обновляется для каждой пачки,
+    а счетчики тегов и записей пересчитываются для затронутых пользователей в конце импорта.
+
+    Если у задания задан пользователь, все записи импортируются ему с новыми id. Иначе
+    (импорт фикстуры администратором) сохраняются id и пользователи из файла, существующие
+    записи с теми же id перезаписываются, как при loaddata; прежние владельцы перезаписанных
+    записей тоже попадают в пересчет. Соответствие id фикстуры новым id сохраняется с каждой
+    пачкой (ImportedEntry), поэтому пользовательские поля фикстуры находят записи из пачек
+    до сбоя и при продолжении импорта """
+
+    def __init__(self, job, batch_size=None, progress=None):
+        self.job = job
+        self.batch_size = batch_size or get_import_batch_size()
+        self.progress = progress
+        self.keep_ids = job.user_id is None
+        self.content_type = ContentType.objects.get_for_model(DiaryEntry)
+        self.rows_storage = get_custom_fields_storage() == 'rows'
+        self._tag_ids = {}
+        self._entry_ids = {}
+        self._user_ids = set()
+
+    def run(self, stream):
+        """ Импортирует записи из текстового потока, начиная с контрольной точки задания """
+        return self.run_records(iter_records(stream))
+
+    def run_records(self, records):
+        """ Импортирует записи (словари в формате выгрузки или фикстуры), начиная с контрольной точки """
+        job = self.job
+        job.status = ImportJob.STATUS_RUNNING
+        job.error = ''
+        job.save(update_fields=['status', 'error', 'updated_at'])
+
+        started = time.monotonic()
+        processed = 0
+        try:
+            records = islice(records, job.processed, None)
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                self._import_batch(batch)
+                processed += len(batch)
+                if self.progress:
+                    self.progress(job, processed / max(time.monotonic() - started, 1e-6))
+            self._finish()
+        except Exception as e:
+            job.status = ImportJob.STATUS_FAILED
+            job.error = str(e)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            raise
+        return job
+
+    def _import_batch(self, records):
+        entries, custom_fields, settings_rows = [], [], []
+        skipped = 0
+        for record in records:
+            kind, data = normalize_record(record)
+            if kind == 'entry':
+                entries.append(data)
+            elif kind == 'custom_field':
+                custom_fields.append(data)
+            elif kind == 'settings':
+                settings_rows.append(data)
+            else:
+                skipped += 1
+
+        with transaction.atomic():
+            entries, entry_skipped = self._resolve_users(entries)
+            settings_rows, settings_skipped = self._resolve_users(settings_rows)
+            saved = self._save_entries(entries)
+            touched, field_skipped = self._save_custom_fields(saved, custom_fields)
+            self._save_settings(settings_rows)
+            update_search_vector(touched)
+            if self.rows_storage:
+                # Строки CustomField повторяют JSONB-колонку, в том числе у перезаписанных записей
+                sync_custom_field_rows(touched)
+
+            job = self.job
+            job.processed += len(records)
+            job.imported += len(saved)
+            job.skipped += skipped + entry_skipped + settings_skipped + field_skipped
+            job.user_ids = sorted(set(job.user_ids) | self._user_ids)
+            job.save(update_fields=['processed', 'imported', 'skipped', 'user_ids', 'updated_at'])
+
+    def _resolve_users(self, rows):
+        """ Проставляет пользователя; строки с несуществующими пользователями отбрасываются """
+        if not self.keep_ids:
+            for row in rows:
+                row['user'] = self.job.user_id
+            self._user_ids.update([self.job.user_id] if rows else [])
+            return rows, 0
+        user_ids = {row['user'] for row in rows if row['user']}
+        existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True)) if user_ids else set()
+        kept = [row for row in rows if row['user'] in existing]
+        self._user_ids.update(existing)
+        return kept, len(rows) - len(kept)
+
+    def _save_entries(self, rows):
+        """ Сохраняет записи одним INSERT (и одним UPDATE дат). Возвращает список (запись, теги) """
+        if not rows:
+            return []
+        previous = {}
+        if self.keep_ids:
+            # Перезаписываемые записи: их прежние владельцы пересчитываются в конце импорта,
+            # а время изменения обновляется, чтобы сменились ETag и ключи кеша фрагментов
+            pks = [row['pk'] for row in rows if row['pk']]
+            previous = dict(DiaryEntry.objects.filter(pk__in=pks).values_list('pk', 'user_id')) if pks else {}
+            self._user_ids.update(previous.values())
+        now = timezone.now()
+        objects, dates = [], []
+        for row in rows:
+            entry = DiaryEntry(
+                user_id=row['user'],
+                text=row['text'] or '',
+                targets=(row['targets'] or '')[:255],
+                custom_values={name: str(value) for name, value in row['custom_fields'].items()},
+            )
+            if self.keep_ids and row['pk']:
+                entry.pk = row['pk']
+            created_at = _parse_datetime(row['created_at'])
+            updated_at = now if entry.pk in previous else _parse_datetime(row['updated_at']) or created_at
+            objects.append(entry)
+            dates.append((created_at, updated_at))
+
+        if self.keep_ids:
+            DiaryEntry.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=['id'],
+                update_fields=['user', 'text', 'targets', 'custom_values', 'updated_at'],
+            )
+        else:
+            DiaryEntry.objects.bulk_create(objects)
+
+        # auto_now_add/auto_now подставляют текущее время при вставке: даты из файла
+        # восстанавливаются отдельным UPDATE (bulk_update не вызывает pre_save полей)
+        dated = []
+        for entry, (created_at, updated_at) in zip(objects, dates):
+            if created_at:
+                entry.created_at, entry.updated_at = created_at, updated_at
+                dated.append(entry)
+        if dated:
+            DiaryEntry.objects.bulk_update(dated, ['created_at', 'updated_at'])
+
+        if not self.keep_ids:
+            mapped = {row['pk']: entry.pk for entry, row in zip(objects, rows) if row['pk'] is not None}
+            self._entry_ids.update(mapped)
+            ImportedEntry.objects.bulk_create(
+                [ImportedEntry(job=self.job, source_id=source_id, entry_id=entry_id)
+                 for source_id, entry_id in mapped.items()],
+                update_conflicts=True,
+                unique_fields=['job', 'source_id'],
+                update_fields=['entry'],
+            )
+        self._save_tags([(entry.pk, row['tags']) for entry, row in zip(objects, rows)])
+        return objects
+
+    def _resolve_tags(self, names):
+        """ id тегов по названиям; недостающие теги создаются одним INSERT """
+        missing = set(names) - set(self._tag_ids)
+        if missing:
+            self._tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+            missing -= set(self._tag_ids)
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, slug=Tag().slugify(name)) for name in missing],
+                                    ignore_conflicts=True)
+            self._tag_ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+            # Совпадение slug у разных названий: такие теги создаются по одному с суффиксом в slug
+            for name in missing - set(self._tag_ids):
+                self._tag_ids[name] = Tag.objects.get_or_create(name=name)[0].pk
+        return self._tag_ids
+
+    def _save_tags(self, entry_tags):
+        """ Связи записей с тегами одним INSERT. Перезаписанные записи (импорт с сохранением id)
+        получают ровно теги из файла: их прежние связи удаляются одним DELETE, как при tags.set() """
+        entry_tags = [
+            (entry_id, {str(name).strip()[:100] for name in names} - {''}) for entry_id, names in entry_tags
+        ]
+        if self.keep_ids and entry_tags:
+            TaggedItem.objects.filter(
+                content_type=self.content_type, object_id__in=[entry_id for entry_id, _ in entry_tags],
+            ).delete()
+        tag_ids = self._resolve_tags({name for _, names in entry_tags for name in names})
+        TaggedItem.objects.bulk_create(
+            [
+                TaggedItem(content_type=self.content_type, object_id=entry_id, tag_id=tag_ids[name])
+                for entry_id, names in entry_tags
+                for name in names
+            ],
+            ignore_conflicts=True,
+        )
+
+    def _save_custom_fields(self, entries, rows):
+        """ Добавляет пользовательские поля из строк фикстуры к значениям записей.
+        Возвращает (id затронутых записей, количество пропущенных строк) """
+        touched = {entry.pk for entry in entries}
+        values = defaultdict(dict)
+        skipped = 0
+        missing = {row['entry'] for row in rows if row['entry'] is not None} - set(self._entry_ids)
+        if missing and not self.keep_ids:
+            # Записи из пачек, сохраненных до перезапуска импорта
+            self._entry_ids.update(
+                ImportedEntry.objects.filter(job=self.job, source_id__in=missing).values_list('source_id', 'entry_id')
+            )
+        for row in rows:
+            entry_id = row['entry'] if self.keep_ids else self._entry_ids.get(row['entry'])
+            if entry_id is None or not row['name']:
+                skipped += 1
+                continue
+            values[entry_id][row['name']] = str(row['value'] or '')
+
+        if values:
+            queryset = DiaryEntry.objects.filter(pk__in=values).only('id', 'custom_values')
+            if not self.keep_ids:
+                queryset = queryset.filter(user_id=self.job.user_id)
+            changed = list(queryset)
+            for entry in changed:
+                entry.custom_values = {**entry.custom_values, **values[entry.pk]}
+            DiaryEntry.objects.bulk_update(changed, ['custom_values'])
+            skipped += len(values) - len(changed)
+            touched.update(entry.pk for entry in changed)
+        return touched, skipped
+
+    def _save_settings(self, rows):
+        """ Настройки дневника: вставка или обновление по пользователю """
+        if not rows:
+            return
+        DiarySettings.objects.bulk_create(
+            [DiarySettings(user_id=row['user'], **{name: row[name] for name in SETTINGS_FIELDS if name in row})
+             for row in rows],
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=list(SETTINGS_FIELDS),
+        )
+        for row in rows:
+            invalidate_diary_settings(row['user'])
+
+    def _finish(self):
+        """ Пересчет счетчиков затронутых пользователей и завершение задания """
+        job = self.job
+        if job.user_ids:
+            rebuild_tag_counts(job.user_ids)
+            rebuild_entry_counters(job.user_ids)
+            rebuild_daily_stats(job.user_ids)
+            rebuild_entry_goals(job.user_ids)
+        ImportedEntry.objects.filter(job=job).delete()
+        if self.keep_ids:
+            # После вставки с явными id последовательности нужно сдвинуть за максимальный id
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [DiaryEntry]):
+                    cursor.execute(sql)
+        job.status = ImportJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'finished_at', 'updated_at'])
+
+
+def import_file(job, file, batch_size=None, progress=None):
+    """ Импортирует бинарный файл (NDJSON или фикстуру, возможно сжатые gzip) по заданию """
+    return DiaryImporter(job, batch_size=batch_size, progress=progress).run(open_source(file))
+
+
+def schedule_import(job_id):
+    """ Запускает импорт задачей Celery после фиксации транзакции """
+    transaction.on_commit(lambda: _start_import(job_id))
+
+
+def _start_import(job_id):
+    from .tasks import import_diary
+    try:
+        import_diary.delay(job_id)
+    except Exception as e:
+        # Брокер недоступен: импортируем сразу
+        logger.warning('Не удалось запустить импорт в фоне: %s', e)
+        import_diary(job_id)
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+
+from diary.benchmark import CONNECTION_MODES, measure_connections
+
+
+class Command(BaseCommand):
+    """ Команда для замера накладных расходов на соединение с PostgreSQL: новое соединение
+    на каждый запрос (как без пула), соединение из пула psycopg 3 (DB_POOL) и одно постоянное
+    соединение. Замер выполняется на базе из настроек проекта """
+    help = 'Сравнивает время получения соединения с базой без пула и с пулом'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Количество запросов в каждом потоке')
+        parser.add_argument('--threads', type=int, default=1, help='Количество одновременных потоков')
+        parser.add_argument('--mode', action='append', choices=CONNECTION_MODES,
+                            help='Замерить только этот режим (по умолчанию - все)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Потоков: {options["threads"]}, запросов в потоке: {options["iterations"]}')
+        self.stdout.write(f'{"режим":<12}{"запросов/с":>12}{"p50, мс":>10}{"p95, мс":>10}{"соединений":>12}')
+        for mode in options['mode'] or CONNECTION_MODES:
+            result = measure_connections(mode, options['iterations'], options['threads'])
+            self.stdout.write(
+                f'{mode:<12}{result["per_second"]:>12}{result["p50_ms"]:>10}{result["p95_ms"]:>10}'
+                f'{result["connections"]:>12}'
+            )
@@ -0,0 +1,52 @@
+from django.core.management import BaseCommand, CommandError
+
+from diary.benchmark import find_benchmark_user, load_test, server_paths, session_cookie, start_server, stop_server
+
+SERVER_MODES = ('wsgi', 'asgi')
+
+
+class Command(BaseCommand):
+    """ Команда для сравнения пропускной способности режимов WSGI (синхронные воркеры gunicorn)
+    и ASGI (воркеры uvicorn с асинхронными контроллерами). Для каждого режима запускается
+    gunicorn с gunicorn.conf.py, и главная страница, список и просмотр записи запрашиваются
+    параллельно от имени пользователя; выводятся запросы в секунду и задержки p50/p95 """
+    help = 'Сравнивает пропускную способность сайта в режимах WSGI и ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='id или email пользователя (по умолчанию - сгенерированный '
+                                           'пользователь с наибольшим числом записей)')
+        parser.add_argument('--mode', action='append', choices=SERVER_MODES,
+                            help='Замерить только этот режим (по умолчанию - оба)')
+        parser.add_argument('--workers', type=int, default=2, help='Количество воркеров gunicorn')
+        parser.add_argument('--concurrency', type=int, default=16, help='Количество одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=500, help='Количество запросов на каждую страницу')
+        parser.add_argument('--port', type=int, default=8765, help='Порт для запуска серверов')
+
+    def handle(self, *args, **options):
+        try:
+            user = find_benchmark_user(options['user'])
+            paths = server_paths(user)
+        except ValueError as e:
+            raise CommandError(str(e))
+        cookie = session_cookie(user)
+        base_url = f'http://127.0.0.1:{options["port"]}'
+
+        self.stdout.write(f'Пользователь {user.email}, воркеров: {options["workers"]}, '
+                          f'клиентов: {options["concurrency"]}')
+        self.stdout.write(f'{"режим":<7}{"страница":<10}{"запросов/с":>12}{"p50, мс":>10}{"p95, мс":>10}{"ошибок":>8}')
+        for mode in options['mode'] or SERVER_MODES:
+            try:
+                process = start_server(mode, options['port'], options['workers'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+            try:
+                for name, path in paths.items():
+                    # Прогрев: первые запросы воркеров импортируют модули и открывают соединения
+                    load_test(base_url, [path], cookie, options['concurrency'], options['concurrency'] * 2)
+                    result = load_test(base_url, [path], cookie, options['concurrency'], options['requests'])
+                    self.stdout.write(
+                        f'{mode:<7}{name:<10}{result["rps"]:>12}{result["p50_ms"]!s:>10}'
+                        f'{result["p95_ms"]!s:>10}{result["errors"]:>8}'
+                    )
+            finally:
+                stop_server(process)
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand, CommandError
+
+from diary.benchmark import SESSION_MODES, find_benchmark_user, measure_sessions
+
+
+class Command(BaseCommand):
+    """ Команда для замера загрузки сессии и пользователя на каждый запрос: сессия в базе
+    и пользователь из базы (как без кеширования), пользователь из кеша, сессия cached_db
+    и подписанная cookie. Выводится количество SQL-запросов на запрос и задержки p50/p95 """
+    help = 'Сравнивает хранилища сессий и кеш пользователя по числу SQL-запросов на запрос'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='id или email пользователя (по умолчанию - сгенерированный '
+                                           'пользователь с наибольшим числом записей)')
+        parser.add_argument('--iterations', type=int, default=200, help='Количество замеров каждого режима')
+        parser.add_argument('--mode', action='append', choices=list(SESSION_MODES),
+                            help='Замерить только этот режим (по умолчанию - все)')
+
+    def handle(self, *args, **options):
+        try:
+            user = find_benchmark_user(options['user'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Пользователь {user.email}, замеров: {options["iterations"]}')
+        self.stdout.write(f'{"режим":<16}{"SQL":>6}{"p50, мс":>10}{"p95, мс":>10}')
+        for mode in options['mode'] or SESSION_MODES:
+            result = measure_sessions(user, mode, options['iterations'])
+            self.stdout.write(f'{mode:<16}{result["queries"]:>6}{result["p50_ms"]:>10}{result["p95_ms"]:>10}')
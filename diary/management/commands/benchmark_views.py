@@ -0,0 +1,53 @@
+from django.core.management import BaseCommand, CommandError
+
+from diary.benchmark import (
+    DEFAULT_TOLERANCE, compare, find_benchmark_user, load_baseline, run_benchmark, save_baseline,
+)
+
+
+class Command(BaseCommand):
+    """ Команда для замера горячих путей дневника: список (с поиском и фильтром по тегу),
+    просмотр, создание и редактирование записи, главная страница. Для каждого сценария
+    считаются SQL-запросы и задержки p50/p95; результаты сохраняются в JSON как базовая линия
+    и сравниваются с ней при следующих запусках """
+    help = 'Замеряет задержки и количество SQL-запросов представлений дневника'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='id или email пользователя (по умолчанию - сгенерированный '
+                                           'пользователь с наибольшим числом записей)')
+        parser.add_argument('--iterations', type=int, default=50, help='Количество замеров каждого сценария')
+        parser.add_argument('--warmup', type=int, default=2, help='Количество прогревочных запросов')
+        parser.add_argument('--scenario', action='append', help='Выполнить только этот сценарий')
+        parser.add_argument('--save', metavar='PATH', help='Сохранить результаты в JSON (новая базовая линия)')
+        parser.add_argument('--baseline', metavar='PATH', help='Сравнить результаты с базовой линией')
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='Допустимый рост p95 относительно базовой линии (0.25 - 25%%)')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Завершиться с ошибкой, если найдены регрессии')
+
+    def handle(self, *args, **options):
+        try:
+            user = find_benchmark_user(options['user'])
+            results = run_benchmark(user, options['iterations'], options['warmup'], options['scenario'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Пользователь {user.email}, записей: {results["meta"]["entries"]}')
+        self.stdout.write(f'{"сценарий":<14}{"статус":>8}{"SQL":>6}{"p50, мс":>10}{"p95, мс":>10}')
+        for name, result in results['scenarios'].items():
+            self.stdout.write(
+                f'{name:<14}{result["status"]:>8}{result["queries"]:>6}{result["p50_ms"]:>10}{result["p95_ms"]:>10}'
+            )
+
+        if options['save']:
+            save_baseline(results, options['save'])
+            self.stdout.write(f'Результаты сохранены в {options["save"]}')
+
+        if options['baseline']:
+            regressions = compare(results, load_baseline(options['baseline']), options['tolerance'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f'Регрессия: {regression}'))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS('Регрессий относительно базовой линии нет'))
+            elif options['fail_on_regression']:
+                raise CommandError(f'Найдено регрессий: {len(regressions)}')
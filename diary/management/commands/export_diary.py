@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management import BaseCommand, CommandError
+
+from diary.export import EXPORT_FORMATS, stream_export
+from users.models import User
+
+
+class Command(BaseCommand):
+    """ Команда для выгрузки дневника пользователя в файл (или в стандартный вывод).
+    Записи читаются из базы пачками, поэтому память не растет с размером дневника """
+    help = 'Выгружает записи дневника пользователя в формате NDJSON, JSON или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='id или email пользователя')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='ndjson', help='Формат выгрузки')
+        parser.add_argument('--gzip', action='store_true', help='Сжать выгрузку в gzip')
+        parser.add_argument('--output', '-o', default='-', help='Файл для выгрузки ("-" - стандартный вывод)')
+        parser.add_argument('--chunk-size', type=int, help='Количество записей, читаемых из базы за один раз')
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+        user = User.objects.filter(**lookup).first()
+        if user is None:
+            raise CommandError(f'Пользователь не найден: {options["user"]}')
+
+        blocks = stream_export(user, options['format'], compress=options['gzip'], chunk_size=options['chunk_size'])
+        if options['output'] == '-':
+            output = sys.stdout.buffer
+            for block in blocks:
+                output.write(block)
+            output.flush()
+            return
+
+        size = 0
+        with open(options['output'], 'wb') as output:
+            for block in blocks:
+                output.write(block)
+                size += len(block)
+        self.stdout.write(self.style.SUCCESS(f'Готово. Записано {size} байт в {options["output"]}'))
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from diary.drafts import flush_drafts
+
+
+class Command(BaseCommand):
+    """ Команда для переноса автосохраненных черновиков записей из кеша в базу """
+    help = 'Переносит черновики записей из очереди в кеше в таблицу черновиков пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Количество черновиков в одной пачке')
+
+    def handle(self, *args, **options):
+        saved = flush_drafts(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Готово. Сохранено черновиков: {saved}'))
@@ -0,0 +1,40 @@
+from django.core.management import BaseCommand
+
+from diary.synthetic import SYNTHETIC_EMAIL_DOMAIN, SYNTHETIC_PASSWORD, clear_synthetic_data, generate_diary_data
+
+
+class Command(BaseCommand):
+    """ Команда для генерации тестовых данных для нагрузочных замеров: пользователи
+    с настройками дневника и записями разной длины, тегами и пользовательскими полями """
+    help = 'Генерирует пользователей и записи дневника для замеров производительности'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Количество пользователей')
+        parser.add_argument('--entries', type=int, default=1000, help='Среднее количество записей на пользователя')
+        parser.add_argument('--days', type=int, default=730, help='За сколько последних дней распределить записи')
+        parser.add_argument('--seed', type=int, help='Зерно генератора случайных чисел (для воспроизводимости)')
+        parser.add_argument('--batch-size', type=int, help='Количество записей в одной пачке вставки')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированных пользователей')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted = clear_synthetic_data()
+            self.stdout.write(f'Удалено записей: {deleted}')
+            if not options['users']:
+                return
+
+        def progress(job, rate):
+            self.stdout.write(f'Сохранено записей: {job.imported} ({rate:.0f} строк/с)')
+
+        job = generate_diary_data(
+            options['users'],
+            options['entries'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            days=options['days'],
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Создано записей: {job.imported}. Пользователи: bench<N>@{SYNTHETIC_EMAIL_DOMAIN}, '
+            f'пароль: {SYNTHETIC_PASSWORD}'
+        ))
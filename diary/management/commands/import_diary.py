@@ -0,0 +1,52 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from diary.importer import import_file
+from diary.models import ImportJob
+from users.models import User
+
+
+class Command(BaseCommand):
+    """ Команда для импорта записей дневника из файла NDJSON (выгрузка export_diary)
+    или фикстуры (diary.json). Записи сохраняются пачками; если импорт прервался,
+    его можно продолжить с последней сохраненной пачки параметром --resume """
+    help = 'Импортирует записи дневника из файла NDJSON или фикстуры пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу (можно сжатому gzip)')
+        parser.add_argument('--user', help='id или email пользователя, которому импортировать записи '
+                                           '(без него id записей и пользователи берутся из фикстуры)')
+        parser.add_argument('--batch-size', type=int, help='Количество записей файла в одной пачке')
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help='Продолжить прерванное задание импорта')
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['path']):
+            raise CommandError(f'Файл не найден: {options["path"]}')
+        if options['resume']:
+            job = ImportJob.objects.filter(pk=options['resume']).first()
+            if job is None:
+                raise CommandError(f'Задание импорта не найдено: {options["resume"]}')
+            self.stdout.write(f'Продолжение задания {job.pk} с записи {job.processed}')
+        else:
+            user = None
+            if options['user']:
+                lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+                user = User.objects.filter(**lookup).first()
+                if user is None:
+                    raise CommandError(f'Пользователь не найден: {options["user"]}')
+            job = ImportJob.objects.create(user=user, source=options['path'])
+
+        def progress(job, rate):
+            self.stdout.write(f'Обработано записей: {job.processed}, импортировано: {job.imported} '
+                              f'({rate:.0f} строк/с)')
+
+        try:
+            with open(options['path'], 'rb') as file:
+                import_file(job, file, batch_size=options['batch_size'], progress=progress)
+        except Exception as e:
+            raise CommandError(f'Импорт прерван: {e}. Продолжить: --resume {job.pk}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. Импортировано записей: {job.imported}, пропущено: {job.skipped}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from diary.daily_stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    """ Команда для пересборки дневных сводок записей (календарь и статистика) с нуля """
+    help = 'Пересобирает дневные сводки записей пользователей по текущим записям дневника'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Пересобрать только для пользователя с этим id')
+
+    def handle(self, *args, **options):
+        created = rebuild_daily_stats(options['user'])
+        self.stdout.write(self.style.SUCCESS(f'Готово. Строк сводок: {created}'))
@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from diary.counters import rebuild_entry_counters
+
+
+class Command(BaseCommand):
+    """ Команда для пересчета счетчиков записей (по пользователям и общего) """
+    help = 'Пересчитывает счетчики записей дневника с нуля'
+
+    def handle(self, *args, **options):
+        total = rebuild_entry_counters()
+        self.stdout.write(self.style.SUCCESS(f'Готово. Всего записей: {total}'))
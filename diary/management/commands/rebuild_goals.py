@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from diary.goals import rebuild_entry_goals
+
+
+class Command(BaseCommand):
+    """ Команда для пересборки связей записей с целями по полю "Цели" """
+    help = 'Разбирает поле "Цели" записей в таблицы целей и связей записей с целями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Пересобрать только для пользователя с этим id')
+
+    def handle(self, *args, **options):
+        created = rebuild_entry_goals(options['user'])
+        self.stdout.write(self.style.SUCCESS(f'Готово. Связей записей с целями: {created}'))
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from diary.tag_counts import rebuild_tag_counts
+
+
+class Command(BaseCommand):
+    """ Команда для пересборки таблицы счетчиков тегов (облака тегов) с нуля """
+    help = 'Пересобирает счетчики тегов пользователей по текущим записям дневника'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', help='Пересобрать только для пользователя с этим id')
+
+    def handle(self, *args, **options):
+        created = rebuild_tag_counts(options['user'])
+        self.stdout.write(self.style.SUCCESS(f'Готово. Строк счетчиков: {created}'))
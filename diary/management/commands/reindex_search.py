@@ -0,0 +1,40 @@
+from django.core.management import BaseCommand
+
+from diary.models import DiaryEntry
+from diary.search import update_search_vector
+
+
+class Command(BaseCommand):
+    """ Команда для заполнения и пересчета поискового индекса записей дневника.
+    Записи обрабатываются пачками по возрастанию id, поэтому прерванный запуск
+    можно продолжить с параметром --after-id (или --missing-only) """
+    help = 'Заполняет и пересчитывает поисковый вектор записей дневника'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Количество записей в одной пачке')
+        parser.add_argument(
+            '--after-id', type=int, default=0, help='Продолжить с записей, id которых больше указанного',
+        )
+        parser.add_argument('--missing-only', action='store_true', help='Обработать только записи без вектора')
+        parser.add_argument('--user', type=int, help='Обработать только записи пользователя с этим id')
+
+    def handle(self, *args, **options):
+        queryset = DiaryEntry.objects.all()
+        if options['missing_only']:
+            queryset = queryset.filter(search_vector__isnull=True)
+        if options['user']:
+            queryset = queryset.filter(user_id=options['user'])
+
+        last_id = options['after_id']
+        total = 0
+        while True:
+            ids = list(
+                queryset.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            total += update_search_vector(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Обработано записей: {total}, последний id: {last_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово. Переиндексировано записей: {total}'))
@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from diary.services import sync_custom_field_rows
+
+
+class Command(BaseCommand):
+    """ Команда для пересборки строк CustomField по JSONB-колонке записей. Нужна перед
+    переключением DIARY_CUSTOM_FIELDS_STORAGE с 'json' на 'rows': в режиме 'json' строки не обновляются """
+    help = 'Пересобирает таблицу пользовательских полей по значениям custom_values записей дневника'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entry', type=int, action='append', help='Пересобрать только для записи с этим id')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sync_custom_field_rows(options['entry'])
+        self.stdout.write(self.style.SUCCESS('Готово'))
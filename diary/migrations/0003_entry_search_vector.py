@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:19
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0002_diarysettings'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diaryentry',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.AddField(
+            model_name='diarysettings',
+            name='custom_fields_names',
+            field=models.JSONField(blank=True, default=list, help_text='Список названий дополнительных полей для записей', verbose_name='Названия кастомных полей'),
+        ),
+        migrations.AddField(
+            model_name='diarysettings',
+            name='default_targets',
+            field=models.CharField(blank=True, help_text='Эти цели будут автоматически подставляться в новые записи', max_length=255, verbose_name='Цели по умолчанию'),
+        ),
+        migrations.AddIndex(
+            model_name='diaryentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='diary_entry_search_idx'),
+        ),
+    ]
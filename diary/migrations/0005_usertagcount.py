@@ -0,0 +1,70 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+
+
+def fill_tag_counts(apps, schema_editor):
+    """ Заполняет счетчики тегов по уже существующим записям """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    UserTagCount = apps.get_model('diary', 'UserTagCount')
+
+    content_type = ContentType.objects.filter(app_label='diary', model='diaryentry').first()
+    if content_type is None:
+        return
+    entries = DiaryEntry.objects.filter(pk=OuterRef('object_id'))
+    rows = (
+        TaggedItem.objects.filter(content_type=content_type)
+        .annotate(
+            entry_user_id=Subquery(entries.values('user_id')),
+            entry_updated_at=Subquery(entries.values('updated_at')),
+        )
+        .filter(entry_user_id__isnull=False)
+        .values('entry_user_id', 'tag_id')
+        .annotate(entry_count=Count('id'), last_used_at=Max('entry_updated_at'))
+    )
+    UserTagCount.objects.bulk_create(
+        [
+            UserTagCount(
+                user_id=row['entry_user_id'],
+                tag_id=row['tag_id'],
+                entry_count=row['entry_count'],
+                last_used_at=row['last_used_at'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('diary', '0004_entry_user_created_index'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_count', models.PositiveIntegerField(default=0, verbose_name='Количество записей')),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последнее использование')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_counts', to='taggit.tag')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_counts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-entry_count'], name='diary_tagcount_user_count_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'tag'), name='diary_usertagcount_user_tag_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_tag_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:23
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_custom_fields(apps, schema_editor):
+    """ Оставляет по одному (последнему) значению каждого поля записи перед созданием ограничения """
+    CustomField = apps.get_model('diary', 'CustomField')
+    latest_ids = CustomField.objects.values('entry_id', 'name').annotate(latest_id=Max('id')).values('latest_id')
+    CustomField.objects.exclude(id__in=latest_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0005_usertagcount'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_custom_fields, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='customfield',
+            constraint=models.UniqueConstraint(fields=('entry', 'name'), name='diary_customfield_entry_name_uniq'),
+        ),
+    ]
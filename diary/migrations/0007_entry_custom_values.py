@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:24
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+# Переносим значения из таблицы CustomField в JSONB-колонку записи
+FOLD_CUSTOM_FIELDS_SQL = """
+UPDATE diary_diaryentry AS entry
+SET custom_values = folded.custom_values
+FROM (
+    SELECT entry_id, jsonb_object_agg(name, value) AS custom_values
+    FROM diary_customfield
+    GROUP BY entry_id
+) AS folded
+WHERE entry.id = folded.entry_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0006_customfield_entry_name_unique'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diaryentry',
+            name='custom_values',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Пользовательские поля'),
+        ),
+        migrations.RunSQL(FOLD_CUSTOM_FIELDS_SQL, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='diaryentry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['custom_values'], name='diary_entry_custom_values_idx', opclasses=['jsonb_path_ops']),
+        ),
+    ]
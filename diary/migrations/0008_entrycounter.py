@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_entry_counters(apps, schema_editor):
+    """ Заполняет счетчики записей по уже существующим данным """
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+    EntryCounter = apps.get_model('diary', 'EntryCounter')
+    rows = DiaryEntry.objects.values('user_id').annotate(entry_count=Count('id')).order_by()
+    counters = [EntryCounter(user_id=row['user_id'], entry_count=row['entry_count']) for row in rows]
+    total = sum(counter.entry_count for counter in counters)
+    EntryCounter.objects.bulk_create(counters + [EntryCounter(user=None, entry_count=total)], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0007_entry_custom_values'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_count', models.BigIntegerField(default=0, verbose_name='Количество записей')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user',), name='diary_entrycounter_user_uniq', nulls_distinct=False)],
+            },
+        ),
+        migrations.RunPython(fill_entry_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:06
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import migrations, models
+from django.db.models import Count, F, Func, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Length, TruncDate
+
+
+def fill_daily_stats(apps, schema_editor):
+    """ Заполняет дневные сводки по уже существующим записям """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    DailyStat = apps.get_model('diary', 'DailyStat')
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+
+    entries = DiaryEntry.objects.annotate(day=TruncDate('created_at'))
+    tags = {}
+    content_type = ContentType.objects.filter(app_label='diary', model='diaryentry').first()
+    if content_type is not None:
+        entry = entries.filter(pk=OuterRef('object_id'))
+        rows = (
+            TaggedItem.objects.filter(content_type=content_type)
+            .annotate(entry_user_id=Subquery(entry.values('user_id')), entry_day=Subquery(entry.values('day')))
+            .filter(entry_user_id__isnull=False)
+            .values('entry_user_id', 'entry_day')
+            .annotate(tag_ids=ArrayAgg('tag_id', distinct=True))
+            .order_by()
+        )
+        tags = {(row['entry_user_id'], row['entry_day']): sorted(row['tag_ids']) for row in rows.iterator()}
+
+    words = Func(F('text'), Value(r'\S+'), function='regexp_count', output_field=IntegerField())
+    rows = entries.values('user_id', 'day').annotate(
+        entry_count=Count('id'), word_count=Sum(words), char_count=Sum(Length('text')),
+    ).order_by()
+    stats = []
+    for row in rows.iterator():
+        tag_ids = tags.get((row['user_id'], row['day']), [])
+        stats.append(DailyStat(
+            user_id=row['user_id'], date=row['day'], entry_count=row['entry_count'], word_count=row['word_count'],
+            char_count=row['char_count'], tag_ids=tag_ids, tag_count=len(tag_ids),
+        ))
+    DailyStat.objects.bulk_create(stats, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0010_diaryentry_user_updated_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('entry_count', models.PositiveIntegerField(default=0, verbose_name='Количество записей')),
+                ('word_count', models.PositiveIntegerField(default=0, verbose_name='Количество слов')),
+                ('char_count', models.PositiveIntegerField(default=0, verbose_name='Количество символов')),
+                ('tag_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), blank=True, default=list, size=None, verbose_name='Теги за день')),
+                ('tag_count', models.PositiveIntegerField(default=0, verbose_name='Количество разных тегов')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'date'), name='diary_dailystat_user_date_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_daily_stats, migrations.RunPython.noop),
+    ]
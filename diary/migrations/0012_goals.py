@@ -0,0 +1,87 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:09
+
+import re
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def split_goals(targets):
+    """ Цели из текста поля "Цели" (как diary.goals.parse_goals на момент миграции) """
+    goals = {}
+    for part in re.split(r'[,;\n]+', targets or ''):
+        name = ' '.join(part.split())[:100]
+        if name:
+            goals.setdefault(name.casefold()[:100], name)
+    return goals
+
+
+def fill_goals(apps, schema_editor):
+    """ Разбирает поле "Цели" существующих записей в таблицы целей и связей """
+    DiaryEntry = apps.get_model('diary', 'DiaryEntry')
+    EntryGoal = apps.get_model('diary', 'EntryGoal')
+    Goal = apps.get_model('diary', 'Goal')
+
+    entries = list(DiaryEntry.objects.exclude(targets='').values_list('id', 'user_id', 'created_at', 'targets'))
+    parsed = {entry_id: split_goals(targets) for entry_id, _, _, targets in entries}
+    names = {}
+    for entry_id, user_id, _, _ in entries:
+        for key, name in parsed[entry_id].items():
+            names.setdefault((user_id, key), name)
+    Goal.objects.bulk_create(
+        [Goal(user_id=user_id, key=key, name=name) for (user_id, key), name in names.items()],
+        batch_size=1000,
+    )
+    goal_ids = {(user_id, key): goal_id for goal_id, user_id, key in Goal.objects.values_list('id', 'user_id', 'key')}
+    EntryGoal.objects.bulk_create(
+        [
+            EntryGoal(entry_id=entry_id, goal_id=goal_ids[user_id, key], created_at=created_at)
+            for entry_id, user_id, created_at, _ in entries
+            for key in parsed[entry_id]
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0011_dailystat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Goal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('key', models.CharField(max_length=100, verbose_name='Ключ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='goals', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EntryGoal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(verbose_name='Дата записи')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='goal_links', to='diary.diaryentry')),
+                ('goal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entry_links', to='diary.goal')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='goal',
+            constraint=models.UniqueConstraint(fields=('user', 'key'), name='diary_goal_user_key_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='entrygoal',
+            index=models.Index(fields=['goal', '-created_at', '-id'], name='diary_entrygoal_goal_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='entrygoal',
+            constraint=models.UniqueConstraint(fields=('entry', 'goal'), name='diary_entrygoal_entry_goal_uniq'),
+        ),
+        migrations.RunPython(fill_goals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0012_goals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryDraft',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(blank=True, verbose_name='Основной текст')),
+                ('targets', models.CharField(blank=True, max_length=255, verbose_name='Цели')),
+                ('tags', models.CharField(blank=True, max_length=255, verbose_name='Теги')),
+                ('custom_values', models.JSONField(blank=True, default=dict, verbose_name='Пользовательские поля')),
+                ('saved_at', models.DateTimeField(verbose_name='Дата автосохранения')),
+                ('entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='drafts', to='diary.diaryentry')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entry_drafts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'entry'), name='diary_entrydraft_user_entry_uniq', nulls_distinct=False)],
+            },
+        ),
+    ]
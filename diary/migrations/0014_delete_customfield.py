@@ -0,0 +1,16 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0013_entrydraft'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='CustomField',
+        ),
+    ]
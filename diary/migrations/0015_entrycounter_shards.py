@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0014_delete_customfield'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='entrycounter',
+            name='diary_entrycounter_user_uniq',
+        ),
+        migrations.AddField(
+            model_name='entrycounter',
+            name='shard',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Часть общего счетчика'),
+        ),
+        migrations.AddConstraint(
+            model_name='entrycounter',
+            constraint=models.UniqueConstraint(fields=('user', 'shard'), name='diary_entrycounter_user_shard_uniq', nulls_distinct=False),
+        ),
+    ]
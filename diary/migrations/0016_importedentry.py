@@ -0,0 +1,26 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0015_entrycounter_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_id', models.BigIntegerField(verbose_name='id записи в файле')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='diary.diaryentry')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imported_entries', to='diary.importjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'source_id'), name='diary_importedentry_job_source_uniq')],
+            },
+        ),
+    ]
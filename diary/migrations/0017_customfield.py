@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Таблица CustomField возвращается рядом с JSONB-колонкой (режим DIARY_CUSTOM_FIELDS_STORAGE='rows'):
+# строки заполняются из custom_values записей
+FILL_CUSTOM_FIELDS_SQL = """
+INSERT INTO diary_customfield (entry_id, name, value)
+SELECT entry.id, field.key, left(field.value, 255)
+FROM diary_diaryentry AS entry, jsonb_each_text(entry.custom_values) AS field
+WHERE length(field.key) <= 50
+ON CONFLICT (entry_id, name) DO NOTHING
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('diary', '0016_importedentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomField',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('value', models.CharField(max_length=255)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custom_fields', to='diary.diaryentry')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('entry', 'name'), name='diary_customfield_entry_name_uniq')],
+            },
+        ),
+        migrations.RunSQL(FILL_CUSTOM_FIELDS_SQL, migrations.RunSQL.noop),
+    ]
@@ -1,5 +1,10 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 from taggit.managers import TaggableManager
+from taggit.models import Tag
 
 from users.models import User
 
@@ -12,14 +17,36 @@ class DiaryEntry(models.Model):
     text = models.TextField('Основной текст')
     targets = models.CharField(max_length=255, blank=True, help_text='Напишите здесь свои цели')
     tags = TaggableManager(blank=True, help_text='Введите теги через запятую')
+    custom_values = models.JSONField('Пользовательские поля', default=dict, blank=True)
+    search_vector = SearchVectorField('Поисковый вектор', null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='diary_entry_user_created_idx'),
+            # Дата последнего изменения и количество записей пользователя для ETag списка (index-only scan)
+            models.Index(fields=['user', 'updated_at'], name='diary_entry_user_updated_idx'),
+            GinIndex(fields=['search_vector'], name='diary_entry_search_idx'),
+            GinIndex(fields=['custom_values'], name='diary_entry_custom_values_idx', opclasses=['jsonb_path_ops']),
+        ]
+
+    def get_custom_fields(self, field_names=()):
+        """ Пользовательские поля записи списком {name, value}: сначала в порядке field_names, затем остальные """
+        names = [name for name in field_names if name in self.custom_values]
+        names += [name for name in self.custom_values if name not in names]
+        return [{'name': name, 'value': self.custom_values[name]} for name in names]
 
 
 class CustomField(models.Model):
-    """ Модель пользовательских полей дневника """
+    """ Модель пользовательских полей дневника (построчное хранение, см. DIARY_CUSTOM_FIELDS_STORAGE) """
     entry = models.ForeignKey(DiaryEntry, on_delete=models.CASCADE, related_name='custom_fields')
     name = models.CharField(max_length=50)
     value = models.CharField(max_length=255)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['entry', 'name'], name='diary_customfield_entry_name_uniq'),
+        ]
+
 
 class DiarySettings(models.Model):
     """ Модель настроек вида дневника """
@@ -43,3 +70,149 @@ class DiarySettings(models.Model):
         verbose_name="Названия кастомных полей",
         help_text="Список названий дополнительных полей для записей"
     )
+
+
+class UserTagCount(models.Model):
+    """ Модель счетчика записей пользователя с тегом (для облака тегов) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tag_counts')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='user_counts')
+    entry_count = models.PositiveIntegerField('Количество записей', default=0)
+    last_used_at = models.DateTimeField('Последнее использование', default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'tag'], name='diary_usertagcount_user_tag_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-entry_count'], name='diary_tagcount_user_count_idx'),
+        ]
+
+
+class EntryCounter(models.Model):
+    """ Модель счетчика записей дневника: по пользователю или общий по сайту (user не задан).
+    Общий счетчик разбит на строки-части (shard), значение - их сумма (см. diary/counters.py) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    shard = models.PositiveSmallIntegerField('Часть общего счетчика', default=0)
+    entry_count = models.BigIntegerField('Количество записей', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'shard'], name='diary_entrycounter_user_shard_uniq', nulls_distinct=False,
+            ),
+        ]
+
+
+class Goal(models.Model):
+    """ Модель цели пользователя, разобранной из поля "Цели" записей (см. diary/goals.py).
+    key - нормализованное название (без лишних пробелов, без учета регистра) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='goals')
+    name = models.CharField('Название', max_length=100)
+    key = models.CharField('Ключ', max_length=100)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='diary_goal_user_key_uniq'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class EntryGoal(models.Model):
+    """ Модель связи записи с целью. Дата записи хранится здесь же, чтобы записи с целью
+    и прогресс по месяцам читались по индексу (goal, created_at, id) без обращения к таблице записей """
+    entry = models.ForeignKey(DiaryEntry, on_delete=models.CASCADE, related_name='goal_links')
+    goal = models.ForeignKey(Goal, on_delete=models.CASCADE, related_name='entry_links')
+    created_at = models.DateTimeField('Дата записи')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['entry', 'goal'], name='diary_entrygoal_entry_goal_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['goal', '-created_at', '-id'], name='diary_entrygoal_goal_date_idx'),
+        ]
+
+
+class EntryDraft(models.Model):
+    """ Модель черновика формы записи: новой (entry не задан) или редактируемой.
+    Автосохранение пишет черновики в кеш, а сюда они переносятся пачками (см. diary/drafts.py) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='entry_drafts')
+    entry = models.ForeignKey(DiaryEntry, on_delete=models.CASCADE, null=True, blank=True, related_name='drafts')
+    text = models.TextField('Основной текст', blank=True)
+    targets = models.CharField('Цели', max_length=255, blank=True)
+    tags = models.CharField('Теги', max_length=255, blank=True)
+    custom_values = models.JSONField('Пользовательские поля', default=dict, blank=True)
+    saved_at = models.DateTimeField('Дата автосохранения')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'entry'], name='diary_entrydraft_user_entry_uniq',
+                                    nulls_distinct=False),
+        ]
+
+
+class DailyStat(models.Model):
+    """ Модель дневной сводки записей пользователя (календарь и статистика): количество записей,
+    слов, символов и разные теги за день. Обновляется при изменении записей (см. diary/daily_stats.py) """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField('Дата')
+    entry_count = models.PositiveIntegerField('Количество записей', default=0)
+    word_count = models.PositiveIntegerField('Количество слов', default=0)
+    char_count = models.PositiveIntegerField('Количество символов', default=0)
+    tag_ids = ArrayField(models.IntegerField(), verbose_name='Теги за день', default=list, blank=True)
+    tag_count = models.PositiveIntegerField('Количество разных тегов', default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='diary_dailystat_user_date_uniq'),
+        ]
+
+
+class ImportJob(models.Model):
+    """ Модель задания импорта записей дневника. processed - контрольная точка:
+    количество прочитанных записей файла, сохраненных вместе с последней пачкой """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Завершен'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='import_jobs',
+        help_text='Пользователь, которому принадлежат импортируемые записи (если не задан - берется из файла)',
+    )
+    source = models.CharField('Файл', max_length=500)
+    status = models.CharField('Статус', max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    processed = models.PositiveIntegerField('Обработано записей файла', default=0)
+    imported = models.PositiveIntegerField('Импортировано записей дневника', default=0)
+    skipped = models.PositiveIntegerField('Пропущено записей файла', default=0)
+    user_ids = models.JSONField('Затронутые пользователи', default=list, blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+    finished_at = models.DateTimeField('Дата завершения', null=True, blank=True)
+
+    def __str__(self):
+        return f'Импорт {self.source} ({self.get_status_display()})'
+
+
+class ImportedEntry(models.Model):
+    """ Модель соответствия id записи в файле импорта и созданной записи (импорт с новыми id).
+    Сохраняется вместе с пачкой, поэтому после продолжения прерванного импорта пользовательские поля
+    фикстуры находят записи из уже сохраненных пачек. Удаляется по завершении задания """
+    job = models.ForeignKey(ImportJob, on_delete=models.CASCADE, related_name='imported_entries')
+    source_id = models.BigIntegerField('id записи в файле')
+    entry = models.ForeignKey(DiaryEntry, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'source_id'], name='diary_importedentry_job_source_uniq'),
+        ]
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CursorPage:
+    """ Страница курсорной пагинации: записи и непрозрачные курсоры соседних страниц """
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[-1], 'next')
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode_cursor(self.object_list[0], 'prev')
+        return None
+
+
+class KeysetPaginator:
+    """ Курсорная (keyset) пагинация по ключу (created_at, id) в порядке убывания.
+    Вместо OFFSET следующая страница выбирается условием по ключу последней записи,
+    поэтому глубокие страницы открываются так же быстро, как первая, и не нужен COUNT(*) """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @cached_property
+    def count(self):
+        """ Общее количество записей (считается только при обращении) """
+        return self.queryset.count()
+
+    @staticmethod
+    def encode_cursor(entry, direction):
+        payload = json.dumps([direction, entry.created_at.isoformat(), entry.pk])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """ Возвращает (direction, created_at, id) или None, если курсор некорректен """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, created_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+            if direction not in ('next', 'prev'):
+                return None
+            return direction, datetime.fromisoformat(created_at), int(pk)
+        except (binascii.Error, ValueError, TypeError):
+            return None
+
+    def page(self, cursor=None):
+        decoded = self.decode_cursor(cursor) if cursor else None
+        queryset = self.queryset.order_by()
+
+        if decoded is None:
+            rows = list(queryset.order_by('-created_at', '-id')[:self.per_page + 1])
+            has_next, has_previous = len(rows) > self.per_page, False
+            return CursorPage(rows[:self.per_page], self, has_next, has_previous)
+
+        direction, created_at, pk = decoded
+        if direction == 'next':
+            # Условие created_at__lte дублирует ключ, чтобы PostgreSQL мог сканировать индекс по диапазону
+            rows = list(
+                queryset.filter(created_at__lte=created_at)
+                .filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+                .order_by('-created_at', '-id')[:self.per_page + 1]
+            )
+            has_next, has_previous = len(rows) > self.per_page, True
+            return CursorPage(rows[:self.per_page], self, has_next, has_previous)
+
+        rows = list(
+            queryset.filter(created_at__gte=created_at)
+            .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            .order_by('created_at', 'id')[:self.per_page + 1]
+        )
+        has_next, has_previous = True, len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return CursorPage(rows, self, has_next, has_previous)
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db.models import F, Func, OuterRef, Subquery, TextField
+from django.utils import timezone
+from taggit.models import TaggedItem
+
+from .models import DiaryEntry
+
+# Маркеры подсветки найденных слов. Экранирование и замена на <mark>
+# выполняются фильтром highlight, чтобы текст записи не попадал в шаблон без escape
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+
+def get_search_configs():
+    """ Конфигурации полнотекстового поиска PostgreSQL (по умолчанию русская и английская) """
+    return getattr(settings, 'DIARY_SEARCH_CONFIGS', ('russian', 'english'))
+
+
+def _tags_document():
+    """ Подзапрос: названия тегов записи одной строкой """
+    content_type = ContentType.objects.get_for_model(DiaryEntry)
+    return Subquery(
+        TaggedItem.objects.filter(content_type=content_type, object_id=OuterRef('pk'))
+        .values('object_id')
+        .annotate(document=StringAgg('tag__name', delimiter=' '))
+        .values('document')
+    )
+
+
+class JSONValuesText(Func):
+    """ Значения JSON-объекта одной строкой """
+    template = "(SELECT string_agg(value, ' ') FROM jsonb_each_text(%(expressions)s))"
+    output_field = TextField()
+
+
+def build_search_vector():
+    """ Выражение tsvector для записи: текст, цели, теги и пользовательские поля """
+    parts = [
+        ('text', 'A'),
+        ('targets', 'B'),
+        (_tags_document(), 'B'),
+        (JSONValuesText('custom_values'), 'C'),
+    ]
+    vector = None
+    for config in get_search_configs():
+        for expression, weight in parts:
+            part = SearchVector(expression, config=config, weight=weight)
+            vector = part if vector is None else vector + part
+    return vector
+
+
+def update_search_vector(entry_ids, touch=False):
+    """ Пересчитывает поисковый вектор для записей с указанными id одним UPDATE.
+    touch=True заодно обновляет время изменения записей (теги изменились без save()) """
+    entry_ids = list(entry_ids)
+    if not entry_ids:
+        return 0
+    fields = {'search_vector': build_search_vector()}
+    if touch:
+        fields['updated_at'] = timezone.now()
+    return DiaryEntry.objects.filter(pk__in=entry_ids).update(**fields)
+
+
+def build_search_query(text):
+    """ Поисковый запрос сразу во всех конфигурациях (слова ищутся и по-русски, и по-английски) """
+    query = None
+    for config in get_search_configs():
+        part = SearchQuery(text, config=config, search_type='websearch')
+        query = part if query is None else query | part
+    return query
+
+
+def search_entries(queryset, text):
+    """ Фильтрует записи по поисковому запросу, сортирует по релевантности и добавляет сниппет """
+    query = build_search_query(text)
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query),
+        headline=SearchHeadline(
+            'text',
+            query,
+            config=get_search_configs()[0],
+            start_sel=HIGHLIGHT_START,
+            stop_sel=HIGHLIGHT_STOP,
+            max_words=35,
+            min_words=15,
+        ),
+    ).order_by('-rank', '-created_at', '-id')
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .models import CustomField, DiaryEntry, DiarySettings
+from .search import update_search_vector
+
+# Префикс параметров списка записей для фильтрации по пользовательским полям (?cf_mood=хорошее)
+CUSTOM_FIELD_PARAM_PREFIX = 'cf_'
+
+
+def settings_cache_key(user_id):
+    return f'diary:settings:{user_id}'
+
+
+def get_diary_settings(request):
+    """ Настройки дневника текущего пользователя.
+    В пределах запроса объект запоминается на request, между запросами (если
+    DIARY_SETTINGS_CACHE_TIMEOUT не 0) хранится в кеше.
+    Если настроек еще нет, они создаются один раз со значениями по умолчанию """
+    diary_settings = getattr(request, '_diary_settings', None)
+    if diary_settings is not None:
+        return diary_settings
+
+    timeout = getattr(settings, 'DIARY_SETTINGS_CACHE_TIMEOUT', 60 * 60)
+    key = settings_cache_key(request.user.pk)
+    diary_settings = cache.get(key) if timeout else None
+    if diary_settings is None:
+        diary_settings, created = DiarySettings.objects.get_or_create(user=request.user)
+        if timeout:
+            cache.set(key, diary_settings, timeout)
+
+    request._diary_settings = diary_settings
+    return diary_settings
+
+
+def invalidate_diary_settings(user_id):
+    """ Удаляет настройки пользователя из кеша (вызывается при каждом сохранении настроек) """
+    cache.delete(settings_cache_key(user_id))
+
+
+def settings_version(diary_settings):
+    """ Версия настроек дневника, влияющих на вид страниц (для ETag страниц) """
+    return [
+        diary_settings.show_targets,
+        diary_settings.show_tags,
+        diary_settings.theme,
+        diary_settings.custom_fields_names,
+    ]
+
+
+def custom_values_from_post(post, field_names):
+    """ Значения пользовательских полей из данных формы (пустые значения отбрасываются) """
+    values = {}
+    for field_name in field_names:
+        value = post.get(f'custom_{field_name}', '').strip()
+        if value:
+            values[field_name] = value
+    return values
+
+
+def get_custom_fields_storage():
+    """ Режим хранения пользовательских полей: 'json' (только JSONB-колонка записи)
+    или 'rows' (JSONB-колонка плюс таблица CustomField) """
+    return getattr(settings, 'DIARY_CUSTOM_FIELDS_STORAGE', 'json')
+
+
+def _custom_field_rows_diff(entry, values):
+    """ Разница между значениями и строками CustomField: (новые и измененные, id удаленных) """
+    existing = {field.name: field for field in entry.custom_fields.all()}
+    changed = [
+        CustomField(entry=entry, name=name, value=value)
+        for name, value in values.items()
+        if name not in existing or existing[name].value != value
+    ]
+    removed = [field.pk for name, field in existing.items() if name not in values]
+    return changed, removed
+
+
+def save_custom_fields(entry, values):
+    """ Сохраняет пользовательские поля записи, записывая только изменения.
+    JSONB-колонка обновляется одним UPDATE; в режиме 'rows' строки CustomField
+    пишутся одним INSERT ... ON CONFLICT и одним DELETE """
+    json_changed = entry.custom_values != values
+    changed, removed = [], []
+    if get_custom_fields_storage() == 'rows':
+        changed, removed = _custom_field_rows_diff(entry, values)
+    if not json_changed and not changed and not removed:
+        return
+
+    with transaction.atomic():
+        if json_changed:
+            DiaryEntry.objects.filter(pk=entry.pk).update(custom_values=values)
+            entry.custom_values = values
+            update_search_vector([entry.pk])
+        if changed:
+            CustomField.objects.bulk_create(
+                changed,
+                update_conflicts=True,
+                unique_fields=['entry', 'name'],
+                update_fields=['value'],
+            )
+        if removed:
+            CustomField.objects.filter(pk__in=removed).delete()
+
+
+def sync_custom_field_rows(entry_ids=None):
+    """ Приводит строки CustomField указанных записей (без аргумента — всех) к их JSONB-колонке:
+    новые и измененные значения одним INSERT ... ON CONFLICT, лишние строки одним DELETE.
+    Поля с именами длиннее столбца name в таблицу не попадают, длинные значения обрезаются """
+    if entry_ids is not None and not entry_ids:
+        return
+    fields, entries = CustomField._meta.db_table, DiaryEntry._meta.db_table
+    condition, params = ('AND entry.id = ANY(%s)', [list(entry_ids)]) if entry_ids is not None else ('', [])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {fields} (entry_id, name, value)
+            SELECT entry.id, field.key, left(field.value, 255)
+            FROM {entries} AS entry, jsonb_each_text(entry.custom_values) AS field
+            WHERE length(field.key) <= 50 {condition}
+            ON CONFLICT (entry_id, name) DO UPDATE SET value = EXCLUDED.value
+            WHERE {fields}.value IS DISTINCT FROM EXCLUDED.value
+            """,
+            params,
+        )
+        cursor.execute(
+            f"""
+            DELETE FROM {fields} AS field
+            USING {entries} AS entry
+            WHERE field.entry_id = entry.id AND NOT jsonb_exists(entry.custom_values, field.name) {condition}
+            """,
+            params,
+        )
+
+
+def filter_by_custom_fields(queryset, params):
+    """ Фильтрует записи по параметрам вида cf_<поле>=<значение> (запрос идет через GIN-индекс custom_values).
+    Возвращает отфильтрованный queryset и словарь примененных фильтров """
+    filters = {
+        key[len(CUSTOM_FIELD_PARAM_PREFIX):]: value.strip()
+        for key, value in params.items()
+        if key.startswith(CUSTOM_FIELD_PARAM_PREFIX) and len(key) > len(CUSTOM_FIELD_PARAM_PREFIX) and value.strip()
+    }
+    if filters:
+        queryset = queryset.filter(custom_values__contains=filters)
+    return queryset, filters
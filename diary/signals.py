@@ -0,0 +1,107 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from taggit.models import Tag
+
+from .counters import change_entry_count
+from .daily_stats import entry_date, refresh_daily_stat, refresh_entry_stats
+from .fragments import invalidate_tags_versions
+from .goals import sync_entry_goals
+from .models import DiaryEntry, DiarySettings, UserTagCount
+from .search import update_search_vector
+from .services import invalidate_diary_settings
+from .tag_counts import decrement_tag_counts, increment_tag_counts
+
+
+@receiver(post_save, sender=DiaryEntry)
+def entry_saved(sender, instance, created, **kwargs):
+    """ Обновляет поисковый вектор, счетчики записей, дневную сводку и цели после сохранения записи """
+    update_search_vector([instance.pk])
+    if created:
+        change_entry_count(instance.user_id, 1)
+    refresh_daily_stat(instance.user_id, entry_date(instance))
+    sync_entry_goals(instance, created)
+
+
+@receiver(pre_delete, sender=DiaryEntry)
+def entry_deleting(sender, instance, **kwargs):
+    """ Уменьшает счетчики тегов удаляемой записи """
+    decrement_tag_counts(instance.user_id, instance.tags.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=DiaryEntry)
+def entry_deleted(sender, instance, **kwargs):
+    """ Уменьшает счетчики записей и обновляет дневную сводку """
+    change_entry_count(instance.user_id, -1)
+    refresh_daily_stat(instance.user_id, entry_date(instance))
+
+
+@receiver(m2m_changed, sender=DiaryEntry.tags.through)
+def entry_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Обновляет поисковый вектор, время изменения записи (для ключей кеша фрагментов и ETag),
+    счетчики тегов и теги дневной сводки при изменении тегов записи """
+    if reverse:
+        # Изменение со стороны тега: в pk_set лежат id записей
+        if action in ('post_add', 'post_remove') and pk_set:
+            entries = list(DiaryEntry.objects.filter(pk__in=pk_set).values_list('user_id', 'created_at'))
+            change_counts = increment_tag_counts if action == 'post_add' else decrement_tag_counts
+            for user_id, _ in entries:
+                change_counts(user_id, [instance.pk])
+            update_search_vector(pk_set, touch=True)
+            refresh_entry_stats(entries)
+        return
+
+    if not isinstance(instance, DiaryEntry):
+        return
+    if action == 'pre_clear':
+        # Запоминаем теги до очистки, чтобы уменьшить их счетчики после неё
+        instance._cleared_tag_ids = list(instance.tags.values_list('id', flat=True))
+    elif action == 'post_add' and pk_set:
+        increment_tag_counts(instance.user_id, pk_set)
+        update_search_vector([instance.pk], touch=True)
+        refresh_daily_stat(instance.user_id, entry_date(instance))
+    elif action == 'post_remove' and pk_set:
+        decrement_tag_counts(instance.user_id, pk_set)
+        update_search_vector([instance.pk], touch=True)
+        refresh_daily_stat(instance.user_id, entry_date(instance))
+    elif action == 'post_clear':
+        decrement_tag_counts(instance.user_id, getattr(instance, '_cleared_tag_ids', []))
+        update_search_vector([instance.pk], touch=True)
+        refresh_daily_stat(instance.user_id, entry_date(instance))
+
+
+def _tagged_entries(tag):
+    """ Записи с тегом: (id, user_id, created_at) """
+    return list(DiaryEntry.objects.filter(tags=tag).values_list('pk', 'user_id', 'created_at'))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    """ После переименования тега пересчитывает поисковый вектор его записей (с обновлением
+    времени изменения для ETag) и сбрасывает версию тегов в ключах фрагментов их пользователей """
+    if created:
+        return
+    update_search_vector([pk for pk, _, _ in _tagged_entries(instance)], touch=True)
+    invalidate_tags_versions(UserTagCount.objects.filter(tag=instance).values_list('user_id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_deleting(sender, instance, **kwargs):
+    """ Запоминает записи удаляемого тега и сбрасывает версию тегов в ключах фрагментов
+    их пользователей (связи с записями удаляются каскадом, без сигналов m2m_changed) """
+    instance._tagged_entries = _tagged_entries(instance)
+    invalidate_tags_versions(UserTagCount.objects.filter(tag=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    """ Пересчитывает поисковый вектор и дневные сводки (теги дня) записей удаленного тега """
+    entries = getattr(instance, '_tagged_entries', [])
+    update_search_vector([pk for pk, _, _ in entries], touch=True)
+    refresh_entry_stats([(user_id, created_at) for _, user_id, created_at in entries])
+
+
+@receiver(post_save, sender=DiarySettings)
+@receiver(post_delete, sender=DiarySettings)
+def diary_settings_changed(sender, instance, **kwargs):
+    """ Сбрасывает кеш настроек дневника после их изменения """
+    invalidate_diary_settings(instance.user_id)
@@ -0,0 +1,161 @@
+import random
+import re
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.utils import timezone
+from taggit.models import TaggedItem
+
+from users.models import User
+from .counters import rebuild_entry_counters
+from .importer import DiaryImporter
+from .models import CustomField, DiaryEntry, EntryDraft, EntryGoal, ImportedEntry, ImportJob
+
+# Домен адресов сгенерированных пользователей: по нему они находятся при очистке
+SYNTHETIC_EMAIL_DOMAIN = 'bench.local'
+SYNTHETIC_PASSWORD = 'bench-password'
+
+WORDS = (
+    'сегодня вчера утро вечер день неделя работа дом семья друзья книга фильм прогулка парк '
+    'погода солнце дождь снег ветер настроение усталость радость планы цели спорт бег зарядка '
+    'встреча разговор звонок письмо проект задача отчет идея мысль сон завтрак обед ужин кофе '
+    'чай музыка концерт дорога поездка город море лес река кошка собака подарок праздник '
+    'выходные отпуск учеба курс урок язык английский привычка здоровье врач аптека магазин '
+    'покупки деньги бюджет ремонт уборка сад огород цветы весна лето осень зима'
+).split()
+
+TAGS = (
+    'работа дом семья спорт здоровье учеба книги кино путешествия друзья еда планы настроение '
+    'сон деньги ремонт музыка отпуск прогулки праздники идеи привычки питомцы покупки погода'
+).split()
+
+CUSTOM_FIELDS = {
+    'настроение': ('отличное', 'хорошее', 'нормальное', 'плохое'),
+    'погода': ('солнечно', 'облачно', 'дождь', 'снег'),
+    'сон': tuple(str(hours) for hours in range(4, 11)),
+    'шаги': tuple(str(steps) for steps in range(1000, 20001, 500)),
+}
+
+TARGETS = (
+    '', '', 'Прочитать книгу', 'Пробежать 5 км', 'Лечь спать до полуночи', 'Выучить 20 слов',
+    'Закончить проект', 'Позвонить родителям',
+)
+
+# Веса тегов по закону Ципфа: первые теги встречаются намного чаще последних
+TAG_WEIGHTS = [1 / rank for rank in range(1, len(TAGS) + 1)]
+
+
+def _text(rng):
+    """ Текст записи случайной длины: от пары предложений до длинного рассказа """
+    words = max(5, min(int(rng.lognormvariate(4, 0.9)), 2000))
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(5, 15))
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(length))
+        sentences.append(sentence.capitalize() + '.')
+        words -= length
+    return ' '.join(sentences)
+
+
+def generate_entry(rng, user_id, created_at):
+    """ Запись дневника в формате фикстуры со случайными тегами и пользовательскими полями """
+    tag_count = rng.choices((0, 1, 2, 3, 4), weights=(2, 4, 3, 2, 1))[0]
+    fields = rng.sample(sorted(CUSTOM_FIELDS), rng.randint(0, len(CUSTOM_FIELDS)))
+    return {
+        'model': 'diary.diaryentry',
+        'fields': {
+            'user': user_id,
+            'created_at': created_at.isoformat(),
+            'updated_at': (created_at + timedelta(minutes=rng.randint(0, 600))).isoformat(),
+            'text': _text(rng),
+            'targets': rng.choice(TARGETS),
+            'tags': sorted(set(rng.choices(TAGS, weights=TAG_WEIGHTS, k=tag_count))),
+            'custom_values': {name: rng.choice(CUSTOM_FIELDS[name]) for name in fields},
+        },
+    }
+
+
+def create_synthetic_users(count, start=0):
+    """ Создает пользователей bench<N>@bench.local одним INSERT (пароль у всех одинаковый) """
+    password = make_password(SYNTHETIC_PASSWORD)
+    users = [
+        User(
+            email=f'bench{number}@{SYNTHETIC_EMAIL_DOMAIN}',
+            display_name=f'Тестовый пользователь {number}',
+            password=password,
+        )
+        for number in range(start, start + count)
+    ]
+    return User.objects.bulk_create(users, ignore_conflicts=True)
+
+
+def synthetic_users():
+    """ Все сгенерированные пользователи """
+    return User.objects.filter(email__endswith=f'@{SYNTHETIC_EMAIL_DOMAIN}')
+
+
+def next_synthetic_number():
+    """ Номер для следующего пользователя bench<N>: на единицу больше наибольшего из существующих """
+    pattern = re.compile(rf'^bench(\d+)@{re.escape(SYNTHETIC_EMAIL_DOMAIN)}$')
+    numbers = [
+        int(match.group(1))
+        for match in map(pattern.match, synthetic_users().values_list('email', flat=True))
+        if match
+    ]
+    return max(numbers, default=-1) + 1
+
+
+def clear_synthetic_data():
+    """ Удаляет сгенерированных пользователей. Записи и их связи удаляются пачкой DELETE без сигналов
+    (обработчики на каждую запись превратили бы очистку в миллионы запросов), производные таблицы
+    пользователей удаляются каскадом вместе с ними, а общий счетчик записей пересчитывается один раз.
+    Возвращает количество удаленных записей """
+    user_ids = list(synthetic_users().values_list('pk', flat=True))
+    content_type = ContentType.objects.get_for_model(DiaryEntry)
+    entries = f'SELECT id FROM {DiaryEntry._meta.db_table} WHERE user_id = ANY(%s)'
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {TaggedItem._meta.db_table} WHERE content_type_id = %s AND object_id IN ({entries})',
+                [content_type.pk, user_ids],
+            )
+            for model in (CustomField, EntryGoal, ImportedEntry):
+                cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE entry_id IN ({entries})', [user_ids])
+            cursor.execute(f'DELETE FROM {EntryDraft._meta.db_table} WHERE user_id = ANY(%s)', [user_ids])
+            cursor.execute(f'DELETE FROM {DiaryEntry._meta.db_table} WHERE user_id = ANY(%s)', [user_ids])
+            deleted = cursor.rowcount
+        User.objects.filter(pk__in=user_ids).delete()
+        rebuild_entry_counters()
+    return deleted
+
+
+def _records(user_ids, entries_per_user, rng, days):
+    now = timezone.now()
+    for user_id in user_ids:
+        yield {
+            'model': 'diary.diarysettings',
+            'fields': {'user': user_id, 'custom_fields_names': sorted(CUSTOM_FIELDS)},
+        }
+        count = max(0, int(rng.gauss(entries_per_user, entries_per_user / 4))) if entries_per_user else 0
+        dates = sorted(now - timedelta(seconds=rng.randint(0, days * 24 * 60 * 60)) for _ in range(count))
+        for created_at in dates:
+            yield generate_entry(rng, user_id, created_at)
+
+
+def generate_diary_data(users, entries_per_user, seed=None, batch_size=None, days=730, progress=None):
+    """ Генерирует пользователей с настройками и записями дневника (в среднем entries_per_user
+    на пользователя, даты за последние days дней). Записи сохраняются пакетным импортом,
+    поэтому поисковый вектор и счетчики заполняются так же, как при обычном импорте """
+    rng = random.Random(seed)
+    start = next_synthetic_number()
+    create_synthetic_users(users, start)
+    user_ids = list(
+        synthetic_users()
+        .filter(email__in=[f'bench{number}@{SYNTHETIC_EMAIL_DOMAIN}' for number in range(start, start + users)])
+        .values_list('pk', flat=True)
+    )
+    job = ImportJob.objects.create(source=f'synthetic:{seed}')
+    importer = DiaryImporter(job, batch_size=batch_size, progress=progress)
+    return importer.run_records(_records(user_ids, entries_per_user, rng, days))
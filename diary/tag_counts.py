@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import DiaryEntry, UserTagCount
+
+
+def increment_tag_counts(user_id, tag_ids):
+    """ Увеличивает счетчики тегов пользователя на единицу (недостающие строки создаются) """
+    tag_ids = list(tag_ids)
+    if not tag_ids:
+        return
+    UserTagCount.objects.bulk_create(
+        [UserTagCount(user_id=user_id, tag_id=tag_id, entry_count=0) for tag_id in tag_ids],
+        ignore_conflicts=True,
+    )
+    UserTagCount.objects.filter(user_id=user_id, tag_id__in=tag_ids).update(
+        entry_count=F('entry_count') + 1,
+        last_used_at=timezone.now(),
+    )
+
+
+def decrement_tag_counts(user_id, tag_ids):
+    """ Уменьшает счетчики тегов пользователя на единицу, обнуленные строки удаляются """
+    tag_ids = list(tag_ids)
+    if not tag_ids:
+        return
+    counts = UserTagCount.objects.filter(user_id=user_id, tag_id__in=tag_ids)
+    counts.filter(entry_count__gt=0).update(entry_count=F('entry_count') - 1)
+    counts.filter(entry_count=0).delete()
+
+
+def get_tag_cloud(user):
+    """ Облако тегов пользователя, отсортированное по частоте использования """
+    return UserTagCount.objects.filter(user=user).select_related('tag').order_by('-entry_count', 'tag__name')
+
+
+def rebuild_tag_counts(user_ids=None):
+    """ Пересобирает счетчики тегов с нуля по текущим записям. Возвращает количество строк """
+    counts = UserTagCount.objects.all()
+    entries = DiaryEntry.objects.filter(tags__isnull=False)
+    if user_ids is not None:
+        counts = counts.filter(user_id__in=user_ids)
+        entries = entries.filter(user_id__in=user_ids)
+
+    rows = entries.values('user_id', 'tags').annotate(entry_count=Count('id'), last_used_at=Max('updated_at'))
+    with transaction.atomic():
+        counts.delete()
+        created = UserTagCount.objects.bulk_create(
+            [
+                UserTagCount(
+                    user_id=row['user_id'],
+                    tag_id=row['tags'],
+                    entry_count=row['entry_count'],
+                    last_used_at=row['last_used_at'],
+                )
+                for row in rows.iterator()
+            ],
+            batch_size=1000,
+        )
+    return len(created)
@@ -0,0 +1,35 @@
+from celery import shared_task
+from django.core.files.storage import storages
+
+from .drafts import flush_drafts
+from .importer import import_file
+from .models import ImportJob
+
+
+@shared_task(bind=True, autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def import_diary(self, job_id):
+    """ Задача для импорта загруженного файла записей дневника.
+    Повторный запуск для того же задания продолжает импорт с контрольной точки; сбои чтения файла
+    повторяются с растущей задержкой. Файл удаляется из хранилища после импорта и после
+    окончательной ошибки, чтобы загруженные дневники не оставались на диске """
+    job = ImportJob.objects.get(pk=job_id)
+    storage = storages['imports']
+    if job.status == ImportJob.STATUS_DONE:
+        storage.delete(job.source)
+        return job.imported
+    try:
+        with storage.open(job.source, 'rb') as file:
+            import_file(job, file)
+    except Exception as e:
+        request = self.request
+        if not isinstance(e, OSError) or request.called_directly or request.retries >= self.max_retries:
+            storage.delete(job.source)
+        raise
+    storage.delete(job.source)
+    return job.imported
+
+
+@shared_task
+def flush_entry_drafts():
+    """ Задача для переноса автосохраненных черновиков из кеша в базу пачками """
+    return flush_drafts()
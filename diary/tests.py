@@ -1 +1,1675 @@
-# Create your tests here.
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+import brotli
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import storages
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.templatetags.static import static
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from taggit.models import Tag
+
+from config.metrics import FRAGMENT_CACHE_REQUESTS, metrics_view
+from users.models import User
+from users.services import get_cached_user, get_user_roles
+from . import drafts, urls as diary_urls
+from .benchmark import compare, run_benchmark
+from .counters import get_entry_counts, rebuild_entry_counters
+from .daily_stats import entry_date, get_streaks, rebuild_daily_stats
+from .importer import DiaryImporter, import_file
+from .models import (
+    CustomField, DailyStat, DiaryEntry, EntryCounter, DiarySettings, EntryDraft, EntryGoal, Goal, ImportedEntry,
+    ImportJob, UserTagCount,
+)
+from .pagination import KeysetPaginator
+from .search import HIGHLIGHT_START, HIGHLIGHT_STOP, search_entries
+from .drafts import draft_cache_key, flush_drafts, get_draft, save_draft
+from .export import astream_export, stream_export
+from .goals import parse_goals, rebuild_entry_goals, sync_entry_goals
+from .fragments import fragment_cache_key, get_tags_version
+from .services import save_custom_fields, settings_cache_key, sync_custom_field_rows
+from .synthetic import clear_synthetic_data, generate_diary_data, synthetic_users
+from .tag_counts import rebuild_tag_counts
+from .tasks import import_diary
+from .templatetags.diary_filters import highlight
+from .views import AsyncDiaryEntryDetailView, AsyncDiaryEntryListView, AsyncHomePageView
+
+
+# Кеши между запросами, как при общем кеше Redis (без REDIS_URL они отключены, а в тестах
+# кеш памяти процесса и так общий для всех запросов)
+SHARED_CACHE_SETTINGS = {
+    'USER_CACHE_TIMEOUT': 5 * 60,
+    'USER_ROLES_CACHE_TIMEOUT': 60 * 60,
+    'DIARY_SETTINGS_CACHE_TIMEOUT': 60 * 60,
+}
+
+
+class QueryBudgetMixin:
+    """ Проверка бюджета SQL-запросов: тест падает, если представление
+    выполняет больше запросов, чем для него заявлено """
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+            self.fail(f'Выполнено {executed} SQL-запросов при бюджете {budget}:\n{queries}')
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class DiaryViewsQueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """ Бюджеты SQL-запросов для представлений дневника """
+
+    # Бюджет включает загрузку сессии (1 запрос, пользователь сессии берется из кеша),
+    # у списка - еще агрегат для ETag/Last-Modified (1 запрос)
+    LIST_BUDGET = 5
+    DETAIL_BUDGET = 4
+    CREATE_BUDGET = 2
+    UPDATE_BUDGET = 4
+    DELETE_BUDGET = 2
+    HOME_BUDGET = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='writer@example.com', display_name='Писатель')
+        DiarySettings.objects.create(user=cls.user, custom_fields_names=['mood', 'weather'])
+        cls.entries = [cls.create_entry(i) for i in range(12)]
+
+    @classmethod
+    def create_entry(cls, number):
+        entry = DiaryEntry.objects.create(
+            user=cls.user,
+            text=f'Запись номер {number}',
+            targets='Прочитать книгу',
+            custom_values={'mood': 'хорошее' if number % 2 else 'плохое', 'weather': 'солнечно'},
+        )
+        entry.tags.add('дом', f'тег{number}')
+        return entry
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))  # роли для меню берутся из кеша
+        # настройки дневника между запросами тоже хранятся в кеше
+        cache.set(settings_cache_key(self.user.pk), DiarySettings.objects.get(user=self.user))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)  # и пользователь сессии (вход сбрасывает его из кеша)
+
+    def test_entry_list(self):
+        with self.assertQueryBudget(self.LIST_BUDGET):
+            response = self.client.get(reverse('diary:entry_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['entries']), 10)
+
+    def test_entry_list_next_page(self):
+        response = self.client.get(reverse('diary:entry_list'))
+        cursor = response.context['page_obj'].next_cursor
+        with self.assertQueryBudget(self.LIST_BUDGET):
+            response = self.client.get(reverse('diary:entry_list'), {'cursor': cursor})
+        self.assertEqual(len(response.context['entries']), 2)
+
+    def test_entry_list_search(self):
+        with self.assertQueryBudget(self.LIST_BUDGET + 1):  # COUNT(*) постраничной пагинации поиска
+            response = self.client.get(reverse('diary:entry_list'), {'q': 'книга'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_entry_list_tag(self):
+        with self.assertQueryBudget(self.LIST_BUDGET):
+            response = self.client.get(reverse('diary:entry_list'), {'tag': 'дом'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_entry_list_custom_field_filter(self):
+        with self.assertQueryBudget(self.LIST_BUDGET):
+            response = self.client.get(reverse('diary:entry_list'), {'cf_mood': 'хорошее'})
+        self.assertEqual(len(response.context['entries']), 6)
+        self.assertEqual(response.context['custom_filters'], {'mood': 'хорошее'})
+
+    def test_entry_list_does_not_depend_on_rows(self):
+        with CaptureQueriesContext(connection) as full_page:
+            self.client.get(reverse('diary:entry_list'))
+        with CaptureQueriesContext(connection) as one_row:
+            self.client.get(reverse('diary:entry_list'), {'tag': 'тег0'})
+        self.assertEqual(len(full_page.captured_queries), len(one_row.captured_queries))
+
+    def test_entry_detail(self):
+        entry = self.entries[0]
+        with self.assertQueryBudget(self.DETAIL_BUDGET):
+            response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': entry.pk}))
+        self.assertContains(response, 'солнечно')
+
+    def test_entry_create_form(self):
+        with self.assertQueryBudget(self.CREATE_BUDGET):
+            response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_entry_update_form(self):
+        entry = self.entries[0]
+        with self.assertQueryBudget(self.UPDATE_BUDGET):
+            response = self.client.get(reverse('diary:entry_update', kwargs={'pk': entry.pk}))
+        self.assertContains(response, 'солнечно')
+
+    def test_entry_delete_form(self):
+        entry = self.entries[0]
+        with self.assertQueryBudget(self.DELETE_BUDGET):
+            response = self.client.get(reverse('diary:entry_confirm_delete', kwargs={'pk': entry.pk}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_home(self):
+        self.client.get(reverse('diary:home'))  # первое обращение создает счетчик пользователя
+        with self.assertQueryBudget(self.HOME_BUDGET):
+            response = self.client.get(reverse('diary:home'))
+        self.assertEqual(response.context['user_entries'], 12)
+        self.assertEqual(response.context['total_entries'], 12)
+
+    def test_home_counters_follow_entries(self):
+        self.client.get(reverse('diary:home'))
+        DiaryEntry.objects.create(user=self.user, text='Еще одна запись')
+        self.entries[0].delete()
+        self.entries[1].delete()
+        response = self.client.get(reverse('diary:home'))
+        self.assertEqual(response.context['user_entries'], 11)
+        self.assertEqual(response.context['total_entries'], 11)
+
+
+class SearchTestCase(TestCase):
+    """ Полнотекстовый поиск: синтаксис websearch, ранжирование, поля вектора и подсветка сниппета """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='search@example.com', display_name='Поиск')
+        cls.in_text = DiaryEntry.objects.create(user=cls.user, text='Сегодня читал книгу про море')
+        cls.in_custom = DiaryEntry.objects.create(
+            user=cls.user, text='Обычный день', custom_values={'place': 'море'},
+        )
+        cls.in_tags = DiaryEntry.objects.create(user=cls.user, text='Прогулка')
+        cls.in_tags.tags.add('путешествие')
+        cls.rainy = DiaryEntry.objects.create(user=cls.user, text='Читал книгу, весь день шел дождь')
+
+    def search(self, text):
+        return list(search_entries(DiaryEntry.objects.filter(user=self.user), text))
+
+    def test_websearch_syntax(self):
+        self.assertEqual({entry.pk for entry in self.search('книга')}, {self.in_text.pk, self.rainy.pk})
+        self.assertEqual([entry.pk for entry in self.search('книга -дождь')], [self.in_text.pk])
+        self.assertEqual([entry.pk for entry in self.search('"весь день"')], [self.rainy.pk])
+        self.assertEqual(
+            {entry.pk for entry in self.search('прогулка or дождь')}, {self.in_tags.pk, self.rainy.pk},
+        )
+        # незакрытые кавычки и одиночные операторы не приводят к ошибке синтаксиса tsquery
+        self.assertEqual(self.search('"книга -'), self.search('книга'))
+
+    def test_vector_includes_custom_values_and_tags(self):
+        self.assertEqual([entry.pk for entry in self.search('путешествие')], [self.in_tags.pk])
+        self.in_tags.tags.remove('путешествие')
+        self.assertEqual(self.search('путешествие'), [])
+
+        results = self.search('море')
+        # совпадение в тексте (вес A) выше совпадения в пользовательском поле (вес C)
+        self.assertEqual([entry.pk for entry in results], [self.in_text.pk, self.in_custom.pk])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_tag_rename_and_delete(self):
+        tag = Tag.objects.get(name='путешествие')
+        tag.name = 'поход'
+        tag.save()
+        self.assertEqual(self.search('путешествие'), [])
+        self.assertEqual([entry.pk for entry in self.search('поход')], [self.in_tags.pk])
+
+        day = entry_date(self.in_tags)
+        self.assertIn(tag.pk, DailyStat.objects.get(user=self.user, date=day).tag_ids)
+        tag.delete()
+        self.assertEqual(self.search('поход'), [])
+        self.assertNotIn(tag.pk, DailyStat.objects.get(user=self.user, date=day).tag_ids)
+
+    def test_headline_marks_matches(self):
+        headline = self.search('море')[0].headline
+        self.assertIn(f'{HIGHLIGHT_START}море{HIGHLIGHT_STOP}', headline)
+        self.assertEqual(highlight(headline), 'Сегодня читал книгу про <mark>море</mark>')
+
+    def test_highlight_escapes_entry_text(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='<script>alert(1)</script> 1 < 2 море & "волны"')
+        headline = next(result.headline for result in self.search('море') if result.pk == entry.pk)
+        html = highlight(headline)
+        self.assertNotIn('<script>', html)
+        self.assertIn('1 &lt; 2 <mark>море</mark> &amp; &quot;волны&quot;', html)
+        # разметка, оставшаяся в сниппете, выводится как текст
+        self.assertEqual(
+            highlight(f'<img src=x onerror=alert(1)> {HIGHLIGHT_START}<b>{HIGHLIGHT_STOP}'),
+            '&lt;img src=x onerror=alert(1)&gt; <mark>&lt;b&gt;</mark>',
+        )
+
+
+class KeysetPaginationTestCase(TestCase):
+    """ Курсорная пагинация: соседние страницы, записи с одинаковой датой и некорректные курсоры """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='pages@example.com', display_name='Страницы')
+        DiarySettings.objects.create(user=cls.user)
+        entries = [DiaryEntry.objects.create(user=cls.user, text=f'Запись {number}') for number in range(7)]
+        # у записей 2-5 одинаковая дата: порядок внутри нее задает id
+        now = timezone.now()
+        for number, entry in enumerate(entries):
+            created_at = now - timedelta(minutes=3) if 2 <= number <= 5 else now - timedelta(minutes=10 - number)
+            DiaryEntry.objects.filter(pk=entry.pk).update(created_at=created_at)
+        cls.expected = list(
+            DiaryEntry.objects.filter(user=cls.user).order_by('-created_at', '-id').values_list('pk', flat=True)
+        )
+
+    def setUp(self):
+        self.paginator = KeysetPaginator(DiaryEntry.objects.filter(user=self.user), 3)
+
+    def ids(self, page):
+        return [entry.pk for entry in page]
+
+    def test_next_and_previous_pages(self):
+        first = self.paginator.page()
+        self.assertEqual(self.ids(first), self.expected[:3])
+        self.assertEqual((first.has_previous(), first.has_next()), (False, True))
+        self.assertIsNone(first.previous_cursor)
+
+        second = self.paginator.page(first.next_cursor)
+        self.assertEqual(self.ids(second), self.expected[3:6])
+        third = self.paginator.page(second.next_cursor)
+        self.assertEqual(self.ids(third), self.expected[6:])
+        self.assertEqual((third.has_previous(), third.has_next()), (True, False))
+        self.assertIsNone(third.next_cursor)
+
+        back = self.paginator.page(third.previous_cursor)
+        self.assertEqual(self.ids(back), self.expected[3:6])
+        self.assertEqual((back.has_previous(), back.has_next()), (True, True))
+        start = self.paginator.page(back.previous_cursor)
+        self.assertEqual(self.ids(start), self.expected[:3])
+        self.assertFalse(start.has_previous())
+
+    def test_ties_on_created_at(self):
+        # границы страниц проходят внутри группы записей с одинаковой датой: без пропусков и повторов
+        seen = []
+        page = self.paginator.page()
+        while True:
+            seen += self.ids(page)
+            if not page.has_next():
+                break
+            page = self.paginator.page(page.next_cursor)
+        self.assertEqual(seen, self.expected)
+
+    def test_invalid_cursor_opens_first_page(self):
+        tampered = [
+            'не-курсор',
+            '!!!',
+            base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+            base64.urlsafe_b64encode(json.dumps(['sideways', timezone.now().isoformat(), 1]).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps(['next', 'вчера', 1]).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps(['next', timezone.now().isoformat(), 'x']).encode()).decode(),
+            base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+        ]
+        for cursor in tampered:
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(KeysetPaginator.decode_cursor(cursor))
+                self.assertEqual(self.ids(self.paginator.page(cursor)), self.expected[:3])
+
+    def test_entry_list_pages(self):
+        self.client.force_login(self.user)
+        url = reverse('diary:entry_list')
+        response = self.client.get(url, {'cursor': 'испорченный'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry.pk for entry in response.context['entries']], self.expected)
+        self.assertFalse(response.context['is_paginated'])
+
+
+class UserTagCountTestCase(TestCase):
+    """ Счетчики тегов пользователя: обновляются при каждом изменении тегов записей """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='tags@example.com', display_name='Теги')
+        DiarySettings.objects.create(user=cls.user)
+
+    def counts(self):
+        return dict(UserTagCount.objects.filter(user=self.user).values_list('tag__name', 'entry_count'))
+
+    def assertCountsRebuildable(self):
+        counts = self.counts()
+        rebuild_tag_counts([self.user.pk])
+        self.assertEqual(self.counts(), counts)
+
+    def test_add_remove_and_replace(self):
+        first = DiaryEntry.objects.create(user=self.user, text='Первая')
+        second = DiaryEntry.objects.create(user=self.user, text='Вторая')
+        first.tags.add('дом', 'работа')
+        second.tags.add('дом')
+        self.assertEqual(self.counts(), {'дом': 2, 'работа': 1})
+
+        first.tags.remove('дом')
+        self.assertEqual(self.counts(), {'дом': 1, 'работа': 1})
+
+        second.tags.set(['спорт', 'работа'])
+        self.assertEqual(self.counts(), {'работа': 2, 'спорт': 1})
+        self.assertCountsRebuildable()
+
+        first.tags.clear()
+        self.assertEqual(self.counts(), {'работа': 1, 'спорт': 1})
+
+    def test_zero_count_row_removed(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись')
+        entry.tags.add('отпуск')
+        self.assertTrue(UserTagCount.objects.filter(user=self.user, tag__name='отпуск').exists())
+        entry.tags.remove('отпуск')
+        self.assertFalse(UserTagCount.objects.filter(user=self.user).exists())
+
+    def test_entry_delete(self):
+        kept = DiaryEntry.objects.create(user=self.user, text='Остается')
+        deleted = DiaryEntry.objects.create(user=self.user, text='Удаляется')
+        kept.tags.add('дом')
+        deleted.tags.add('дом', 'поездка')
+        deleted.delete()
+        self.assertEqual(self.counts(), {'дом': 1})
+        self.assertCountsRebuildable()
+
+    def test_tags_cleared_via_form(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись')
+        entry.tags.add('дом', 'работа')
+        self.client.force_login(self.user)
+        url = reverse('diary:entry_update', kwargs={'pk': entry.pk})
+
+        self.client.post(url, {'text': 'Запись', 'tags': 'дом, сад'})
+        self.assertEqual(self.counts(), {'дом': 1, 'сад': 1})
+        self.client.post(url, {'text': 'Запись', 'tags': ''})
+        self.assertEqual(self.counts(), {})
+
+
+class EntryCounterTestCase(QueryBudgetMixin, TestCase):
+    """ Счетчики записей: строка пользователя и части общего счетчика """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(email=f'counter{number}@example.com') for number in range(3)]
+
+    @override_settings(DIARY_ENTRY_COUNTER_SHARDS=2)
+    def test_sharded_total(self):
+        entries = [DiaryEntry.objects.create(user=user, text='Запись') for user in self.users for _ in range(2)]
+        # общий счетчик разнесен по строкам, строка пользователя создана первой записью
+        self.assertEqual(EntryCounter.objects.filter(user=None).count(), 2)
+        self.assertEqual(EntryCounter.objects.get(user=self.users[0]).entry_count, 2)
+        entries[0].delete()
+
+        with self.assertQueryBudget(1):
+            self.assertEqual(get_entry_counts(self.users[0]), (1, 5))
+        self.assertEqual(get_entry_counts(self.users[1]), (2, 5))
+
+        rebuild_entry_counters([self.users[1].pk])
+        self.assertEqual(EntryCounter.objects.filter(user=None).count(), 1)
+        self.assertEqual(get_entry_counts(self.users[0]), (1, 5))
+
+    def test_missing_user_row_counted_once(self):
+        DiaryEntry.objects.create(user=self.users[0], text='Запись')
+        EntryCounter.objects.filter(user=self.users[0]).delete()
+        self.assertEqual(get_entry_counts(self.users[0]), (1, 1))
+        DiaryEntry.objects.create(user=self.users[0], text='Еще запись')
+        self.assertEqual(get_entry_counts(self.users[0]), (2, 2))
+
+    def test_user_delete(self):
+        DiaryEntry.objects.create(user=self.users[0], text='Запись')
+        DiaryEntry.objects.create(user=self.users[1], text='Запись')
+        # удаление записей каскадом не создает заново строку удаленного пользователя
+        user_id = self.users[0].pk
+        self.users[0].delete()
+        self.assertFalse(EntryCounter.objects.filter(user_id=user_id).exists())
+        self.assertEqual(get_entry_counts(self.users[1]), (1, 1))
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class DiarySettingsCacheTestCase(QueryBudgetMixin, TestCase):
+    """ Кеширование настроек дневника """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='reader@example.com', display_name='Читатель')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_settings_created_lazily(self):
+        response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(DiarySettings.objects.filter(user=self.user).exists())
+
+    def test_settings_read_from_cache(self):
+        self.client.get(reverse('diary:entry_create'))
+        with self.assertQueryBudget(2):  # только сессия и пользователь
+            self.client.get(reverse('diary:entry_create'))
+
+    @override_settings(DIARY_SETTINGS_CACHE_TIMEOUT=0)
+    def test_settings_not_cached_without_timeout(self):
+        # Без общего кеша настройки читаются из базы в каждом запросе, а не из кеша процесса
+        self.client.get(reverse('diary:entry_create'))
+        self.assertIsNone(cache.get(settings_cache_key(self.user.pk)))
+        DiarySettings.objects.filter(user=self.user).update(custom_fields_names=['mood'])
+        response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual([field['name'] for field in response.context['custom_fields']], ['mood'])
+
+    def test_settings_save_invalidates_cache(self):
+        self.client.get(reverse('diary:entry_create'))
+        self.client.post(reverse('diary:update_custom_fields'), {'custom_fields[]': ['mood']})
+        response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual([field['name'] for field in response.context['custom_fields']], ['mood'])
+
+
+class SaveCustomFieldsTestCase(QueryBudgetMixin, TestCase):
+    """ Сохранение пользовательских полей: JSONB-колонка вместе с записью, строки CustomField по разнице значений """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='fields@example.com', display_name='Поля')
+        DiarySettings.objects.create(user=cls.user, custom_fields_names=['mood', 'sleep'])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_values_saved_with_entry(self):
+        self.client.post(reverse('diary:entry_create'), {'text': 'Запись', 'custom_mood': 'хорошее'})
+        entry = DiaryEntry.objects.get(user=self.user)
+        self.assertEqual(entry.custom_values, {'mood': 'хорошее'})
+
+        self.client.post(reverse('diary:entry_update', kwargs={'pk': entry.pk}),
+                         {'text': 'Запись', 'custom_mood': 'отличное', 'custom_sleep': '8'})
+        entry.refresh_from_db()
+        self.assertEqual(entry.custom_values, {'mood': 'отличное', 'sleep': '8'})
+        # значения полей попадают в поисковый вектор
+        self.assertTrue(search_entries(DiaryEntry.objects.filter(pk=entry.pk), 'отличное').exists())
+        self.assertFalse(search_entries(DiaryEntry.objects.filter(pk=entry.pk), 'хорошее').exists())
+
+    def test_json_values_saved_with_one_update(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись', custom_values={'mood': 'хорошее'})
+        # savepoint, UPDATE значений, поисковый вектор, release savepoint
+        with self.assertQueryBudget(4):
+            save_custom_fields(entry, {'mood': 'отличное', 'sleep': '8'})
+        entry.refresh_from_db()
+        self.assertEqual(entry.custom_values, {'mood': 'отличное', 'sleep': '8'})
+        self.assertFalse(entry.custom_fields.exists())
+
+    @override_settings(DIARY_CUSTOM_FIELDS_STORAGE='rows')
+    def test_rows_diff_is_written_in_fixed_statements(self):
+        values = {'mood': 'хорошее', 'weather': 'дождь', 'sleep': '8'}
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись', custom_values=values)
+        sync_custom_field_rows([entry.pk])
+        # чтение строк, savepoint, UPDATE значений, вектор, upsert, delete, release savepoint
+        with self.assertQueryBudget(7):
+            save_custom_fields(entry, {'mood': 'отличное', 'sleep': '8', 'steps': '10000'})
+        self.assertEqual(
+            dict(entry.custom_fields.values_list('name', 'value')),
+            {'mood': 'отличное', 'sleep': '8', 'steps': '10000'},
+        )
+
+    @override_settings(DIARY_CUSTOM_FIELDS_STORAGE='rows')
+    def test_unchanged_values_are_not_written(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись', custom_values={'mood': 'хорошее'})
+        sync_custom_field_rows([entry.pk])
+        with self.assertQueryBudget(1):
+            save_custom_fields(entry, {'mood': 'хорошее'})
+
+    @override_settings(DIARY_CUSTOM_FIELDS_STORAGE='rows')
+    def test_form_writes_rows(self):
+        self.client.post(reverse('diary:entry_create'), {'text': 'Запись', 'custom_mood': 'хорошее'})
+        entry = DiaryEntry.objects.get(user=self.user)
+        self.client.post(reverse('diary:entry_update', kwargs={'pk': entry.pk}),
+                         {'text': 'Запись', 'custom_sleep': '8'})
+        self.assertEqual(dict(entry.custom_fields.values_list('name', 'value')), {'sleep': '8'})
+
+    def test_sync_command_rebuilds_rows(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Запись', custom_values={'mood': 'ок', 'sleep': '8'})
+        CustomField.objects.create(entry=entry, name='mood', value='старое')
+        CustomField.objects.create(entry=entry, name='weather', value='дождь')
+        call_command('sync_custom_fields', stdout=io.StringIO())
+        self.assertEqual(dict(entry.custom_fields.values_list('name', 'value')), {'mood': 'ок', 'sleep': '8'})
+
+
+class DiaryExportTestCase(QueryBudgetMixin, TestCase):
+    """ Потоковая выгрузка дневника """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='export@example.com', display_name='Выгрузка')
+        cls.other = User.objects.create(email='other@example.com', display_name='Другой')
+        for number in range(12):
+            entry = DiaryEntry.objects.create(user=cls.user, text=f'Запись {number}', custom_values={'mood': 'ок'})
+            entry.tags.add('дом', f'тег{number}')
+        DiaryEntry.objects.create(user=cls.other, text='Чужая запись')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, **params):
+        response = self.client.get(reverse('diary:entry_export'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, content = self.export(format='ndjson')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0]['text'], 'Запись 0')
+        self.assertEqual(rows[0]['tags'], ['дом', 'тег0'])
+        self.assertEqual(rows[0]['custom_fields'], {'mood': 'ок'})
+
+    def test_json_and_csv(self):
+        response, content = self.export(format='json')
+        self.assertEqual(len(json.loads(content)), 12)
+        response, content = self.export(format='csv')
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[5]['tags'], 'дом, тег5')
+
+    def test_gzip(self):
+        response, content = self.export(format='ndjson', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(len(gzip.decompress(content).decode().splitlines()), 12)
+
+    async def test_asgi_streaming(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('diary:entry_export'), {'format': 'ndjson', 'gzip': '1'})
+        self.assertEqual(response.status_code, 200)
+        # Асинхронный итератор: ASGI-обработчик отдает блоки по мере формирования, не собирая их в памяти
+        self.assertTrue(response.is_async)
+        content = b''.join([block async for block in response.streaming_content])
+        rows = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual([row['text'] for row in rows], [f'Запись {number}' for number in range(12)])
+
+    def test_astream_export_in_chunks(self):
+        async def read():
+            return b''.join([block async for block in astream_export(self.user, 'ndjson', chunk_size=5)])
+
+        with self.assertQueryBudget(6):
+            rows = async_to_sync(read)().splitlines()
+        self.assertEqual(len(rows), 12)
+
+    def test_unknown_format(self):
+        response = self.client.get(reverse('diary:entry_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_entries_read_in_chunks(self):
+        # по пачке записей и пачке тегов на каждые 5 записей, независимо от общего числа
+        with self.assertQueryBudget(6):
+            rows = b''.join(stream_export(self.user, 'ndjson', chunk_size=5)).splitlines()
+        self.assertEqual(len(rows), 12)
+
+
+class DiaryImportTestCase(QueryBudgetMixin, TestCase):
+    """ Пакетный импорт записей """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.source_user = User.objects.create(email='source@example.com', display_name='Источник')
+        cls.user = User.objects.create(email='target@example.com', display_name='Получатель')
+        for number in range(12):
+            entry = DiaryEntry.objects.create(
+                user=cls.source_user, text=f'Прочитал книгу номер {number}', custom_values={'mood': 'ок'},
+            )
+            entry.tags.add('чтение', f'тег{number}')
+        DiaryEntry.objects.filter(user=cls.source_user).update(created_at='2024-01-01T10:00:00Z')
+        cls.ndjson = b''.join(stream_export(cls.source_user, 'ndjson'))
+
+    def run_import(self, content, user=None, batch_size=5):
+        job = ImportJob.objects.create(user=user or self.user, source='test.ndjson')
+        return import_file(job, io.BytesIO(content), batch_size=batch_size)
+
+    def test_ndjson_round_trip(self):
+        job = self.run_import(gzip.compress(self.ndjson))
+        self.assertEqual((job.status, job.processed, job.imported, job.skipped), (ImportJob.STATUS_DONE, 12, 12, 0))
+        entries = DiaryEntry.objects.filter(user=self.user)
+        self.assertEqual(entries.count(), 12)
+        entry = entries.get(text='Прочитал книгу номер 3')
+        self.assertEqual(sorted(entry.tags.names()), ['тег3', 'чтение'])
+        self.assertEqual(entry.custom_values, {'mood': 'ок'})
+        self.assertEqual(entry.created_at.year, 2024)
+        # поисковый вектор и счетчики заполняются без сигналов
+        self.assertEqual(search_entries(entries, 'книга').count(), 12)
+        self.assertEqual(UserTagCount.objects.get(user=self.user, tag__name='чтение').entry_count, 12)
+        self.assertEqual(get_entry_counts(self.user), (12, 24))
+
+    def test_batch_queries_do_not_depend_on_size(self):
+        def count_queries(content):
+            job = ImportJob.objects.create(user=self.user, source='test.ndjson')
+            importer = DiaryImporter(job, batch_size=100)
+            importer._resolve_tags(['чтение'] + [f'тег{number}' for number in range(12)])  # теги уже известны
+            records = [json.loads(line) for line in content.splitlines()]
+            with CaptureQueriesContext(connection) as context:
+                importer._import_batch(records)
+            return len(context.captured_queries)
+
+        half = b'\n'.join(self.ndjson.splitlines()[:6])
+        self.assertEqual(count_queries(half), count_queries(self.ndjson))
+
+    def test_resume_after_failure(self):
+        job = ImportJob.objects.create(user=self.user, source='test.ndjson')
+        original = DiaryImporter._save_tags
+        calls = []
+
+        def failing_save_tags(importer, entry_tags):
+            calls.append(1)
+            if len(calls) == 2:
+                raise OSError('диск отвалился')
+            return original(importer, entry_tags)
+
+        with mock.patch.object(DiaryImporter, '_save_tags', failing_save_tags):
+            with self.assertRaises(OSError):
+                import_file(job, io.BytesIO(self.ndjson), batch_size=5)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (ImportJob.STATUS_FAILED, 5))
+
+        import_file(job, io.BytesIO(self.ndjson), batch_size=5)
+        self.assertEqual(job.status, ImportJob.STATUS_DONE)
+        self.assertEqual(DiaryEntry.objects.filter(user=self.user).count(), 12)
+
+    def test_fixture_keeps_ids(self):
+        fixture = json.dumps([
+            {'model': 'diary.diaryentry', 'pk': 9001,
+             'fields': {'user': self.user.pk, 'created_at': '2025-06-29T14:53:09.383Z',
+                        'updated_at': '2025-06-30T12:32:09.740Z', 'text': 'Из фикстуры', 'targets': 'Цель'}},
+            {'model': 'diary.diarysettings', 'pk': 1,
+             'fields': {'user': self.user.pk, 'show_targets': False, 'custom_fields_names': ['вес']}},
+            {'model': 'diary.customfield', 'pk': 1, 'fields': {'entry': 9001, 'name': 'вес', 'value': '59 кг'}},
+            {'model': 'diary.diaryentry', 'pk': 9002, 'fields': {'user': 123456, 'text': 'Нет пользователя'}},
+        ], ensure_ascii=False).encode()
+        job = ImportJob.objects.create(source='diary.json')
+        import_file(job, io.BytesIO(fixture), batch_size=2)
+        self.assertEqual((job.imported, job.skipped), (1, 1))
+        entry = DiaryEntry.objects.get(pk=9001)
+        self.assertEqual(entry.custom_values, {'вес': '59 кг'})
+        self.assertFalse(DiarySettings.objects.get(user=self.user).show_targets)
+        # последовательность id сдвинута за импортированные записи
+        self.assertGreater(DiaryEntry.objects.create(user=self.user, text='Новая').pk, 9001)
+
+    def test_overwrite_replaces_tags(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Было')
+        entry.tags.add('старый', 'общий')
+        fixture = json.dumps([
+            {'model': 'diary.diaryentry', 'pk': entry.pk,
+             'fields': {'user': self.user.pk, 'text': 'Стало', 'tags': ['общий', 'новый']}},
+        ], ensure_ascii=False).encode()
+        import_file(ImportJob.objects.create(source='diary.json'), io.BytesIO(fixture))
+        entry.refresh_from_db()
+        self.assertEqual(entry.text, 'Стало')
+        self.assertEqual(sorted(entry.tags.names()), ['новый', 'общий'])
+        # счетчики тегов пересобраны после импорта
+        self.assertEqual(
+            dict(UserTagCount.objects.filter(user=self.user).values_list('tag__name', 'entry_count')),
+            {'новый': 1, 'общий': 1},
+        )
+
+    @override_settings(DIARY_CUSTOM_FIELDS_STORAGE='rows')
+    def test_rows_storage_follows_custom_values(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Было', custom_values={'mood': 'плохое', 'sleep': '6'})
+        sync_custom_field_rows([entry.pk])
+        fixture = json.dumps([
+            {'model': 'diary.diaryentry', 'pk': entry.pk,
+             'fields': {'user': self.user.pk, 'text': 'Стало', 'custom_values': {'mood': 'хорошее'}}},
+            {'model': 'diary.customfield', 'pk': 1, 'fields': {'entry': entry.pk, 'name': 'steps', 'value': '9000'}},
+        ], ensure_ascii=False).encode()
+        import_file(ImportJob.objects.create(source='diary.json'), io.BytesIO(fixture))
+        # строки перезаписанной записи повторяют ее JSONB-колонку: лишнее поле удалено
+        self.assertEqual(
+            dict(CustomField.objects.filter(entry=entry).values_list('name', 'value')),
+            {'mood': 'хорошее', 'steps': '9000'},
+        )
+
+    def test_overwrite_moves_entry_to_other_user(self):
+        entry = DiaryEntry.objects.create(user=self.source_user, text='Было')
+        entry.tags.add('переезд')
+        DiaryEntry.objects.filter(pk=entry.pk).update(updated_at='2024-01-01T10:00:00Z')
+        fixture = json.dumps([
+            {'model': 'diary.diaryentry', 'pk': entry.pk,
+             'fields': {'user': self.user.pk, 'text': 'Стало', 'updated_at': '2024-01-02T10:00:00Z'}},
+        ], ensure_ascii=False).encode()
+        job = import_file(ImportJob.objects.create(source='diary.json'), io.BytesIO(fixture))
+        self.assertIn(self.source_user.pk, job.user_ids)
+        # счетчики прежнего владельца тоже пересобраны
+        self.assertEqual(get_entry_counts(self.source_user)[0], 12)
+        self.assertFalse(UserTagCount.objects.filter(user=self.source_user, tag__name='переезд').exists())
+        # время изменения перезаписанной записи обновлено, а не взято из файла
+        entry.refresh_from_db()
+        self.assertGreater(entry.updated_at, timezone.now() - timedelta(minutes=1))
+
+    def test_resume_keeps_custom_fields_of_earlier_batches(self):
+        fixture = json.dumps([
+            {'model': 'diary.diaryentry', 'pk': 1, 'fields': {'text': 'Первая'}},
+            {'model': 'diary.diaryentry', 'pk': 2, 'fields': {'text': 'Вторая'}},
+            {'model': 'diary.diaryentry', 'pk': 3, 'fields': {'text': 'Третья'}},
+            {'model': 'diary.customfield', 'pk': 1, 'fields': {'entry': 1, 'name': 'вес', 'value': '59 кг'}},
+        ], ensure_ascii=False).encode()
+        job = ImportJob.objects.create(user=self.user, source='diary.json')
+        original = DiaryImporter._save_tags
+        calls = []
+
+        def failing_save_tags(importer, entry_tags):
+            calls.append(1)
+            if len(calls) == 2:
+                raise OSError('диск отвалился')
+            return original(importer, entry_tags)
+
+        with mock.patch.object(DiaryImporter, '_save_tags', failing_save_tags):
+            with self.assertRaises(OSError):
+                import_file(job, io.BytesIO(fixture), batch_size=2)
+        import_file(job, io.BytesIO(fixture), batch_size=2)
+        self.assertEqual((job.status, job.imported, job.skipped), (ImportJob.STATUS_DONE, 3, 0))
+        entry = DiaryEntry.objects.get(user=self.user, text='Первая')
+        self.assertEqual(entry.custom_values, {'вес': '59 кг'})
+        # соответствие id удаляется вместе с завершением задания
+        self.assertFalse(ImportedEntry.objects.filter(job=job).exists())
+
+    def test_repository_fixture(self):
+        with open(settings.BASE_DIR / 'diary.json', 'rb') as file:
+            fixture = json.load(file)
+        user_ids = {item['fields']['user'] for item in fixture if 'user' in item['fields']}
+        User.objects.bulk_create(
+            [User(pk=user_id, email=f'user{user_id}@example.com', display_name='Автор') for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        with open(settings.BASE_DIR / 'diary.json', 'rb') as file:
+            job = import_file(ImportJob.objects.create(source='diary.json'), file, batch_size=7)
+        entries = [item for item in fixture if item['model'] == 'diary.diaryentry']
+        fields = [item for item in fixture if item['model'] == 'diary.customfield']
+        self.assertEqual(job.imported, len(entries))
+        entry = DiaryEntry.objects.get(pk=fields[0]['fields']['entry'])
+        self.assertEqual(entry.custom_values[fields[0]['fields']['name']], fields[0]['fields']['value'])
+
+    def imports_storage_settings(self):
+        imports_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, imports_root, ignore_errors=True)
+        storage_settings = {**settings.STORAGES, 'imports': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': imports_root},
+        }}
+        return imports_root, self.settings(STORAGES=storage_settings)
+
+    def test_upload_view(self):
+        imports_root, imports_settings = self.imports_storage_settings()
+        self.client.force_login(self.user)
+        with imports_settings:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse('diary:entry_import'), {
+                    'file': SimpleUploadedFile('diary.ndjson', self.ndjson, content_type='application/x-ndjson'),
+                })
+            self.assertRedirects(response, reverse('diary:entry_import'))
+            self.assertEqual(len(callbacks), 1)
+            job = ImportJob.objects.get(user=self.user)
+            # Файл лежит в закрытом хранилище под случайным именем, а не под именем загрузки
+            self.assertTrue(os.path.isfile(os.path.join(imports_root, job.source)))
+            self.assertNotIn('diary.ndjson', job.source)
+            self.assertEqual(import_diary(job.pk), 12)
+            self.assertFalse(os.path.exists(os.path.join(imports_root, job.source)))
+        response = self.client.get(reverse('diary:entry_import'))
+        self.assertContains(response, 'Завершен')
+
+    def test_failed_import_deletes_file(self):
+        imports_root, imports_settings = self.imports_storage_settings()
+        with imports_settings:
+            source = storages['imports'].save(f'{self.user.pk}/broken', io.BytesIO(b'{"text": '))
+            job = ImportJob.objects.create(user=self.user, source=source)
+            with self.assertRaises(ValueError):
+                import_diary(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertFalse(os.path.exists(os.path.join(imports_root, source)))
+
+
+class SyntheticDataBenchmarkTestCase(TestCase):
+    """ Генерация тестовых данных и замеры представлений """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.job = generate_diary_data(users=2, entries_per_user=20, seed=42, batch_size=15)
+
+    def test_generated_data(self):
+        users = synthetic_users()
+        self.assertEqual(users.count(), 2)
+        self.assertEqual(DiarySettings.objects.filter(user__in=users).count(), 2)
+        self.assertEqual(DiaryEntry.objects.filter(user__in=users).count(), self.job.imported)
+        self.assertTrue(UserTagCount.objects.filter(user__in=users).exists())
+        self.assertFalse(DiaryEntry.objects.filter(user__in=users, search_vector__isnull=True).exists())
+        stats = DailyStat.objects.filter(user__in=users).aggregate(entries=Sum('entry_count'))
+        self.assertEqual(stats['entries'], self.job.imported)
+
+    def test_benchmark_and_regressions(self):
+        cache.clear()
+        user = synthetic_users().first()
+        results = run_benchmark(user, iterations=2, warmup=1)
+        self.assertIn('list_search', results['scenarios'])
+        for name, result in results['scenarios'].items():
+            self.assertIn(result['status'], (200, 302), name)
+        self.assertEqual(DiaryEntry.objects.filter(text='Замер производительности').count(), 0)
+
+        self.assertEqual(compare(results, results), [])
+        baseline = json.loads(json.dumps(results))
+        baseline['scenarios']['list']['queries'] -= 1
+        baseline['scenarios']['detail']['p95_ms'] = results['scenarios']['detail']['p95_ms'] / 2
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+
+    def test_numbering_continues_after_partial_delete(self):
+        synthetic_users().get(email='bench0@bench.local').delete()
+        generate_diary_data(users=1, entries_per_user=0, seed=1)
+        self.assertEqual(
+            sorted(synthetic_users().values_list('email', flat=True)), ['bench1@bench.local', 'bench2@bench.local'],
+        )
+
+    def test_clear_without_entry_signals(self):
+        other = User.objects.create(email='keep@example.com')
+        DiaryEntry.objects.create(user=other, text='Остается', targets='Цель').tags.add('дом')
+        users = list(synthetic_users())
+        with mock.patch('diary.signals.refresh_daily_stat') as refresh, \
+                mock.patch('diary.signals.decrement_tag_counts') as decrement:
+            deleted = clear_synthetic_data()
+        refresh.assert_not_called()
+        decrement.assert_not_called()
+        self.assertEqual(deleted, self.job.imported)
+        self.assertFalse(synthetic_users().exists())
+        for model in (DiaryEntry, DailyStat, UserTagCount, Goal):
+            self.assertFalse(model.objects.filter(user__in=users).exists(), model)
+        self.assertEqual(get_entry_counts(other), (1, 1))
+        self.assertEqual(DiaryEntry.objects.get(user=other).tags.count(), 1)
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class FragmentCacheTestCase(QueryBudgetMixin, TestCase):
+    """ Кеш HTML-фрагментов записей: ключи по времени изменения и настройкам, пакетное чтение """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='fragments@example.com', display_name='Фрагменты')
+        cls.diary_settings = DiarySettings.objects.create(user=cls.user)
+        cls.entries = []
+        for number in range(3):
+            entry = DiaryEntry.objects.create(user=cls.user, text=f'Строка {number}\nвторая строка',
+                                              targets='Цель дня')
+            entry.tags.add('кеш')
+            cls.entries.append(entry)
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        cache.set(settings_cache_key(self.user.pk), DiarySettings.objects.get(user=self.user))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def counter(self, fragment, result):
+        return FRAGMENT_CACHE_REQUESTS.labels(fragment, result)._value.get()
+
+    def test_list_page_from_cache(self):
+        hits, misses = self.counter('card', 'hit'), self.counter('card', 'miss')
+        with CaptureQueriesContext(connection) as cold:
+            first = self.client.get(reverse('diary:entry_list'))
+        with mock.patch('diary.fragments.render_to_string') as render, \
+                CaptureQueriesContext(connection) as warm:
+            second = self.client.get(reverse('diary:entry_list'))
+        render.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, 'Цели: Цель дня')
+        # Теги карточек из кеша не загружаются
+        self.assertEqual(len(warm.captured_queries), len(cold.captured_queries) - 1)
+        self.assertEqual(self.counter('card', 'miss') - misses, 3)
+        self.assertEqual(self.counter('card', 'hit') - hits, 3)
+
+    def test_entry_change_gives_new_key(self):
+        entry = self.entries[0]
+        entry.refresh_from_db()  # время изменения обновлено добавлением тега
+        self.client.get(reverse('diary:entry_detail', kwargs={'pk': entry.pk}))
+        tags_version = get_tags_version(self.user.pk)
+        old_key = fragment_cache_key('body', entry, self.diary_settings, tags_version)
+        self.assertIsNotNone(cache.get(old_key))
+
+        self.client.post(reverse('diary:entry_update', kwargs={'pk': entry.pk}),
+                         {'text': 'Новый текст', 'targets': '', 'tags': 'другой'})
+        entry.refresh_from_db()
+        self.assertNotEqual(fragment_cache_key('body', entry, self.diary_settings, tags_version), old_key)
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': entry.pk}))
+        self.assertContains(response, '<p>Новый текст</p>', html=True)
+        self.assertContains(response, 'другой')
+        self.assertNotContains(response, 'Цель дня')
+
+    def test_entry_tags_change(self):
+        entry = self.entries[0]
+        url = reverse('diary:entry_detail', kwargs={'pk': entry.pk})
+        self.assertNotContains(self.client.get(url), 'новый')
+        entry.tags.add('новый')
+        self.assertContains(self.client.get(url), 'новый')
+        entry.tags.remove('новый')
+        self.assertNotContains(self.client.get(url), 'новый')
+
+    def test_tag_rename_and_delete(self):
+        url = reverse('diary:entry_list')
+        self.assertContains(self.client.get(url), 'кеш')
+        tag = Tag.objects.get(name='кеш')
+        tag.name = 'переименованный'
+        tag.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'переименованный')
+        tag.delete()
+        self.assertNotContains(self.client.get(url), 'переименованный')
+
+    def test_settings_flags(self):
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': self.entries[1].pk}))
+        self.assertContains(response, '<p>Строка 1<br>вторая строка</p>', html=True)
+        self.assertContains(response, 'кеш')
+
+        self.client.post(reverse('diary:settings'), {'show_targets': 'on', 'default_targets': ''})
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': self.entries[1].pk}))
+        self.assertContains(response, 'Цель дня')
+        self.assertNotContains(response, 'badge bg-light')
+
+    def test_search_results_not_cached(self):
+        hits, misses = self.counter('card', 'hit'), self.counter('card', 'miss')
+        for _ in range(2):
+            response = self.client.get(reverse('diary:entry_list'), {'q': 'строка'})
+            self.assertContains(response, '<mark>', count=6)
+        self.assertEqual((self.counter('card', 'hit'), self.counter('card', 'miss')), (hits, misses))
+
+    @override_settings(DIARY_FRAGMENT_CACHE=False)
+    def test_disabled(self):
+        self.client.get(reverse('diary:entry_list'))
+        with mock.patch('diary.fragments.render_to_string', return_value='') as render:
+            self.client.get(reverse('diary:entry_list'))
+        self.assertEqual(render.call_count, 3)
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class ConditionalGetTestCase(QueryBudgetMixin, TestCase):
+    """ Условные GET-запросы: 304 Not Modified без загрузки записей и рендеринга шаблона """
+
+    # Сессия и один запрос для валидаторов (пользователь сессии берется из кеша)
+    NOT_MODIFIED_BUDGET = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='etag@example.com', display_name='Кеш браузера')
+        DiarySettings.objects.create(user=cls.user)
+        cls.entries = []
+        for number in range(3):
+            entry = DiaryEntry.objects.create(user=cls.user, text=f'Запись {number}')
+            entry.tags.add('дом' if number else 'работа')
+            cls.entries.append(entry)
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        cache.set(settings_cache_key(self.user.pk), DiarySettings.objects.get(user=self.user))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def assertNotModified(self, url, response, **params):
+        with mock.patch('django.template.response.SimpleTemplateResponse.render') as render, \
+                self.assertQueryBudget(self.NOT_MODIFIED_BUDGET):
+            second = self.client.get(url, params, headers={'If-None-Match': response['ETag']})
+        render.assert_not_called()
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], response['ETag'])
+        return second
+
+    def test_entry_detail(self):
+        url = reverse('diary:entry_detail', kwargs={'pk': self.entries[0].pk})
+        response = self.client.get(url)
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertNotModified(url, response)
+
+        response = self.client.get(url, headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_entry_detail_changes(self):
+        entry = self.entries[0]
+        url = reverse('diary:entry_detail', kwargs={'pk': entry.pk})
+        etag = self.client.get(url)['ETag']
+
+        entry.text = 'Новый текст'
+        entry.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertContains(response, 'Новый текст')
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.client.post(reverse('diary:settings'), {'show_targets': 'on', 'default_targets': ''})
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_entry_detail_of_other_user(self):
+        other = User.objects.create(email='other-etag@example.com', display_name='Другой')
+        entry = DiaryEntry.objects.create(user=other, text='Чужая')
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': entry.pk}),
+                                   headers={'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_entry_list(self):
+        url = reverse('diary:entry_list')
+        response = self.client.get(url)
+        self.assertNotModified(url, response)
+
+        DiaryEntry.objects.create(user=self.user, text='Еще одна запись')
+        response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Еще одна запись')
+
+    def test_entry_list_filter(self):
+        url = reverse('diary:entry_list')
+        response = self.client.get(url, {'tag': 'работа'})
+        self.assertNotModified(url, response, tag='работа')
+        self.assertNotEqual(self.client.get(url)['ETag'], response['ETag'])
+
+        # Запись вне фильтра меняет облако тегов, поэтому страница с фильтром тоже обновляется
+        self.entries[1].delete()
+        second = self.client.get(url, {'tag': 'работа'}, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(second.status_code, 200)
+
+    def test_entry_list_search(self):
+        url = reverse('diary:entry_list')
+        response = self.client.get(url, {'q': 'запись'})
+        self.assertNotModified(url, response, q='запись')
+
+    def test_user_change(self):
+        url = reverse('diary:entry_list')
+        etag = self.client.get(url)['ETag']
+        user = User.objects.get(pk=self.user.pk)
+        user.display_name = 'Новое имя'
+        user.save()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class RequestTimingMiddlewareTestCase(TestCase):
+    """ Замеры запросов: заголовок Server-Timing и метрики Prometheus """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='timing@example.com', display_name='Замер')
+        cls.staff = User.objects.create(email='staff@example.com', display_name='Персонал', is_staff=True)
+        DiaryEntry.objects.create(user=cls.user, text='Запись')
+
+    def test_server_timing_for_staff_only(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('diary:entry_list'))
+        self.assertNotIn('Server-Timing', response.headers)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('diary:entry_list'))
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;desc="SQL queries: \d+";dur=[\d.]+')
+        self.assertIn('tpl;', timing)
+        self.assertIn('total;', timing)
+
+    def test_metrics_endpoint(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('diary:entry_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('diary_http_request_duration_seconds_bucket{le="0.005",method="GET",view="diary:entry_list"}',
+                      content)
+        self.assertIn('diary_http_db_queries_count{method="GET",view="diary:entry_list"}', content)
+        self.assertIn('diary_http_template_duration_seconds_count{method="GET",view="diary:entry_list"}', content)
+
+    def test_db_pool_metrics(self):
+        if connection.pool is None:
+            self.skipTest('Пул соединений отключен (DB_POOL=False)')
+        self.client.force_login(self.user)
+        self.client.get(reverse('diary:entry_list'))
+        content = self.client.get(reverse('metrics')).content.decode()
+        self.assertRegex(content, r'diary_db_pool_size\{database="default"\} [1-9]')
+        self.assertIn('diary_db_pool_max_size{database="default"}', content)
+        self.assertRegex(content, r'diary_db_pool_requests_total\{database="default"\} [1-9]')
+
+    @override_settings(METRICS_AUTH_TOKEN='secret')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5',
+                                   headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_AUTH_TOKEN=None, METRICS_ALLOWED_NETWORKS=['127.0.0.0/8', '10.0.0.0/8'])
+    def test_metrics_internal_only_without_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5').status_code, 404)
+        # Через nginx запрос приходит с внутреннего адреса, но с заголовком X-Forwarded-For
+        response = self.client.get(reverse('metrics'), headers={'X-Forwarded-For': '203.0.113.5'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_db_pool_stats_published_periodically(self):
+        self.client.force_login(self.user)
+        with mock.patch('config.metrics.observe_db_pools') as observe_db_pools, \
+                mock.patch('config.metrics._pools_observed_at', 0.0):
+            # статистика пула снимается после запроса не чаще DB_POOL_METRICS_INTERVAL
+            self.client.get(reverse('diary:entry_list'))
+            self.client.get(reverse('diary:entry_list'))
+            self.assertEqual(observe_db_pools.call_count, 1)
+            with override_settings(DB_POOL_METRICS_INTERVAL=0):
+                self.client.get(reverse('diary:entry_list'))
+            self.assertEqual(observe_db_pools.call_count, 2)
+
+    @override_settings(SERVER_TIMING='all')
+    def test_server_timing_for_all(self):
+        response = self.client.get(reverse('users:login'))
+        self.assertIn('Server-Timing', response.headers)
+
+    @override_settings(SERVER_TIMING='off')
+    def test_server_timing_off(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('diary:entry_list'))
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_server_timing_does_not_load_user(self):
+        # Ответ без обращения к пользователю: ради заголовка сессия и пользователь не загружаются
+        self.client.force_login(self.staff)
+        with mock.patch('django.contrib.auth.get_user') as get_user:
+            response = self.client.get(reverse('metrics'))
+        get_user.assert_not_called()
+        self.assertNotIn('Server-Timing', response.headers)
+
+    async def test_server_timing_async(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('diary:entry_list'))
+        self.assertNotIn('Server-Timing', response.headers)
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('diary:entry_list'))
+        self.assertIn('Server-Timing', response.headers)
+
+
+class StaticAndCompressionTestCase(TestCase):
+    """ Статика с хешами в именах и заранее сжатыми вариантами, сжатие ответов Django """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='static@example.com', display_name='Статика')
+        DiaryEntry.objects.create(user=cls.user, text='Запись')
+
+    def test_collectstatic(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        with override_settings(STATIC_ROOT=static_root):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            with open(os.path.join(static_root, 'staticfiles.json')) as file:
+                hashed_name = json.load(file)['paths']['css/bootstrap.min.css']
+            self.assertRegex(hashed_name, r'^css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+            self.assertEqual(static('css/bootstrap.min.css'), settings.STATIC_URL + hashed_name)
+
+        path = os.path.join(static_root, hashed_name)
+        with open(path, 'rb') as file:
+            content = file.read()
+        with open(f'{path}.gz', 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+        with open(f'{path}.br', 'rb') as file:
+            self.assertEqual(brotli.decompress(file.read()), content)
+
+    def test_static_without_manifest(self):
+        # до collectstatic (разработка) ссылки ведут на исходные файлы
+        self.assertEqual(static('css/bootstrap.min.css'), settings.STATIC_URL + 'css/bootstrap.min.css')
+
+    def test_html_gzip(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('diary:entry_list'), headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Запись', gzip.decompress(response.content).decode())
+
+    def test_compressed_export_not_recompressed(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('diary:entry_export'), {'format': 'ndjson', 'gzip': '1'},
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 1)
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class DailyStatsTestCase(QueryBudgetMixin, TestCase):
+    """ Дневные сводки записей: обновление при изменении записей, пересборка и страница статистики """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='stats@example.com', display_name='Статистика')
+        DiarySettings.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def snapshot(self):
+        return sorted(DailyStat.objects.filter(user=self.user).values_list(
+            'date', 'entry_count', 'word_count', 'char_count', 'tag_ids', 'tag_count'))
+
+    def test_updated_with_entries(self):
+        first = DiaryEntry.objects.create(user=self.user, text='Один два три')
+        first.tags.add('дом', 'работа')
+        second = DiaryEntry.objects.create(user=self.user, text='Четыре\nпять')
+        second.tags.add('дом')
+        stat = DailyStat.objects.get(user=self.user)
+        self.assertEqual(stat.date, entry_date(first))
+        self.assertEqual((stat.entry_count, stat.word_count, stat.char_count, stat.tag_count), (2, 5, 23, 2))
+
+        first.text = 'Один'
+        first.save()
+        first.tags.remove('работа')
+        stat.refresh_from_db()
+        self.assertEqual((stat.entry_count, stat.word_count, stat.tag_count), (2, 3, 1))
+
+        snapshot = self.snapshot()
+        rebuild_daily_stats([self.user.pk])
+        self.assertEqual(self.snapshot(), snapshot)
+
+        first.delete()
+        second.delete()
+        self.assertFalse(DailyStat.objects.filter(user=self.user).exists())
+
+    def test_rebuild_by_day(self):
+        for day, text in ((1, 'а б'), (1, 'в'), (3, 'г д е')):
+            entry = DiaryEntry.objects.create(user=self.user, text=text)
+            DiaryEntry.objects.filter(pk=entry.pk).update(created_at=timezone.now() - timedelta(days=day))
+        self.assertEqual(rebuild_daily_stats([self.user.pk]), 2)
+        today = timezone.localdate()
+        self.assertEqual(
+            [(date, count, words) for date, count, words, *_ in self.snapshot()],
+            [(today - timedelta(days=3), 1, 3), (today - timedelta(days=1), 2, 3)],
+        )
+
+    def test_streaks(self):
+        today = timezone.localdate()
+        for days_ago in (0, 1, 2, 5, 6, 7, 8, 20):
+            DailyStat.objects.create(user=self.user, date=today - timedelta(days=days_ago), entry_count=1)
+        self.assertEqual(get_streaks(self.user, today), (3, 4))
+        self.assertEqual(get_streaks(self.user, today + timedelta(days=1)), (3, 4))  # вчерашняя серия еще идет
+        self.assertEqual(get_streaks(self.user, today + timedelta(days=2)), (0, 4))
+
+    def test_stats_page_reads_rollups_only(self):
+        today = timezone.localdate()
+        DailyStat.objects.create(user=self.user, date=today, entry_count=4, word_count=40, tag_ids=[1, 2])
+        DailyStat.objects.create(user=self.user, date=today - timedelta(days=1), entry_count=1, tag_ids=[2, 3])
+        # сессия, сводки года и даты для серий
+        with self.assertQueryBudget(3) as context:
+            response = self.client.get(reverse('diary:stats'))
+        self.assertFalse([query for query in context.captured_queries if 'diary_diaryentry' in query['sql']])
+        self.assertEqual(response.context['current_streak'], 2)
+
+        days = {day['date']: day for week in response.context['heatmap'] for day in week}
+        self.assertEqual(days[today]['level'], 4)
+        month = response.context['months'][today.month - 1]
+        if today.day > 1:  # вчерашний день в том же месяце
+            self.assertEqual(days[today - timedelta(days=1)]['level'], 1)
+            self.assertEqual((month['days'], month['entry_count'], month['tag_count']), (2, 5, 3))
+
+    def test_invalid_year(self):
+        self.assertEqual(self.client.get(reverse('diary:stats'), {'year': 'abc'}).status_code, 404)
+
+
+class DailyStatsConcurrencyTestCase(TransactionTestCase):
+    """ Параллельные пересчеты сводки одного дня не затирают друг друга """
+
+    def test_concurrent_updates_same_day(self):
+        user = User.objects.create(email='stats-race@example.com', display_name='Гонка')
+        first = DiaryEntry.objects.create(user=user, text='один')
+        second = DiaryEntry.objects.create(user=user, text='два')
+        first_saved = threading.Event()
+        errors = []
+
+        def update_second():
+            try:
+                first_saved.wait()
+                second.text = 'два три четыре'
+                second.save()
+            except Exception as e:  # pragma: no cover - ошибка потока попадает в тест
+                errors.append(e)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=update_second)
+        thread.start()
+        with transaction.atomic():
+            first.text = 'один пять'
+            first.save()
+            first_saved.set()
+            # Второй пересчет ждет фиксации первого, а не считает день со старым текстом первой записи
+            time.sleep(0.3)
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(DailyStat.objects.get(user=user).word_count, 5)
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class GoalsTestCase(QueryBudgetMixin, TestCase):
+    """ Цели записей: разбор поля "Цели", связи с записями, пересборка и страницы целей """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='goals@example.com', display_name='Цели')
+        DiarySettings.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def links(self):
+        return sorted(EntryGoal.objects.filter(goal__user=self.user).values_list('entry_id', 'goal__key', 'created_at'))
+
+    def test_parse_goals(self):
+        self.assertEqual(parse_goals('Бег,  бег ;Чтение   книг\n\n'), {'бег': 'Бег', 'чтение книг': 'Чтение книг'})
+        self.assertEqual(parse_goals(''), {})
+
+    def test_links_follow_targets(self):
+        entry = DiaryEntry.objects.create(user=self.user, text='Утро', targets='Бег, Чтение')
+        self.assertEqual([key for _, key, _ in self.links()], ['бег', 'чтение'])
+
+        entry.targets = 'чтение; Сон'
+        entry.save()
+        self.assertEqual([key for _, key, _ in self.links()], ['сон', 'чтение'])
+        self.assertEqual(Goal.objects.filter(user=self.user).count(), 3)
+
+        # цели не изменились: только чтение текущих связей
+        with self.assertQueryBudget(1):
+            sync_entry_goals(entry)
+
+        entry.delete()
+        self.assertEqual(self.links(), [])
+
+    def test_rebuild_matches_incremental(self):
+        DiaryEntry.objects.create(user=self.user, text='а', targets='Бег')
+        DiaryEntry.objects.create(user=self.user, text='б', targets='бег, Йога')
+        DiaryEntry.objects.create(user=self.user, text='в')
+        links = self.links()
+        self.assertEqual(rebuild_entry_goals([self.user.pk]), 3)
+        self.assertEqual(self.links(), links)
+
+    def test_goal_pages(self):
+        for days_ago in (0, 1, 40, 400):
+            entry = DiaryEntry.objects.create(user=self.user, text=f'Запись {days_ago}', targets='Бег')
+            created_at = timezone.now() - timedelta(days=days_ago)
+            DiaryEntry.objects.filter(pk=entry.pk).update(created_at=created_at)
+            EntryGoal.objects.filter(entry=entry).update(created_at=created_at)
+        DiaryEntry.objects.create(user=self.user, text='Другое', targets='Сон')
+        run = Goal.objects.get(user=self.user, key='бег')
+
+        # сессия и цели с количеством записей
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse('diary:goal_list'))
+        goals = {goal.key: goal for goal in response.context['goals']}
+        self.assertEqual((goals['бег'].entry_count, goals['бег'].recent_count), (4, 2))
+
+        # сессия, цель, месяцы и страница записей
+        with self.assertQueryBudget(4) as context:
+            response = self.client.get(reverse('diary:goal_detail', args=[run.pk]))
+        self.assertEqual(
+            len([query for query in context.captured_queries if 'diary_diaryentry' in query['sql']]), 1)
+        self.assertEqual(sum(month['entry_count'] for month in response.context['months']), 3)
+        self.assertEqual([entry.text for entry in response.context['entries']][:2], ['Запись 0', 'Запись 1'])
+
+        other = User.objects.create(email='other-goals@example.com')
+        foreign = Goal.objects.create(user=other, key='бег', name='Бег')
+        self.assertEqual(self.client.get(reverse('diary:goal_detail', args=[foreign.pk])).status_code, 404)
+
+        # без графика по месяцам страница цели открывается
+        with self.settings(GOAL_PROGRESS_MONTHS=0):
+            response = self.client.get(reverse('diary:goal_detail', args=[run.pk]))
+        self.assertEqual((response.context['months'], response.context['max_month_count']), ([], 0))
+
+
+@override_settings(DIARY_DRAFT_QUEUE=True, **SHARED_CACHE_SETTINGS)
+class EntryDraftTestCase(QueryBudgetMixin, TestCase):
+    """ Черновики формы записи: автосохранение в кеш, перенос в базу пачками, восстановление и удаление """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='drafts@example.com', display_name='Черновик')
+        DiarySettings.objects.create(user=cls.user, custom_fields_names=['mood'])
+        cls.entry = DiaryEntry.objects.create(user=cls.user, text='Старый текст')
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        cache.set(settings_cache_key(self.user.pk), DiarySettings.objects.get(user=self.user))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def autosave(self, entry=None, **data):
+        url = reverse('diary:entry_draft', kwargs={'pk': entry.pk} if entry else None)
+        return self.client.post(url, {'text': '', 'targets': '', 'tags': '', **data})
+
+    def test_autosave_writes_cache_only(self):
+        for text in ('Ч', 'Черн', 'Черновик'):
+            with self.assertQueryBudget(1):  # только сессия
+                response = self.autosave(text=text, custom_mood='хорошее')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(EntryDraft.objects.exists())
+        draft = cache.get(draft_cache_key(self.user.pk))
+        self.assertEqual((draft['text'], draft['custom_values']), ('Черновик', {'mood': 'хорошее'}))
+
+        response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual(response.context['form'].initial['text'], 'Черновик')
+        self.assertEqual(response.context['custom_fields'], [{'name': 'mood', 'value': 'хорошее'}])
+
+    def test_flush_in_batches(self):
+        other = User.objects.create(email='drafts-other@example.com')
+        for number in range(3):
+            save_draft(self.user.pk, None, {'text': f'новая {number}', 'targets': '', 'tags': '', 'custom_values': {}})
+        save_draft(self.user.pk, self.entry.pk, {'text': 'правка', 'targets': 'Бег', 'tags': '', 'custom_values': {}})
+        save_draft(other.pk, self.entry.pk, {'text': 'чужая', 'targets': '', 'tags': '', 'custom_values': {}})
+
+        # проверка пользователей и записей и одна вставка на пачку
+        with self.assertQueryBudget(3):
+            self.assertEqual(flush_drafts(batch_size=10), 2)
+        self.assertEqual(
+            list(EntryDraft.objects.order_by('text').values_list('entry_id', 'text')),
+            [(None, 'новая 2'), (self.entry.pk, 'правка')],
+        )
+        self.assertEqual(flush_drafts(), 0)
+
+        save_draft(self.user.pk, None, {'text': 'новая 3', 'targets': '', 'tags': '', 'custom_values': {}})
+        self.assertEqual(flush_drafts(batch_size=1), 1)
+        self.assertEqual(EntryDraft.objects.get(entry=None).text, 'новая 3')
+
+        # кеш потерян: черновик восстанавливается из базы
+        cache.clear()
+        self.assertEqual(get_draft(self.user.pk, self.entry.pk)['targets'], 'Бег')
+
+    def test_draft_cleared_on_save(self):
+        self.autosave(self.entry, text='Новый текст')
+        flush_drafts()
+        response = self.client.get(reverse('diary:entry_update', kwargs={'pk': self.entry.pk}))
+        self.assertEqual(response.context['form'].initial['text'], 'Новый текст')
+        self.assertContains(response, 'Восстановлен несохраненный черновик')
+
+        self.client.post(reverse('diary:entry_update', kwargs={'pk': self.entry.pk}), {'text': 'Новый текст'})
+        self.assertFalse(EntryDraft.objects.exists())
+        self.assertIsNone(get_draft(self.user.pk, self.entry.pk))
+        response = self.client.get(reverse('diary:entry_update', kwargs={'pk': self.entry.pk}))
+        self.assertIsNone(response.context['draft'])
+
+    def test_stale_draft_ignored(self):
+        self.autosave(self.entry, text='Устаревший')
+        DiaryEntry.objects.filter(pk=self.entry.pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.client.get(reverse('diary:entry_update', kwargs={'pk': self.entry.pk}))
+        self.assertIsNone(response.context['draft'])
+        self.assertContains(response, 'Старый текст')
+
+    @override_settings(DIARY_DRAFT_MAX_LENGTH=5)
+    def test_too_long(self):
+        self.assertEqual(self.autosave(text='Слишком длинный').status_code, 413)
+        self.assertIsNone(get_draft(self.user.pk))
+
+    def test_flush_waits_for_queue_item(self):
+        draft = {'text': 'первый', 'targets': '', 'tags': '', 'custom_values': {}}
+        save_draft(self.user.pk, None, draft)
+        # Другое автосохранение получило номер 2, но еще не записало элемент очереди
+        cache.incr(drafts.QUEUE_SEQUENCE_KEY)
+        save_draft(self.user.pk, self.entry.pk, {**draft, 'text': 'второй'})
+
+        self.assertEqual(flush_drafts(), 1)
+        self.assertEqual(cache.get(drafts.QUEUE_FLUSHED_KEY), 1)
+        self.assertIsNotNone(cache.get(drafts._queue_item_key(3)))
+
+        cache.set(drafts._queue_item_key(2), (self.user.pk, self.entry.pk))
+        self.assertEqual(flush_drafts(), 1)
+        self.assertEqual(cache.get(drafts.QUEUE_FLUSHED_KEY), 3)
+        self.assertEqual(EntryDraft.objects.get(entry=self.entry).text, 'второй')
+        # Флаг очереди снят: следующее автосохранение снова ставит черновик в очередь
+        self.assertIsNone(cache.get(drafts._queued_key(self.user.pk, self.entry.pk)))
+
+    def test_lost_queue_item_skipped(self):
+        draft = {'text': 'после потери', 'targets': '', 'tags': '', 'custom_values': {}}
+        cache.add(drafts.QUEUE_SEQUENCE_KEY, 0, None)
+        cache.incr(drafts.QUEUE_SEQUENCE_KEY)
+        save_draft(self.user.pk, None, draft)
+        self.assertEqual(flush_drafts(), 0)
+        with mock.patch('diary.drafts.time.time', return_value=time.time() + drafts.QUEUE_ITEM_WAIT):
+            self.assertEqual(flush_drafts(), 1)
+        self.assertEqual(EntryDraft.objects.get().text, 'после потери')
+
+    def test_flush_lock_released_only_by_owner(self):
+        def steal_lock(*args, **kwargs):
+            # Блокировка истекла во время переноса, и ее взял другой перенос
+            cache.set(drafts.FLUSH_LOCK_KEY, 'other')
+            return 0
+
+        save_draft(self.user.pk, None, {'text': 'текст', 'targets': '', 'tags': '', 'custom_values': {}})
+        with mock.patch('diary.drafts._flush_batch', side_effect=steal_lock):
+            flush_drafts()
+        self.assertEqual(cache.get(drafts.FLUSH_LOCK_KEY), 'other')
+        self.assertEqual(flush_drafts(), 0)
+
+    @override_settings(DIARY_DRAFT_QUEUE=False)
+    def test_without_shared_cache(self):
+        self.autosave(text='В базу')
+        self.autosave(self.entry, text='Правка')
+        self.assertEqual(flush_drafts(), 0)
+        self.assertEqual(EntryDraft.objects.get(entry=None).text, 'В базу')
+        self.assertIsNone(cache.get(draft_cache_key(self.user.pk)))
+        response = self.client.get(reverse('diary:entry_create'))
+        self.assertEqual(response.context['form'].initial['text'], 'В базу')
+
+        other = User.objects.create(email='drafts-stranger@example.com')
+        save_draft(other.pk, self.entry.pk, {'text': 'чужая', 'targets': '', 'tags': '', 'custom_values': {}})
+        self.assertEqual(EntryDraft.objects.filter(user=other).count(), 0)
+
+        self.client.post(reverse('diary:entry_update', kwargs={'pk': self.entry.pk}), {'text': 'Правка'})
+        self.assertFalse(EntryDraft.objects.filter(entry=self.entry).exists())
+
+
+ASYNC_VIEWS = {
+    'home': AsyncHomePageView.as_view(),
+    'entry_list': AsyncDiaryEntryListView.as_view(),
+    'entry_detail': AsyncDiaryEntryDetailView.as_view(),
+}
+
+
+class AsyncViewsUrls:
+    """ Маршруты с асинхронными контроллерами (как при DIARY_ASYNC_VIEWS = True) """
+    urlpatterns = [
+        path('', include((
+            [path(str(pattern.pattern), ASYNC_VIEWS.get(pattern.name, pattern.callback), name=pattern.name)
+             for pattern in diary_urls.urlpatterns],
+            'diary',
+        ))),
+        path('users/', include('users.urls', namespace='users')),
+        path('metrics', metrics_view, name='metrics'),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsUrls, DIARY_ASYNC_PARALLEL_QUERIES=False, **SHARED_CACHE_SETTINGS)
+class AsyncViewsTestCase(QueryBudgetMixin, TestCase):
+    """ Асинхронные контроллеры: те же страницы и тот же бюджет SQL-запросов """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='async@example.com', display_name='Асинхронный')
+        DiarySettings.objects.create(user=cls.user, custom_fields_names=['mood'])
+        cls.entries = []
+        for number in range(12):
+            entry = DiaryEntry.objects.create(user=cls.user, text=f'Запись {number}', custom_values={'mood': 'ок'})
+            entry.tags.add('дом')
+            cls.entries.append(entry)
+
+    def setUp(self):
+        cache.clear()
+        get_user_roles(User.objects.get(pk=self.user.pk))
+        cache.set(settings_cache_key(self.user.pk), DiarySettings.objects.get(user=self.user))
+        self.client.force_login(self.user)
+        get_cached_user(self.user.pk)
+
+    def test_entry_list(self):
+        with self.assertQueryBudget(DiaryViewsQueryBudgetTestCase.LIST_BUDGET):
+            response = self.client.get(reverse('diary:entry_list'))
+        self.assertEqual(len(response.context['entries']), 10)
+        self.assertEqual([item.tag.name for item in response.context['tag_cloud']], ['дом'])
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('diary:entry_list'), {'cursor': cursor})
+        self.assertEqual(len(response.context['entries']), 2)
+
+    def test_entry_list_search(self):
+        response = self.client.get(reverse('diary:entry_list'), {'q': 'запись'})
+        self.assertEqual(response.context['paginator'].count, 12)
+
+    def test_entry_detail(self):
+        with self.assertQueryBudget(DiaryViewsQueryBudgetTestCase.DETAIL_BUDGET):
+            response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': self.entries[0].pk}))
+        self.assertContains(response, 'Запись 0')
+        self.assertEqual(response.context['custom_fields'], [{'name': 'mood', 'value': 'ок'}])
+
+    def test_not_modified(self):
+        for url in (reverse('diary:entry_list'), reverse('diary:entry_detail', kwargs={'pk': self.entries[0].pk})):
+            etag = self.client.get(url)['ETag']
+            with self.assertQueryBudget(ConditionalGetTestCase.NOT_MODIFIED_BUDGET):
+                response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_home(self):
+        self.client.get(reverse('diary:home'))
+        with self.assertQueryBudget(DiaryViewsQueryBudgetTestCase.HOME_BUDGET):
+            response = self.client.get(reverse('diary:home'))
+        self.assertEqual(response.context['user_entries'], 12)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse('diary:entry_list'))
+        self.assertEqual(response.status_code, 302)
+        other = User.objects.create(email='stranger@example.com', display_name='Чужой')
+        self.client.force_login(other)
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': self.entries[0].pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROOT_URLCONF=AsyncViewsUrls, DIARY_ASYNC_PARALLEL_QUERIES=True)
+class AsyncParallelQueriesTestCase(TransactionTestCase):
+    """ Параллельные запросы асинхронных контроллеров (каждый в своем соединении) """
+
+    def test_entry_list_and_detail(self):
+        user = User.objects.create(email='parallel@example.com', display_name='Параллельный')
+        entry = DiaryEntry.objects.create(user=user, text='Параллельная запись')
+        entry.tags.add('дом')
+        self.client.force_login(user)
+        response = self.client.get(reverse('diary:entry_list'))
+        self.assertEqual([item.text for item in response.context['entries']], ['Параллельная запись'])
+        self.assertEqual(len(response.context['tag_cloud']), 1)
+        response = self.client.get(reverse('diary:entry_detail', kwargs={'pk': entry.pk}))
+        self.assertContains(response, 'Параллельная запись')
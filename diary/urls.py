@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 
 from .views import (
@@ -11,21 +12,47 @@ from .views import (
     SettingsView,
     DiaryEntryCreateView,
     DiaryEntryDetailView,
-    UpdateCustomFieldsView
+    DiaryEntryDraftView,
+    UpdateCustomFieldsView,
+    DiaryExportView,
+    DiaryImportView,
+    DiaryStatsView,
+    GoalListView,
+    GoalDetailView,
+    AsyncHomePageView,
+    AsyncDiaryEntryListView,
+    AsyncDiaryEntryDetailView,
 )
 
+# При запуске через ASGI (uvicorn) читающие страницы обслуживаются асинхронными контроллерами
+if settings.DIARY_ASYNC_VIEWS:
+    home_view = AsyncHomePageView.as_view()
+    entry_list_view = AsyncDiaryEntryListView.as_view()
+    entry_detail_view = AsyncDiaryEntryDetailView.as_view()
+else:
+    home_view = HomePageView.as_view()
+    entry_list_view = DiaryEntryListView.as_view()
+    entry_detail_view = DiaryEntryDetailView.as_view()
+
 app_name = 'diary'
 
 urlpatterns = [
-    path('', HomePageView.as_view(), name='home'),
+    path('', home_view, name='home'),
     # path('settings/', DiarySettingsView.as_view(), name='settings'),
-    path('list/', DiaryEntryListView.as_view(), name='entry_list'),
+    path('list/', entry_list_view, name='entry_list'),
     # path('create/', DiaryEntryCreateView.as_view(), name='entry_create'),
     # path('<int:pk>/', DiaryEntryDetailView.as_view(), name='entry_detail'),
     path('<int:pk>/update/', DiaryEntryUpdateView.as_view(), name='entry_update'),
     path('<int:pk>/delete/', DiaryEntryDeleteView.as_view(), name='entry_confirm_delete'),
     path('settings/', SettingsView.as_view(), name='settings'),
     path('entries/create/', DiaryEntryCreateView.as_view(), name='entry_create'),
-    path('entries/<int:pk>/', DiaryEntryDetailView.as_view(), name='entry_detail'),
+    path('entries/<int:pk>/', entry_detail_view, name='entry_detail'),
+    path('entries/draft/', DiaryEntryDraftView.as_view(), name='entry_draft'),
+    path('entries/<int:pk>/draft/', DiaryEntryDraftView.as_view(), name='entry_draft'),
     path('update-custom-fields/', UpdateCustomFieldsView.as_view(), name='update_custom_fields'),
+    path('export/', DiaryExportView.as_view(), name='entry_export'),
+    path('import/', DiaryImportView.as_view(), name='entry_import'),
+    path('stats/', DiaryStatsView.as_view(), name='stats'),
+    path('goals/', GoalListView.as_view(), name='goal_list'),
+    path('goals/<int:pk>/', GoalDetailView.as_view(), name='goal_detail'),
 ]
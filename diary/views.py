@@ -1,14 +1,38 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+
+from asgiref.sync import sync_to_async
+from django.conf import settings as django_settings
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404
-from django.urls import reverse_lazy
+from django.core.files.storage import storages
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
-from django.views.generic import CreateView, UpdateView, DetailView, TemplateView, ListView, DeleteView
-from taggit.models import Tag
-
-from .forms import DiarySettingsForm, DiaryEntryForm
-from .models import DiaryEntry, DiarySettings, CustomField
+from django.views.generic import View, CreateView, UpdateView, DetailView, TemplateView, ListView, DeleteView, FormView
+
+from .concurrency import run_parallel
+from .conditional import ConditionalGetMixin, page_etag
+from .counters import aget_entry_counts, get_entry_counts
+from .daily_stats import build_heatmap, build_monthly_stats, get_streaks, get_year_stats
+from .drafts import DRAFT_FIELDS, clear_draft, draft_from_post, get_draft, save_draft
+from .export import EXPORT_FORMATS, astream_export, export_filename, stream_export
+from .forms import DiarySettingsForm, DiaryEntryForm, DiaryImportForm
+from .fragments import render_entry_fragments
+from .goals import get_goal_progress, get_monthly_progress
+from .importer import schedule_import
+from .models import DiaryEntry, EntryGoal, Goal, ImportJob
+from .pagination import KeysetPaginator
+from .search import build_search_query, search_entries
+from .services import (
+    custom_values_from_post, filter_by_custom_fields, get_diary_settings, save_custom_fields, settings_version,
+)
+from .tag_counts import get_tag_cloud
 
 
 class HomePageView(TemplateView):
@@ -16,9 +40,9 @@ class HomePageView(TemplateView):
     template_name = "home.html"
 
     def get_context_data(self, **kwargs):
-        # предполагалось, что я покажу пользователю, сколько у него записей в дневнике
+        # Количество записей берется из таблицы счетчиков, а не подсчетом по всей таблице записей
         context = super().get_context_data(**kwargs)
-        context["total_entries"] = DiaryEntry.objects.count()
+        context["user_entries"], context["total_entries"] = get_entry_counts(self.request.user)
         return context
 
 
@@ -29,8 +53,7 @@ class SettingsView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('diary:settings')
 
     def get_object(self, queryset=None):
-        obj, created = DiarySettings.objects.get_or_create(user=self.request.user)
-        return obj
+        return get_diary_settings(self.request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -44,7 +67,48 @@ class SettingsView(LoginRequiredMixin, UpdateView):
         return super().form_valid(form)
 
 
-class DiaryEntryCreateView(LoginRequiredMixin, CreateView):
+class EntryDraftMixin:
+    """ Черновик формы записи: восстанавливается из автосохранения при открытии формы
+    и удаляется после успешного сохранения записи """
+
+    def get_draft_entry_id(self):
+        return None
+
+    def get_draft(self):
+        if not hasattr(self, '_draft'):
+            self._draft = None
+            if self.request.method == 'GET':
+                self._draft = get_draft(self.request.user.pk, self.get_draft_entry_id())
+        return self._draft
+
+    def get_initial(self):
+        initial = super().get_initial()
+        draft = self.get_draft()
+        if draft:
+            initial.update({field: draft[field] for field in DRAFT_FIELDS})
+        return initial
+
+    def get_custom_values(self):
+        draft = self.get_draft()
+        return draft['custom_values'] if draft else {}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        entry_id = self.get_draft_entry_id()
+        context.update({
+            'draft': self.get_draft(),
+            'draft_url': reverse('diary:entry_draft', kwargs={'pk': entry_id} if entry_id else None),
+            'draft_delay': getattr(django_settings, 'DIARY_DRAFT_AUTOSAVE_DELAY', 2000),
+        })
+        return context
+
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        clear_draft(self.request.user.pk, self.get_draft_entry_id())
+        return response
+
+
+class DiaryEntryCreateView(LoginRequiredMixin, EntryDraftMixin, CreateView):
     """ Контроллер для создания новой записи дневника"""
     model = DiaryEntry
     form_class = DiaryEntryForm
@@ -58,16 +122,18 @@ class DiaryEntryCreateView(LoginRequiredMixin, CreateView):
 
     def get_initial(self):
         initial = super().get_initial()
-        settings = get_object_or_404(DiarySettings, user=self.request.user)
-        initial['targets'] = settings.default_targets
+        settings = get_diary_settings(self.request)
+        # Цели из черновика не заменяются целями по умолчанию
+        initial.setdefault('targets', settings.default_targets)
         return initial
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        settings = get_object_or_404(DiarySettings, user=self.request.user)
+        settings = get_diary_settings(self.request)
 
-        # Создаем список словарей с именами полей и пустыми значениями
-        custom_fields = [{'name': name, 'value': ''} for name in settings.custom_fields_names]
+        # Создаем список словарей с именами полей и значениями из черновика (если он есть)
+        custom_values = self.get_custom_values()
+        custom_fields = [{'name': name, 'value': custom_values.get(name, '')} for name in settings.custom_fields_names]
 
         context.update({
             'custom_fields': custom_fields,
@@ -79,33 +145,48 @@ class DiaryEntryCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.user = self.request.user
+        settings = get_diary_settings(self.request)
+        custom_values = custom_values_from_post(self.request.POST, settings.custom_fields_names)
+        # Значения пользовательских полей сохраняются вместе с записью одним INSERT
+        form.instance.custom_values = custom_values
         response = super().form_valid(form)
-
-        settings = get_object_or_404(DiarySettings, user=self.request.user)
-        for field_name in settings.custom_fields_names:
-            value = self.request.POST.get(f'custom_{field_name}', '').strip()
-            if value:
-                CustomField.objects.create(
-                    entry=self.object,
-                    name=field_name,
-                    value=value
-                )
+        # В режиме 'rows' строки CustomField пишутся по разнице с сохраненными
+        save_custom_fields(self.object, custom_values)
 
         return response
 
 
-class DiaryEntryDetailView(LoginRequiredMixin, DetailView):
+class DiaryEntryDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     """ Контроллер для просмотра конкретной записи дневника"""
     model = DiaryEntry
     template_name = 'diary/entry_detail.html'
     context_object_name = 'entry'
 
+    def entry_validators(self, updated_at):
+        settings = get_diary_settings(self.request)
+        return page_etag(self.request, 'entry', self.kwargs['pk'], updated_at, settings_version(settings)), updated_at
+
+    def get_validators(self):
+        # Для проверки загружается только время изменения записи
+        updated_at = (
+            DiaryEntry.objects.filter(pk=self.kwargs['pk'], user=self.request.user)
+            .values_list('updated_at', flat=True)
+            .first()
+        )
+        return self.entry_validators(updated_at) if updated_at else None
+
+    def get_response_validators(self):
+        return self.entry_validators(self.object.updated_at)
+
     def get_queryset(self):
+        # Теги загружаются только при промахе кеша фрагментов (см. render_entry_fragments)
         return super().get_queryset().filter(user=self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['custom_fields'] = self.object.custom_fields.all()
+        settings = get_diary_settings(self.request)
+        render_entry_fragments([self.object], 'body', settings)
+        context['custom_fields'] = self.object.get_custom_fields(settings.custom_fields_names)
         return context
 
 
@@ -113,49 +194,111 @@ class DiaryEntryDetailView(LoginRequiredMixin, DetailView):
 class UpdateCustomFieldsView(LoginRequiredMixin, TemplateView):
     """ Контроллер для обновления пользовательских полей дневника"""
     def post(self, request, *args, **kwargs):
-        settings = get_object_or_404(DiarySettings, user=request.user)
+        settings = get_diary_settings(request)
         custom_fields = request.POST.getlist('custom_fields[]')
         settings.custom_fields_names = [f.strip() for f in custom_fields if f.strip()]
         settings.save()
         return JsonResponse({'status': 'ok'})
 
 
-class DiaryEntryListView(LoginRequiredMixin, ListView):
+class DiaryEntryListView(LoginRequiredMixin, ConditionalGetMixin, ListView):
     """ Контроллер для просмотра списка записей дневника"""
     model = DiaryEntry
     template_name = 'diary/entry_list.html'
     context_object_name = 'entries'
     paginate_by = 10
 
-    def get_queryset(self):
+    def get_filtered_queryset(self):
+        """ Записи пользователя с фильтрами по тегу и пользовательским полям (без поиска и сортировки) """
+        # Теги загружаются только для записей, которых нет в кеше фрагментов
         queryset = DiaryEntry.objects.filter(user=self.request.user)
 
-        # Поиск по тексту
-        search_query = self.request.GET.get('q')
-        if search_query:
-            queryset = queryset.filter(text__icontains=search_query)
-
         # Поиск по тегам
         tag_query = self.request.GET.get('tag')
         if tag_query:
             queryset = queryset.filter(tags__name__in=[tag_query])
 
+        # Фильтры по пользовательским полям (?cf_mood=хорошее)
+        queryset, self.custom_filters = filter_by_custom_fields(queryset, self.request.GET)
+        return queryset
+
+    def get_queryset(self):
+        queryset = self.get_filtered_queryset()
+
+        # Полнотекстовый поиск: результаты сортируются по релевантности
+        search_query = self.request.GET.get('q', '').strip()
+        if search_query:
+            return search_entries(queryset, search_query)
+
         return queryset.order_by('-created_at')
 
+    def get_validators(self):
+        """ ETag и Last-Modified списка: дата последнего изменения и количество записей по текущему
+        фильтру и по всем записям пользователя (от них зависит облако тегов). Считаются одним
+        агрегатом по индексу (user, updated_at), сами записи не загружаются """
+        if hasattr(self, '_validators'):
+            return self._validators
+        filtered = self.get_filtered_queryset()
+        search_query = self.request.GET.get('q', '').strip()
+        if search_query:
+            filtered = filtered.filter(search_vector=build_search_query(search_query))
+
+        entries = DiaryEntry.objects.filter(user=self.request.user).order_by()
+        # COUNT(*), а не COUNT(id): id нет в индексе, и PostgreSQL пришлось бы читать таблицу.
+        # Count('*') нельзя использовать с filter, поэтому отфильтрованные записи считаются по
+        # обязательному полю updated_at из того же индекса
+        aggregates = {'last_modified': Max('updated_at'), 'count': Count('*')}
+        if search_query or self.custom_filters or self.request.GET.get('tag'):
+            matched = Q(pk__in=filtered.values('pk'))
+            aggregates.update(filtered_modified=Max('updated_at', filter=matched),
+                              filtered_count=Count('updated_at', filter=matched))
+        stats = entries.aggregate(**aggregates)
+
+        settings = get_diary_settings(self.request)
+        etag = page_etag(self.request, 'list', sorted(stats.items()), settings_version(settings))
+        self._validators = etag, stats['last_modified']
+        return self._validators
+
+    def use_cursor_pagination(self):
+        """ Курсорная пагинация возможна только при сортировке по дате
+        (результаты полнотекстового поиска сортируются по релевантности) """
+        if getattr(django_settings, 'DIARY_LIST_PAGINATION', 'cursor') != 'cursor':
+            return False
+        return not self.request.GET.get('q', '').strip()
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_filter_context(self):
+        """ Параметры поиска и фильтров для шаблона """
+        return {
+            'show_total': getattr(django_settings, 'DIARY_LIST_SHOW_TOTAL', False),
+            'search_query': self.request.GET.get('q', ''),
+            'tag_query': self.request.GET.get('tag', ''),
+            'custom_filters': self.custom_filters,
+        }
+
+    def render_fragments(self, page):
+        """ Карточки записей страницы из кеша фрагментов """
+        page.object_list = render_entry_fragments(page.object_list, 'card', get_diary_settings(self.request))
+        return page.object_list
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['search_query'] = self.request.GET.get('q', '')
-        context['tag_query'] = self.request.GET.get('tag', '')
+        context['entries'] = context['object_list'] = self.render_fragments(context['page_obj'])
+        context.update(self.get_filter_context())
 
-        # Получаем все теги пользователя
-        context['tags'] = Tag.objects.filter(
-            diaryentry__user=self.request.user
-        ).distinct()
+        # Облако тегов пользователя из таблицы счетчиков
+        context['tag_cloud'] = get_tag_cloud(self.request.user)
 
         return context
 
 
-class DiaryEntryUpdateView(LoginRequiredMixin, UpdateView):
+class DiaryEntryUpdateView(LoginRequiredMixin, EntryDraftMixin, UpdateView):
     """ Контроллер для обновления записи дневника"""
     model = DiaryEntry
     form_class = DiaryEntryForm
@@ -165,12 +308,25 @@ class DiaryEntryUpdateView(LoginRequiredMixin, UpdateView):
     def get_queryset(self):
         return super().get_queryset().filter(user=self.request.user)
 
+    def get_draft_entry_id(self):
+        return self.object.pk
+
+    def get_draft(self):
+        draft = super().get_draft()
+        # Черновик, сохраненный раньше последнего изменения записи, устарел
+        if draft and draft['saved_at'] <= self.object.updated_at:
+            self._draft = draft = None
+        return draft
+
+    def get_custom_values(self):
+        return super().get_custom_values() if self.get_draft() else self.object.custom_values
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        settings = get_object_or_404(DiarySettings, user=self.request.user)
+        settings = get_diary_settings(self.request)
 
-        # Получаем текущие значения кастомных полей
-        existing_fields = {field.name: field.value for field in self.object.custom_fields.all()}
+        # Получаем текущие значения кастомных полей (или значения из черновика)
+        existing_fields = self.get_custom_values()
 
         # Создаем список всех кастомных полей с их значениями
         custom_fields = []
@@ -189,19 +345,13 @@ class DiaryEntryUpdateView(LoginRequiredMixin, UpdateView):
         return context
 
     def form_valid(self, form):
+        settings = get_diary_settings(self.request)
+        custom_values = custom_values_from_post(self.request.POST, settings.custom_fields_names)
+        # Значения пользовательских полей сохраняются вместе с записью одним UPDATE
+        form.instance.custom_values = custom_values
         response = super().form_valid(form)
-        settings = get_object_or_404(DiarySettings, user=self.request.user)
-
-        # Обновляем кастомные поля
-        self.object.custom_fields.all().delete()  # Удаляем старые
-        for field_name in settings.custom_fields_names:
-            value = self.request.POST.get(f'custom_{field_name}', '').strip()
-            if value:
-                CustomField.objects.create(
-                    entry=self.object,
-                    name=field_name,
-                    value=value
-                )
+        # В режиме 'rows' строки CustomField пишутся по разнице с сохраненными
+        save_custom_fields(self.object, custom_values)
 
         return response
 
@@ -209,6 +359,21 @@ class DiaryEntryUpdateView(LoginRequiredMixin, UpdateView):
         return reverse_lazy('diary:entry_detail', kwargs={'pk': self.object.pk})
 
 
+@method_decorator(require_POST, name='dispatch')
+class DiaryEntryDraftView(LoginRequiredMixin, View):
+    """ Контроллер автосохранения черновика формы записи (без pk - новой записи).
+    Черновик пишется только в кеш; в базу черновики переносит пачками задача flush_entry_drafts
+    (без общего кеша, DIARY_DRAFT_QUEUE = False - сразу в базу) """
+
+    def post(self, request, pk=None):
+        max_length = getattr(django_settings, 'DIARY_DRAFT_MAX_LENGTH', 100_000)
+        if len(request.POST.get('text', '')) > max_length:
+            return JsonResponse({'error': f'Текст черновика длиннее {max_length} символов'}, status=413)
+        settings = get_diary_settings(request)
+        draft = save_draft(request.user.pk, pk, draft_from_post(request.POST, settings.custom_fields_names))
+        return JsonResponse({'saved_at': draft['saved_at'].isoformat()})
+
+
 class DiaryEntryDeleteView(LoginRequiredMixin, DeleteView):
     """ Контроллер для удаления записи дневника """
     model = DiaryEntry
@@ -218,3 +383,199 @@ class DiaryEntryDeleteView(LoginRequiredMixin, DeleteView):
 
     def get_queryset(self):
         return DiaryEntry.objects.filter(user=self.request.user)
+
+
+class DiaryExportView(LoginRequiredMixin, View):
+    """ Контроллер для выгрузки всего дневника пользователя (?format=ndjson|json|csv&gzip=1).
+    Файл формируется и отдается потоком, не собираясь целиком в памяти (и под WSGI, и под ASGI) """
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'ndjson')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404('Неизвестный формат выгрузки')
+        compress = request.GET.get('gzip') in ('1', 'true', 'on')
+
+        content_type = 'application/gzip' if compress else f'{EXPORT_FORMATS[export_format][0]}; charset=utf-8'
+        # Под ASGI (SERVER_MODE=asgi) ответ должен получить асинхронный итератор, иначе Django
+        # соберет всю выгрузку в памяти перед отправкой
+        stream = astream_export if isinstance(request, ASGIRequest) else stream_export
+        response = StreamingHttpResponse(
+            stream(request.user, export_format, compress=compress),
+            content_type=content_type,
+        )
+        filename = export_filename(export_format, compress, timezone.localdate())
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class DiaryImportView(LoginRequiredMixin, FormView):
+    """ Контроллер для импорта записей из файла. Файл сохраняется под случайным именем в закрытое
+    хранилище imports, импорт выполняется в фоне задачей Celery; на странице показываются последние задания """
+    template_name = 'diary/entry_import.html'
+    form_class = DiaryImportForm
+    success_url = reverse_lazy('diary:entry_import')
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        source = storages['imports'].save(f'{self.request.user.pk}/{uuid4().hex}', upload)
+        job = ImportJob.objects.create(user=self.request.user, source=source)
+        schedule_import(job.pk)
+        messages.success(self.request, 'Файл загружен, импорт запущен')
+        return super().form_valid(form)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['jobs'] = ImportJob.objects.filter(user=self.request.user).order_by('-created_at')[:10]
+        return context
+
+
+class DiaryStatsView(LoginRequiredMixin, TemplateView):
+    """ Контроллер статистики записей: календарь года, серии дней подряд и статистика по месяцам.
+    Данные берутся только из дневных сводок (DailyStat), без агрегации по таблице записей """
+    template_name = 'diary/stats.html'
+
+    def get_year(self):
+        today = timezone.localdate()
+        try:
+            year = int(self.request.GET.get('year', today.year))
+        except ValueError:
+            raise Http404('Некорректный год')
+        if not 1 < year < 9999:
+            raise Http404('Некорректный год')
+        return year
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        year = self.get_year()
+        stats = get_year_stats(self.request.user, year)
+        current_streak, longest_streak = get_streaks(self.request.user)
+        months = build_monthly_stats(stats, year)
+        context.update({
+            'year': year,
+            'heatmap': build_heatmap(stats, year),
+            'months': months,
+            'year_totals': {
+                'days': len(stats),
+                'entry_count': sum(month['entry_count'] for month in months),
+                'word_count': sum(month['word_count'] for month in months),
+            },
+            'current_streak': current_streak,
+            'longest_streak': longest_streak,
+        })
+        return context
+
+
+class GoalListView(LoginRequiredMixin, ListView):
+    """ Контроллер списка целей пользователя: сколько записей упоминают цель всего
+    и за последние GOAL_RECENT_DAYS дней, дата последней записи """
+    template_name = 'diary/goal_list.html'
+    context_object_name = 'goals'
+
+    def get_queryset(self):
+        recent_days = getattr(django_settings, 'GOAL_RECENT_DAYS', 30)
+        return get_goal_progress(self.request.user, timezone.now() - timedelta(days=recent_days))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['recent_days'] = getattr(django_settings, 'GOAL_RECENT_DAYS', 30)
+        return context
+
+
+class GoalDetailView(LoginRequiredMixin, DetailView):
+    """ Контроллер прогресса по цели: записи с целью по месяцам и сами записи (курсорная пагинация).
+    Оба запроса идут по индексу связей (goal, created_at, id) """
+    template_name = 'diary/goal_detail.html'
+    context_object_name = 'goal'
+    paginate_by = 20
+
+    def get_queryset(self):
+        return Goal.objects.filter(user=self.request.user)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        links = EntryGoal.objects.filter(goal=self.object).select_related('entry')
+        page = KeysetPaginator(links, self.paginate_by).page(self.request.GET.get('cursor'))
+        months = get_monthly_progress(self.object, getattr(django_settings, 'GOAL_PROGRESS_MONTHS', 12))
+        context.update({
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'entries': [link.entry for link in page],
+            'months': months,
+            'max_month_count': max((month['entry_count'] for month in months), default=0),
+        })
+        return context
+
+
+class AsyncUserMixin:
+    """ Асинхронная диспетчеризация: пользователь загружается через request.auser()
+    и подставляется в request.user, чтобы проверки прав и шаблоны не обращались к базе повторно """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        response = super().dispatch(request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            response = await response
+        return response
+
+
+class AsyncHomePageView(AsyncUserMixin, HomePageView):
+    """ Асинхронный контроллер домашней страницы """
+
+    async def get(self, request, *args, **kwargs):
+        context = self.get_context_data(**kwargs)
+        context["user_entries"], context["total_entries"] = await aget_entry_counts(request.user)
+        return self.render_to_response(context)
+
+    def get_context_data(self, **kwargs):
+        # Счетчики загружаются асинхронно в get(), здесь только базовый контекст без обращения к базе
+        return super(HomePageView, self).get_context_data(**kwargs)
+
+
+class AsyncDiaryEntryDetailView(AsyncUserMixin, DiaryEntryDetailView):
+    """ Асинхронный контроллер просмотра записи: запись и настройки дневника
+    загружаются параллельно """
+
+    async def get(self, request, *args, **kwargs):
+        response = await sync_to_async(self.get_not_modified)()
+        if response is not None:
+            return response
+        self.object, _ = await run_parallel(self.get_object, lambda: get_diary_settings(request))
+        # При промахе кеша фрагментов загружаются теги записи
+        context = await sync_to_async(self.get_context_data)(object=self.object)
+        # ETag включает роли пользователя, которые могут загружаться из базы
+        validators = await sync_to_async(self.get_response_validators)()
+        return self.add_validators(self.render_to_response(context), validators)
+
+
+class AsyncDiaryEntryListView(AsyncUserMixin, DiaryEntryListView):
+    """ Асинхронный контроллер списка записей: страница записей (с карточками из кеша фрагментов),
+    облако тегов и валидаторы для ETag загружаются параллельно """
+
+    def load_page(self, queryset):
+        paginator, page, entries, is_paginated = self.paginate_queryset(queryset, self.paginate_by)
+        return paginator, page, self.render_fragments(page), is_paginated
+
+    async def get(self, request, *args, **kwargs):
+        response = await sync_to_async(self.get_not_modified)()
+        if response is not None:
+            return response
+        # Построение queryset может обращаться к базе (ContentType для поиска), поэтому выполняется в потоке
+        self.object_list = await sync_to_async(self.get_queryset)()
+        page_data, tag_cloud, validators = await run_parallel(
+            lambda: self.load_page(self.object_list),
+            lambda: list(get_tag_cloud(request.user)),
+            self.get_response_validators,
+        )
+        paginator, page, entries, is_paginated = page_data
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'object_list': entries,
+            self.get_context_object_name(self.object_list): entries,
+            'tag_cloud': tag_cloud,
+            **self.get_filter_context(),
+        }
+        return self.add_validators(self.render_to_response(context), validators)
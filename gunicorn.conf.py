@@ -0,0 +1,32 @@
+import os
+import shutil
+
+# Метрики Prometheus в многопроцессном режиме: каждый воркер пишет значения в файлы
+# каталога PROMETHEUS_MULTIPROC_DIR, а /metrics собирает их вместе
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+
+# Режим сервера: wsgi - синхронные воркеры, asgi - воркеры uvicorn с асинхронными
+# контроллерами (SERVER_MODE=asgi включает и DIARY_ASYNC_VIEWS в настройках)
+if os.getenv('SERVER_MODE', 'wsgi') == 'asgi':
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'config.wsgi:application'
+    worker_class = 'sync'
+
+
+def on_starting(server):
+    """ Очищает каталог метрик от файлов предыдущего запуска """
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """ Помечает файлы метрик завершившегося воркера (для корректных gauge) """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,172 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .services import invalidate_cached_users
+
+logger = logging.getLogger(__name__)
+
+# Форматы вариантов аватара: WebP для современных браузеров и JPEG как запасной
+AVATAR_FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpeg', 'JPEG', 'image/jpeg'),
+)
+# Время (в секундах), в течение которого обработка того же файла аватара не запускается повторно
+AVATAR_PROCESSING_GUARD_TIMEOUT = 10 * 60
+
+
+def get_avatar_sizes():
+    """ Размеры (сторона квадрата в пикселях) генерируемых вариантов аватара """
+    return tuple(sorted(getattr(settings, 'AVATAR_SIZES', (48, 128, 256))))
+
+
+def _variants_dir():
+    return getattr(settings, 'AVATAR_VARIANTS_DIR', 'avatars/variants')
+
+
+def _open_image(data):
+    """ Открывает изображение с учетом ориентации из EXIF. Метаданные (EXIF, ICC, GPS)
+    в варианты не переносятся: сохраняются только пиксели """
+    image = Image.open(BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    return image
+
+
+def _encode(image, pil_format):
+    """ Кодирует изображение в нужный формат без метаданных """
+    if pil_format == 'JPEG' and image.mode == 'RGBA':
+        # JPEG не поддерживает прозрачность: подкладываем белый фон
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    options = {'quality': getattr(settings, 'AVATAR_QUALITY', 85)}
+    if pil_format == 'JPEG':
+        options.update(optimize=True, progressive=True)
+    else:
+        options['method'] = 6
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
+
+
+def generate_avatar_variants(avatar, user_id):
+    """ Создает квадратные миниатюры аватара во всех размерах и форматах.
+    Файлы лежат в каталоге пользователя, а имена содержат хеш исходного файла, поэтому их можно
+    кешировать навсегда: новый аватар получает новые имена, а одинаковые картинки разных
+    пользователей не делят файлы. Возвращает описание вариантов для User.avatar_variants """
+    avatar.open('rb')
+    try:
+        data = avatar.read()
+    finally:
+        avatar.close()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    image = _open_image(data)
+
+    sizes = {}
+    for size in get_avatar_sizes():
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        sizes[str(size)] = {}
+        for extension, pil_format, _ in AVATAR_FORMATS:
+            name = f'{_variants_dir()}/{user_id}/{digest}_{size}.{extension}'
+            if not default_storage.exists(name):
+                name = default_storage.save(name, ContentFile(_encode(thumbnail, pil_format)))
+            sizes[str(size)][extension] = name
+    return {'source': avatar.name, 'hash': digest, 'sizes': sizes}
+
+
+def variant_names(variants):
+    """ Имена всех файлов вариантов аватара """
+    return [name for formats in (variants or {}).get('sizes', {}).values() for name in formats.values()]
+
+
+def delete_avatar_variants(variants, keep=()):
+    """ Удаляет файлы вариантов аватара (кроме перечисленных в keep) """
+    keep = set(keep)
+    for name in variant_names(variants):
+        if name not in keep:
+            default_storage.delete(name)
+
+
+def process_user_avatar(user_id):
+    """ Обрабатывает текущий аватар пользователя и сохраняет описание вариантов.
+    Старые варианты удаляются после записи новых. Возвращает True, если аватар обработан """
+    from .models import User
+
+    user = User.objects.filter(pk=user_id).only('avatar', 'avatar_variants').first()
+    if user is None or not user.avatar:
+        return False
+    old_variants = user.avatar_variants
+    variants = generate_avatar_variants(user.avatar, user_id)
+    # Файл обработан: тот же файл, загруженный заново, снова можно обрабатывать
+    cache.delete(_processing_key(user_id, user.avatar.name))
+    # update() не вызывает сигналы сохранения; условие по avatar защищает от гонки с новой загрузкой
+    updated = User.objects.filter(pk=user_id, avatar=user.avatar.name).update(avatar_variants=variants)
+    if not updated:
+        # Файлы, которые уже использует сохраненная новая версия (та же картинка), не удаляются
+        current = User.objects.filter(pk=user_id).values_list('avatar_variants', flat=True).first()
+        delete_avatar_variants(variants, keep=variant_names(current))
+        return False
+    invalidate_cached_users([user_id])
+    delete_avatar_variants(old_variants, keep=variant_names(variants))
+    return True
+
+
+def _processing_key(user_id, avatar_name):
+    """ Ключ кеша: обработка этого файла аватара уже запущена """
+    return f'users:avatar-processing:{user_id}:{hashlib.sha256(avatar_name.encode()).hexdigest()[:20]}'
+
+
+def schedule_avatar_processing(user_id, avatar_name):
+    """ Запускает обработку аватара задачей Celery после фиксации транзакции.
+    Повторный запуск для того же файла (несколько сохранений подряд) отбрасывается """
+    transaction.on_commit(lambda: _start_processing(user_id, avatar_name))
+
+
+def _start_processing(user_id, avatar_name):
+    from .tasks import process_avatar
+    if not cache.add(_processing_key(user_id, avatar_name), True, AVATAR_PROCESSING_GUARD_TIMEOUT):
+        return
+    try:
+        process_avatar.delay(user_id)
+    except Exception as e:
+        # Брокер недоступен: обрабатываем аватар сразу, чтобы не отдавать оригинал
+        logger.warning('Не удалось запустить обработку аватара: %s', e)
+        process_user_avatar(user_id)
+
+
+def remove_user_avatar(user):
+    """ Удаляет аватар пользователя вместе со всеми вариантами """
+    delete_avatar_variants(user.avatar_variants)
+    if user.avatar:
+        user.avatar.delete(save=False)
+    user.avatar = None
+    user.avatar_variants = {}
+    user.save(update_fields=['avatar', 'avatar_variants'])
+
+
+def get_avatar_variant(user, size):
+    """ Вариант аватара ближайшего к нужному размера (не меньше его) с адресами во всех форматах.
+    Пока аватар не обработан, возвращает None """
+    sizes = (user.avatar_variants or {}).get('sizes')
+    if not sizes or user.avatar_variants.get('source') != (user.avatar.name if user.avatar else None):
+        return None
+    available = sorted(int(key) for key in sizes)
+    chosen = next((value for value in available if value >= size), available[-1])
+    return {
+        'size': chosen,
+        'formats': [
+            {'url': default_storage.url(sizes[str(chosen)][extension]), 'type': mime}
+            for extension, _, mime in AVATAR_FORMATS
+            if extension in sizes[str(chosen)]
+        ],
+    }
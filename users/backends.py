@@ -0,0 +1,24 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+from .services import get_cached_user
+
+
+class CachedModelBackend(ModelBackend):
+    """ ModelBackend, который загружает пользователя сессии из кеша (см. get_cached_user).
+    Проверка пароля при входе и права пользователя работают как в ModelBackend """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            # Следующий в списке ModelBackend проверил бы тот же пароль второй раз
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        user = get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        return await sync_to_async(self.get_user)(user_id)
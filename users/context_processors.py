@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .services import get_user_roles
+
+
+def roles(request):
+    """ Роли текущего пользователя в шаблонах: {{ user_roles.is_manager }}, {{ user_roles.groups }} """
+    return {'user_roles': SimpleLazyObject(lambda: get_user_roles(request.user))}
@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from users.outbox import get_outbox_metrics, send_pending_emails
+
+
+class Command(BaseCommand):
+    """ Команда для отправки писем из очереди и просмотра метрик доставки """
+    help = 'Отправляет письма из очереди исходящих (--stats: только показать метрики)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stats', action='store_true', help='Показать метрики доставки без отправки')
+        parser.add_argument('--batch-size', type=int, help='Количество писем в одной пачке')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            stats = send_pending_emails(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Отправлено: {stats['sent']}, с ошибкой: {stats['failed']}"))
+        for name, value in get_outbox_metrics().items():
+            self.stdout.write(f'{name}: {value}')
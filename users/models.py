@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.core.validators import RegexValidator, EmailValidator
 from django.db import models
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -50,6 +51,13 @@ class User(AbstractUser):
         null=True,
         help_text='Загрузите свой аватар'
     )
+    # Миниатюры аватара (WebP и JPEG), создаются задачей Celery после загрузки
+    avatar_variants = models.JSONField(
+        verbose_name="Варианты аватара",
+        default=dict,
+        blank=True,
+        editable=False,
+    )
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["display_name"]
@@ -75,6 +83,14 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.display_name} ({self.email})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Имя файла аватара при загрузке из базы: обработка запускается, только если оно изменилось
+        if 'avatar' in field_names:
+            instance._loaded_avatar = values[field_names.index('avatar')] or None
+        return instance
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
@@ -85,4 +101,40 @@ class User(AbstractUser):
 
     @property
     def is_moderator(self) -> bool:
-        return self.groups.filter(name='Менеджер').exists()
+        from .services import get_user_roles
+        return get_user_roles(self).is_manager
+
+
+class OutgoingEmail(models.Model):
+    """ Модель письма в очереди на отправку (исходящие) """
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка отправки'),
+    ]
+
+    subject = models.CharField('Тема', max_length=255)
+    body = models.TextField('Текст письма')
+    from_email = models.CharField('Отправитель', max_length=254, blank=True)
+    to = models.JSONField('Получатели', default=list)
+    status = models.CharField('Статус', max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField('Попыток отправки', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    next_attempt_at = models.DateTimeField('Следующая попытка', default=timezone.now)
+    sent_at = models.DateTimeField('Дата отправки', null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} ({', '.join(self.to)})"
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='users_outbox_status_next_idx'),
+        ]
@@ -0,0 +1,145 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Avg, Count, F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None):
+    """ Ставит письмо в очередь исходящих. Отправка запускается задачей Celery
+    после фиксации транзакции; если брокер недоступен, письмо отправит периодическая задача """
+    email = OutgoingEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        to=list(recipient_list),
+    )
+    if getattr(settings, 'EMAIL_OUTBOX_SEND_ON_COMMIT', True):
+        transaction.on_commit(_schedule_sending)
+    return email
+
+
+def _schedule_sending():
+    from .tasks import send_email_outbox
+    try:
+        send_email_outbox.delay()
+    except Exception as e:
+        logger.warning('Не удалось запустить отправку писем: %s', e)
+
+
+def _retry_delay(attempts):
+    """ Экспоненциальная задержка перед повторной попыткой """
+    return timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', 60) * 2 ** (attempts - 1))
+
+
+def _claim_batch(batch_size):
+    """ Забирает пачку писем в короткой транзакции: строки блокируются с SKIP LOCKED и помечаются
+    как отправляемые до истечения аренды, после чего транзакция завершается и отправка идет без блокировок.
+    Письма воркера, упавшего во время отправки, забираются снова после истечения аренды """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_CLAIM_TIMEOUT', 5 * 60))
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[OutgoingEmail.STATUS_PENDING, OutgoingEmail.STATUS_SENDING],
+                next_attempt_at__lte=now,
+            )
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        for email in emails:
+            email.status = OutgoingEmail.STATUS_SENDING
+            email.attempts += 1
+            email.next_attempt_at = now + lease
+        OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at'])
+    return emails
+
+
+def _release_batch(emails, error):
+    """ Возвращает забранные письма в очередь без учета попытки: письма не отправлялись,
+    потому что не удалось открыть соединение с почтовым сервером """
+    for email in emails:
+        email.status = OutgoingEmail.STATUS_PENDING
+        email.attempts -= 1
+        email.next_attempt_at = timezone.now()
+        email.last_error = str(error)
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+
+
+def _send_batch(emails, connection):
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    sent = failed = 0
+    for email in emails:
+        try:
+            EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection).send()
+        except Exception as e:
+            email.last_error = str(e)
+            if email.attempts >= max_attempts:
+                email.status = OutgoingEmail.STATUS_FAILED
+                failed += 1
+            else:
+                email.status = OutgoingEmail.STATUS_PENDING
+                email.next_attempt_at = timezone.now() + _retry_delay(email.attempts)
+        else:
+            email.status = OutgoingEmail.STATUS_SENT
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            sent += 1
+    OutgoingEmail.objects.bulk_update(emails, ['status', 'last_error', 'next_attempt_at', 'sent_at'])
+    return sent, failed
+
+
+def send_pending_emails(batch_size=None):
+    """ Отправляет письма из очереди пачками через одно соединение с почтовым сервером.
+    Соединение открывается только при первой непустой пачке, письма отправляются вне транзакции
+    (см. _claim_batch), поэтому несколько воркеров не отправят письмо дважды и не держат блокировки.
+    Если соединение не открылось, пачка возвращается в очередь без учета попытки, а ошибка
+    пробрасывается, чтобы задача повторилась с задержкой.
+    Возвращает словарь с количеством отправленных и окончательно не отправленных писем """
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    stats = {'sent': 0, 'failed': 0}
+    connection = None
+    try:
+        while True:
+            emails = _claim_batch(batch_size)
+            if not emails:
+                break
+            if connection is None:
+                try:
+                    connection = get_connection()
+                    connection.open()
+                except Exception as e:
+                    connection = None
+                    _release_batch(emails, e)
+                    raise
+            sent, failed = _send_batch(emails, connection)
+            stats['sent'] += sent
+            stats['failed'] += failed
+            if len(emails) < batch_size:
+                break
+    finally:
+        if connection is not None:
+            connection.close()
+    return stats
+
+
+def get_outbox_metrics():
+    """ Метрики доставки: количество писем по статусам, среднее число попыток и время доставки """
+    metrics = {status: 0 for status, label in OutgoingEmail.STATUS_CHOICES}
+    for row in OutgoingEmail.objects.values('status').annotate(count=Count('id')).order_by():
+        metrics[row['status']] = row['count']
+    delivered = OutgoingEmail.objects.filter(status=OutgoingEmail.STATUS_SENT).aggregate(
+        avg_attempts=Avg('attempts'),
+        avg_delivery_time=Avg(F('sent_at') - F('created_at')),
+    )
+    metrics['avg_attempts'] = delivered['avg_attempts'] or 0
+    avg_delivery_time = delivered['avg_delivery_time']
+    metrics['avg_delivery_seconds'] = avg_delivery_time.total_seconds() if avg_delivery_time else 0
+    return metrics
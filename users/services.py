@@ -0,0 +1,129 @@
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import transaction
+
+MANAGER_GROUP_NAME = 'Менеджер'
+MANAGER_GROUP_CACHE_KEY = 'users:manager_group_id'
+# Версии кеша ролей: общая (меняется при изменении групп и их прав) и у каждого пользователя
+ROLES_VERSION_KEY = 'users:roles_version'
+USER_ROLES_VERSION_KEY = 'users:roles_version:{user_id}'
+
+
+def get_manager_group_id():
+    """ Id группы менеджеров. Ищется по названию и хранится в кеше USER_ROLES_CACHE_TIMEOUT секунд
+    (0 в кеше означает, что группы нет); кеш сбрасывается при изменении групп. Без общего кеша
+    (USER_ROLES_CACHE_TIMEOUT равен 0) сброс не дошел бы до других воркеров, поэтому id ищется каждый раз """
+    timeout = getattr(settings, 'USER_ROLES_CACHE_TIMEOUT', 60 * 60)
+    group_id = cache.get(MANAGER_GROUP_CACHE_KEY) if timeout else None
+    if group_id is None:
+        group_id = Group.objects.filter(name=MANAGER_GROUP_NAME).values_list('pk', flat=True).first() or 0
+        if timeout:
+            cache.set(MANAGER_GROUP_CACHE_KEY, group_id, timeout)
+    return group_id or None
+
+
+def invalidate_manager_group():
+    cache.delete(MANAGER_GROUP_CACHE_KEY)
+
+
+class UserRoles:
+    """ Группы и права пользователя, загруженные один раз """
+
+    def __init__(self, groups=(), permissions=()):
+        self.groups = frozenset(groups)
+        self.permissions = frozenset(permissions)
+
+    @property
+    def is_manager(self):
+        return MANAGER_GROUP_NAME in self.groups
+
+    def in_group(self, name):
+        return name in self.groups
+
+    def has_perm(self, perm):
+        return perm in self.permissions
+
+
+def get_user_roles(user):
+    """ Роли пользователя. В пределах запроса запоминаются на объекте пользователя,
+    между запросами (если USER_ROLES_CACHE_TIMEOUT не 0) хранятся в кеше под ключом с версией,
+    которая меняется при изменении состава групп пользователя, его прав или прав групп """
+    if not user.is_authenticated:
+        return UserRoles()
+    roles = getattr(user, '_roles_cache', None)
+    if roles is not None:
+        return roles
+
+    timeout = getattr(settings, 'USER_ROLES_CACHE_TIMEOUT', 60 * 60)
+    data = _get_cached_roles(user, timeout) if timeout else _load_roles(user)
+    roles = UserRoles(data['groups'], data['permissions'])
+    user._roles_cache = roles
+    # ModelBackend берет права из _perm_cache, поэтому has_perm и {{ perms }} тоже не ходят в базу
+    user._perm_cache = set(roles.permissions)
+    return roles
+
+
+def _load_roles(user):
+    return {
+        'groups': list(user.groups.values_list('name', flat=True)),
+        'permissions': list(user.get_all_permissions()),
+    }
+
+
+def _get_cached_roles(user, timeout):
+    user_version_key = USER_ROLES_VERSION_KEY.format(user_id=user.pk)
+    versions = cache.get_many([ROLES_VERSION_KEY, user_version_key])
+    for key in (ROLES_VERSION_KEY, user_version_key):
+        if key not in versions:
+            versions[key] = uuid4().hex
+            if not cache.add(key, versions[key], None):
+                versions[key] = cache.get(key)
+    key = f'users:roles:{user.pk}:{versions[ROLES_VERSION_KEY]}:{versions[user_version_key]}'
+
+    data = cache.get(key)
+    if data is None:
+        data = _load_roles(user)
+        cache.set(key, data, timeout)
+    return data
+
+
+def invalidate_user_roles(user_ids=None):
+    """ Сбрасывает кеш ролей указанных пользователей (без аргумента — всех пользователей) """
+    if user_ids is None:
+        cache.set(ROLES_VERSION_KEY, uuid4().hex, None)
+        return
+    cache.set_many({USER_ROLES_VERSION_KEY.format(user_id=user_id): uuid4().hex for user_id in user_ids}, None)
+
+
+def user_cache_key(user_id):
+    return f'users:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """ Пользователь по id для AuthenticationMiddleware. Строка таблицы пользователей хранится
+    в кеше USER_CACHE_TIMEOUT секунд и сбрасывается при сохранении пользователя (профиль,
+    смена пароля, блокировка), поэтому запрос страницы не обращается к users_user """
+    user_model = get_user_model()
+    timeout = getattr(settings, 'USER_CACHE_TIMEOUT', 5 * 60)
+    if not timeout:
+        return user_model._default_manager.filter(pk=user_id).first()
+
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = user_model._default_manager.filter(pk=user_id).first()
+        if user is not None:
+            cache.set(key, user, timeout)
+    return user
+
+
+def invalidate_cached_users(user_ids):
+    """ Сбрасывает кешированные строки пользователей. Ключи удаляются сразу и еще раз после
+    фиксации транзакции: запрос, прочитавший строку до фиксации, мог положить ее в кеш """
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
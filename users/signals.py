@@ -0,0 +1,76 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .avatars import delete_avatar_variants, schedule_avatar_processing
+from .models import User
+from .services import invalidate_cached_users, invalidate_manager_group, invalidate_user_roles
+
+# Аватар экземпляра, созданного не загрузкой из базы, неизвестен и считается измененным
+_NOT_LOADED = object()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    """ Сбрасывает кешированный id группы менеджеров и роли при изменении групп """
+    invalidate_manager_group()
+    invalidate_user_roles()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Сбрасывает кеш ролей при изменении групп или прав пользователя """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_user_roles([instance.pk])
+    elif pk_set:
+        invalidate_user_roles(pk_set)
+    else:
+        # Группа очищена со своей стороны: затронутые пользователи неизвестны
+        invalidate_user_roles()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    """ Сбрасывает кеш ролей всех пользователей при изменении прав групп """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_user_roles()
+
+
+@receiver(post_save, sender=User)
+def user_avatar_changed(sender, instance, update_fields=None, **kwargs):
+    """ Запускает обработку нового аватара и удаляет варианты убранного.
+    Сохранения, не изменившие поле avatar (вход, правка профиля), ничего не запускают """
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    avatar_name = instance.avatar.name or None
+    if getattr(instance, '_loaded_avatar', _NOT_LOADED) == avatar_name:
+        return
+    instance._loaded_avatar = avatar_name
+
+    variants = instance.avatar_variants or {}
+    if instance.avatar:
+        if variants.get('source') != avatar_name:
+            schedule_avatar_processing(instance.pk, avatar_name)
+    elif variants:
+        delete_avatar_variants(variants)
+        User.objects.filter(pk=instance.pk).update(avatar_variants={})
+        instance.avatar_variants = {}
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    """ Удаляет файлы аватара удаленного пользователя """
+    delete_avatar_variants(instance.avatar_variants)
+    if instance.avatar:
+        instance.avatar.delete(save=False)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """ Сбрасывает кешированную строку пользователя (профиль, пароль, блокировка, удаление) """
+    invalidate_cached_users([instance.pk])
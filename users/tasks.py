@@ -0,0 +1,17 @@
+from celery import shared_task
+
+from .avatars import process_user_avatar
+from .outbox import send_pending_emails
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=5)
+def send_email_outbox():
+    """ Задача для отправки писем из очереди исходящих.
+    Если почтовый сервер недоступен, задача повторяется с растущей задержкой """
+    return send_pending_emails()
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def process_avatar(user_id):
+    """ Задача для создания миниатюр аватара без метаданных """
+    return process_user_avatar(user_id)
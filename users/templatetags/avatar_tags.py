@@ -0,0 +1,19 @@
+from django import template
+
+from users.avatars import get_avatar_variant
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/avatar.html')
+def avatar(user, size=48, css_class='rounded-circle'):
+    """ Аватар пользователя: миниатюра нужного размера в WebP с запасным JPEG.
+    Оригинальный файл не отдается; пока миниатюры не готовы, показывается значок """
+    variant = get_avatar_variant(user, size) if user.is_authenticated else None
+    return {
+        'sources': variant['formats'][:-1] if variant else [],
+        'fallback': variant['formats'][-1] if variant else None,
+        'size': size,
+        'css_class': css_class,
+        'alt': getattr(user, 'display_name', ''),
+    }
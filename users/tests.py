@@ -1 +1,384 @@
-# Create your tests here.
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+
+from diary.tests import SHARED_CACHE_SETTINGS, QueryBudgetMixin
+from .avatars import get_avatar_variant, process_user_avatar, schedule_avatar_processing
+from .models import OutgoingEmail, User
+from .outbox import enqueue_email, send_pending_emails
+from .services import (
+    MANAGER_GROUP_CACHE_KEY, MANAGER_GROUP_NAME, get_manager_group_id, get_user_roles, user_cache_key,
+)
+
+
+class UserListViewTestCase(QueryBudgetMixin, TestCase):
+    """ Список пользователей: постраничный вывод и роль в одном запросе """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.managers = Group.objects.create(name=MANAGER_GROUP_NAME)
+        cls.admin = User.objects.create(email='admin@example.com', display_name='Админ', is_superuser=True)
+        for number in range(30):
+            user = User.objects.create(email=f'user{number:02}@example.com', display_name=f'Пользователь {number}')
+            if number % 3 == 0:
+                user.groups.add(cls.managers)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def test_user_list_query_budget(self):
+        self.client.get(reverse('users:home'))  # id группы менеджеров попадает в кеш
+        # сессия, пользователь, COUNT(*) и страница пользователей
+        with self.assertQueryBudget(4):
+            response = self.client.get(reverse('users:home'))
+        self.assertEqual(len(response.context['users']), 20)
+        managers = {user.email for user in response.context['users'] if user.is_manager}
+        self.assertIn('user00@example.com', managers)
+        self.assertNotIn('user01@example.com', managers)
+
+    def test_user_list_search(self):
+        response = self.client.get(reverse('users:home'), {'q': 'Пользователь 2'})
+        self.assertEqual(
+            [user.email for user in response.context['users']],
+            ['user02@example.com', 'user20@example.com', 'user21@example.com', 'user22@example.com',
+             'user23@example.com', 'user24@example.com', 'user25@example.com', 'user26@example.com',
+             'user27@example.com', 'user28@example.com', 'user29@example.com'],
+        )
+
+    def test_manager_has_access(self):
+        manager = User.objects.get(email='user03@example.com')
+        self.client.force_login(manager)
+        response = self.client.get(reverse('users:home'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_regular_user_redirected(self):
+        self.client.force_login(User.objects.get(email='user01@example.com'))
+        response = self.client.get(reverse('users:home'))
+        self.assertRedirects(response, reverse('diary:home'))
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class UserRolesTestCase(QueryBudgetMixin, TestCase):
+    """ Кеширование групп и прав пользователя """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.managers = Group.objects.create(name=MANAGER_GROUP_NAME)
+        cls.user = User.objects.create(email='role@example.com', display_name='Роль')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_roles_loaded_once_per_request(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertQueryBudget(3):  # группы, права пользователя и права групп
+            self.assertFalse(user.is_moderator)
+            self.assertFalse(user.is_moderator)
+            self.assertFalse(user.has_perm('users.can_inactivate'))
+
+    def test_roles_cached_between_requests(self):
+        get_user_roles(self.fresh_user())
+        user = self.fresh_user()
+        with self.assertQueryBudget(0):
+            self.assertFalse(get_user_roles(user).is_manager)
+
+    @override_settings(USER_ROLES_CACHE_TIMEOUT=0)
+    def test_roles_not_cached_without_timeout(self):
+        # Без общего кеша роли запоминаются только в пределах запроса
+        get_user_roles(self.fresh_user())
+        self.user.groups.add(self.managers)
+        user = self.fresh_user()
+        with self.assertQueryBudget(3):
+            self.assertTrue(user.is_moderator)
+            self.assertTrue(user.is_moderator)
+
+    @override_settings(USER_ROLES_CACHE_TIMEOUT=0)
+    def test_manager_group_id_not_cached_without_timeout(self):
+        # Без общего кеша id группы не кешируется: сброс в одном воркере не дошел бы до остальных
+        self.assertEqual(get_manager_group_id(), self.managers.pk)
+        self.assertIsNone(cache.get(MANAGER_GROUP_CACHE_KEY))
+        self.managers.delete()
+        self.assertIsNone(get_manager_group_id())
+
+    def test_manager_group_id_cached(self):
+        self.assertEqual(get_manager_group_id(), self.managers.pk)
+        with self.assertQueryBudget(0):
+            self.assertEqual(get_manager_group_id(), self.managers.pk)
+
+    def test_group_change_invalidates_roles(self):
+        get_user_roles(self.fresh_user())
+        self.user.groups.add(self.managers)
+        self.assertTrue(self.fresh_user().is_moderator)
+        self.managers.custom_user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().is_moderator)
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db', **SHARED_CACHE_SETTINGS)
+class CachedSessionUserTestCase(TestCase):
+    """ Сессия и пользователь сессии из кеша, сброс кеша при изменении пользователя """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(email='session@example.com', display_name='Сессия')
+        cls.user.set_password('old-password-123')
+        cls.user.save()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def auth_queries(self):
+        """ SQL-запросы страницы профиля к таблицам сессий и пользователей """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('users:profile'))
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in context.captured_queries
+                if '"django_session"' in query['sql'] or '"users_user"' in query['sql']]
+
+    def test_session_and_user_from_cache(self):
+        self.assertEqual(len(self.auth_queries()), 1)  # пользователь попадает в кеш
+        self.assertEqual(self.auth_queries(), [])
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+    @override_settings(USER_CACHE_TIMEOUT=0)
+    def test_user_not_cached_without_timeout(self):
+        # Без общего кеша (REDIS_URL не задан) пользователь загружается из базы при каждом запросе
+        self.assertEqual(len(self.auth_queries()), 1)
+        self.assertEqual(len(self.auth_queries()), 1)
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+
+    def test_profile_update_invalidates_user(self):
+        self.auth_queries()
+        self.client.post(reverse('users:profile'), {'display_name': 'Новое имя', 'email': self.user.email})
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        response = self.client.get(reverse('users:profile'))
+        self.assertEqual(response.context['user'].display_name, 'Новое имя')
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.auth_queries()
+        other = self.client_class()
+        other.force_login(self.user)
+        self.client.post(reverse('users:password_change'), {
+            'old_password': 'old-password-123',
+            'new_password1': 'new-password-456',
+            'new_password2': 'new-password-456',
+        })
+        # текущая сессия обновлена, сессия со старым хешем пароля больше не действует
+        self.assertEqual(self.client.get(reverse('users:profile')).status_code, 200)
+        self.assertEqual(other.get(reverse('users:profile')).status_code, 302)
+
+    def test_session_of_default_backend_stays_logged_in(self):
+        # Сессии, созданные до CachedModelBackend, хранят путь ModelBackend
+        other = self.client_class()
+        other.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(other.get(reverse('users:profile')).status_code, 200)
+
+    def test_wrong_password_checked_once(self):
+        with mock.patch.object(User, 'check_password', return_value=False) as check:
+            self.assertFalse(self.client_class().login(email=self.user.email, password='wrong-password'))
+        # пароль проверен только CachedModelBackend, ModelBackend после него не вызывается
+        self.assertEqual(check.call_count, 1)
+
+    def test_deactivation_logs_out(self):
+        self.auth_queries()
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(reverse('users:profile')).status_code, 302)
+
+
+class EmailOutboxTestCase(TestCase):
+    """ Очередь исходящих писем (в тестах используется locmem-бэкенд почты) """
+
+    def test_registration_queues_email(self):
+        response = self.client.post(reverse('users:register'), {
+            'email': 'new@example.com',
+            'display_name': 'Новичок',
+            'password1': 'Sup3r-secret-pass',
+            'password2': 'Sup3r-secret-pass',
+        })
+        self.assertRedirects(response, reverse('users:login'))
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.to, ['new@example.com'])
+        self.assertIn('/users/email-confirm/', email.body)
+
+    def test_pending_emails_sent_in_batches(self):
+        for number in range(5):
+            enqueue_email('Тема', 'Текст', [f'user{number}@example.com'], from_email='noreply@example.com')
+        stats = send_pending_emails(batch_size=2)
+        self.assertEqual(stats, {'sent': 5, 'failed': 0})
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.STATUS_SENT).exists())
+
+    def test_failed_email_retried_with_backoff(self):
+        email = enqueue_email('Тема', 'Текст', ['user@example.com'], from_email='noreply@example.com')
+        with mock.patch('users.outbox.EmailMessage.send', side_effect=OSError('SMTP недоступен')):
+            stats = send_pending_emails()
+        self.assertEqual(stats, {'sent': 0, 'failed': 0})
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.STATUS_PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # До наступления следующей попытки письмо не отправляется повторно
+        self.assertEqual(send_pending_emails(), {'sent': 0, 'failed': 0})
+
+    def test_connection_failure_does_not_count_attempt(self):
+        email = enqueue_email('Тема', 'Текст', ['user@example.com'], from_email='noreply@example.com')
+        with mock.patch('users.outbox.get_connection') as get_connection:
+            get_connection.return_value.open.side_effect = OSError('SMTP недоступен')
+            with self.assertRaises(OSError):
+                send_pending_emails()
+        email.refresh_from_db()
+        # письмо сразу доступно для повтора задачи и не застревает в статусе отправки
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_PENDING, 0))
+        self.assertLessEqual(email.next_attempt_at, timezone.now())
+        self.assertEqual(send_pending_emails(), {'sent': 1, 'failed': 0})
+
+    def test_empty_outbox_does_not_connect(self):
+        with mock.patch('users.outbox.get_connection') as get_connection:
+            self.assertEqual(send_pending_emails(), {'sent': 0, 'failed': 0})
+        get_connection.assert_not_called()
+
+    def test_emails_claimed_before_sending(self):
+        email = enqueue_email('Тема', 'Текст', ['user@example.com'], from_email='noreply@example.com')
+        statuses = []
+
+        def send(message):
+            # во время отправки строка уже помечена и не заблокирована транзакцией выборки
+            statuses.append(OutgoingEmail.objects.values_list('status', 'attempts').get(pk=email.pk))
+            return 1
+
+        with mock.patch('users.outbox.EmailMessage.send', autospec=True, side_effect=send):
+            self.assertEqual(send_pending_emails(), {'sent': 1, 'failed': 0})
+        self.assertEqual(statuses, [(OutgoingEmail.STATUS_SENDING, 1)])
+        # второй воркер не забирает письмо, пока не истекла аренда
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            status=OutgoingEmail.STATUS_SENDING, next_attempt_at=timezone.now() + timedelta(minutes=5),
+        )
+        self.assertEqual(send_pending_emails(), {'sent': 0, 'failed': 0})
+
+    def test_stale_claim_is_retried(self):
+        email = enqueue_email('Тема', 'Текст', ['user@example.com'], from_email='noreply@example.com')
+        # воркер забрал письмо и упал: после истечения аренды письмо отправляется снова
+        OutgoingEmail.objects.filter(pk=email.pk).update(
+            status=OutgoingEmail.STATUS_SENDING, attempts=1, next_attempt_at=timezone.now() - timedelta(seconds=1),
+        )
+        self.assertEqual(send_pending_emails(), {'sent': 1, 'failed': 0})
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_SENT, 2))
+
+
+class AvatarPipelineTestCase(TestCase):
+    """ Обработка аватаров: миниатюры без метаданных и удаление всех вариантов """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root, AVATAR_SIZES=(48, 128))
+        self.override.enable()
+        self.user = User.objects.create(email='face@example.com', display_name='Лицо')
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def upload_avatar(self, user=None):
+        user = user or self.user
+        image = Image.new('RGB', (400, 300), (200, 50, 50))
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'  # производитель камеры
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        with self.captureOnCommitCallbacks() as callbacks:
+            user.avatar = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+            user.save()
+        # обработка запускается после фиксации транзакции (второй обработчик сбрасывает кеш пользователя)
+        self.assertEqual(len(callbacks), 2)
+        self.assertTrue(process_user_avatar(user.pk))
+        user.refresh_from_db()
+
+    def test_variants_generated_without_metadata(self):
+        self.upload_avatar()
+        sizes = self.user.avatar_variants['sizes']
+        self.assertEqual(set(sizes), {'48', '128'})
+        for size, formats in sizes.items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            for name in formats.values():
+                self.assertIn(self.user.avatar_variants['hash'], name)
+                with default_storage.open(name) as file:
+                    image = Image.open(file)
+                    self.assertEqual(image.size, (int(size), int(size)))
+                    self.assertFalse(image.getexif())
+
+    def test_template_gets_nearest_variant(self):
+        self.upload_avatar()
+        variant = get_avatar_variant(self.user, 100)
+        self.assertEqual(variant['size'], 128)
+        self.assertEqual([item['type'] for item in variant['formats']], ['image/webp', 'image/jpeg'])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('users:profile'))
+        self.assertContains(response, variant['formats'][0]['url'])
+        self.assertNotContains(response, self.user.avatar.url)
+
+    def test_processing_scheduled_once_per_upload(self):
+        cache.clear()
+        with mock.patch('users.tasks.process_avatar.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.avatar = SimpleUploadedFile('face.jpg', b'not-an-image', content_type='image/jpeg')
+                self.user.save()
+                # повторное сохранение того же экземпляра (как в ProfileUpdateView) не запускает обработку
+                self.user.display_name = 'Новое имя'
+                self.user.save()
+                # повторный запуск для того же файла отбрасывается
+                schedule_avatar_processing(self.user.pk, self.user.avatar.name)
+            user = User.objects.get(pk=self.user.pk)
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                user.last_login = timezone.now()
+                user.save(update_fields=['last_login'])
+                user.display_name = 'Еще одно имя'
+                user.save()
+        delay.assert_called_once_with(self.user.pk)
+        self.assertEqual(len(callbacks), 2)  # только сброс кеша пользователя
+
+    def test_remove_avatar_deletes_all_variants(self):
+        self.upload_avatar()
+        names = [name for formats in self.user.avatar_variants['sizes'].values() for name in formats.values()]
+        original = self.user.avatar.name
+        self.client.force_login(self.user)
+        self.client.post(reverse('users:avatar_remove'))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+        self.assertEqual(self.user.avatar_variants, {})
+        for name in names + [original]:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_same_image_of_other_user_survives_removal(self):
+        other = User.objects.create(email='twin@example.com', display_name='Двойник')
+        self.upload_avatar()
+        self.upload_avatar(other)
+        self.assertEqual(self.user.avatar_variants['hash'], other.avatar_variants['hash'])
+        self.client.force_login(self.user)
+        self.client.post(reverse('users:avatar_remove'))
+        # у каждого пользователя свои файлы вариантов, удаление одного аватара не задевает другой
+        for formats in other.avatar_variants['sizes'].values():
+            for name in formats.values():
+                self.assertTrue(default_storage.exists(name))
@@ -6,7 +6,7 @@ from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.core.mail import send_mail
+from django.db.models import Exists, OuterRef, Q, Value
 from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
@@ -17,8 +17,11 @@ from django.views.generic.edit import CreateView, DeleteView
 
 from config.settings import EMAIL_HOST_USER
 from users.forms import UserRegisterForm
+from .avatars import remove_user_avatar
 from .forms import ProfileUpdateForm
 from .models import User
+from .outbox import enqueue_email
+from .services import get_manager_group_id, get_user_roles
 
 
 def logout_view(request):
@@ -29,23 +32,40 @@ def logout_view(request):
 class UserListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
     """ Список всех пользователей приложения (доступен менеджерам и суперюзеру) """
     model = User
-    template_name = "user_list.html"
+    template_name = "users/user_list.html"
     context_object_name = "users"
+    paginate_by = 20
 
     def test_func(self):
         """ Проверяет, является ли пользователь менеджером или суперюзером """
-        return self.request.user.is_superuser or self.request.user.groups.filter(name="Менеджер").exists()
+        user = self.request.user
+        return user.is_superuser or get_user_roles(user).is_manager
 
     def handle_no_permission(self):
         """ Обработка случая, когда у пользователя нет прав """
-        from django.shortcuts import redirect
-        return redirect('home')  # Перенаправляем на главную страницу
+        return redirect('diary:home')  # Перенаправляем на главную страницу
+
+    def get_queryset(self):
+        # Принадлежность к группе менеджеров вычисляется в том же запросе через EXISTS
+        manager_group_id = get_manager_group_id()
+        if manager_group_id:
+            is_manager = Exists(
+                User.groups.through.objects.filter(user_id=OuterRef('pk'), group_id=manager_group_id)
+            )
+        else:
+            is_manager = Value(False)
+        queryset = User.objects.annotate(is_manager=is_manager)
+
+        # Поиск по email и имени
+        search_query = self.request.GET.get('q', '').strip()
+        if search_query:
+            queryset = queryset.filter(Q(email__icontains=search_query) | Q(display_name__icontains=search_query))
+
+        return queryset.order_by('email', 'pk')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Получаем всех пользователей и добавляем информацию о принадлежности к группе
-        for user in context['users']:
-            user.is_manager = user.groups.filter(name="Менеджер").exists()
+        context['search_query'] = self.request.GET.get('q', '')
         return context
 
 
@@ -64,16 +84,14 @@ class UserCreateView(CreateView):
         user.save()
         host = self.request.get_host()  # получаем хост, откуда пришел пользователь
         url = f'http://{host}/users/email-confirm/{token}/'
-        try:
-            send_mail(
-                subject="Подтверждение почты",
-                message=f"""Спасибо, что зарегистрировались в нашем сервисе!
-                Для подтверждения регистрации перейдите по ссылке {url}""",
-                from_email=EMAIL_HOST_USER,
-                recipient_list=[user.email]
-            )
-        except Exception as e:
-            print(f'Error sending email: {e}')
+        # Письмо ставится в очередь исходящих и отправляется в фоне задачей Celery
+        enqueue_email(
+            subject="Подтверждение почты",
+            message=f"""Спасибо, что зарегистрировались в нашем сервисе!
+            Для подтверждения регистрации перейдите по ссылке {url}""",
+            from_email=EMAIL_HOST_USER,
+            recipient_list=[user.email]
+        )
         return super().form_valid(form)
 
 
@@ -162,9 +180,7 @@ class DeleteAccountView(LoginRequiredMixin, DeleteView):
 def remove_avatar(request):
     """ Функция для удаления аватара """
     user = request.user
-    if user.avatar:
-        user.avatar.delete()
-        user.avatar = None  # Очищаем ссылку на файл
-        user.save()
+    if user.avatar or user.avatar_variants:
+        remove_user_avatar(user)  # удаляет оригинал и все миниатюры
         messages.success(request, 'Аватар успешно удален!')
     return redirect('users:profile')